@@ -1,3 +1,5 @@
 """
 Aston
-""" 
+"""
+
+__version__ = '0.7.0'
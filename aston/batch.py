@@ -0,0 +1,267 @@
+"""
+Headless peak finding and integration for whole directories of runs.
+
+Every data file found under a directory is handed to a pool of worker
+processes, which read the file, pull out the requested traces, and
+find and integrate the peaks in them. The peak tables come back as
+plain rows and are written to either an SQLite database or a CSV file.
+
+Both outputs remember which files have already been processed (and
+their size and modification time), so an interrupted run picks up
+where it left off and only changed files are redone.
+"""
+from __future__ import print_function
+import csv
+import os
+import os.path as op
+import sqlite3
+import sys
+import time
+import traceback
+import aston.peaks.PeakFinding as ampf
+import aston.peaks.Integrators as ami
+
+PEAK_FINDERS = {'simple': ampf.simple_peak_find,
+                'statslope': ampf.stat_slope_peak_find,
+                'wavelet': ampf.wavelet_peak_find}
+
+INTEGRATORS = {'simple': ami.simple_integrate,
+               'drop': ami.drop_integrate,
+               'constant': ami.constant_bl_integrate,
+               'periodic': ami.periodic_integrate}
+
+PEAK_COLUMNS = ('path', 'trace', 'peak', 'time', 't0', 't1', \
+                'height', 'width', 'area')
+
+
+def _stamp(filename):
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime
+
+
+def process_file(filename, traces=('tic',), peak_finder='simple', \
+                 integrator='drop', pf_opts=None, int_opts=None):
+    """
+    Finds and integrates the peaks in the given traces of one file.
+
+    Returns
+    -------
+    list of tuple
+        One row for each peak, with the fields in PEAK_COLUMNS.
+    """
+    from aston.tracefile.TraceFile import TraceFile
+    pf_f, int_f = PEAK_FINDERS[peak_finder], INTEGRATORS[integrator]
+
+    tf = TraceFile(filename)
+    rows = []
+    for name in traces:
+        ts = tf.trace(name)
+        if ts is None or len(ts) < 2:
+            continue
+        found = ampf.find_peaks([ts], pf_f, pf_opts or {})
+        if len(found[0]) == 0:
+            continue
+        pks = ami.integrate_peaks([ts], found, int_f, int_opts or {})
+        for n, pk in enumerate(sorted(pks, key=lambda p: p.time())):
+            info = pk.components[0].info
+            rows.append((filename, name, n, pk.time(), info.get('t0'), \
+                         info.get('t1'), pk.height(), pk.width(), \
+                         pk.area()))
+    return rows
+
+
+def _process_task(task):
+    # run in the worker processes; never raise so one bad
+    # file doesn't take down the whole batch
+    filename, opts = task
+    t = time.time()
+    try:
+        rows, error = process_file(filename, **opts), None
+    except Exception:
+        rows, error = [], traceback.format_exc()
+    return filename, rows, error, time.time() - t
+
+
+class SQLiteResults(object):
+    """
+    Stores peak tables in the batch_files and batch_peaks tables of
+    an SQLite database (which can be the same one Aston uses).
+    """
+    def __init__(self, filename, restart=False):
+        self.db = sqlite3.connect(filename)
+        if restart:
+            self.db.execute('DROP TABLE IF EXISTS batch_files')
+            self.db.execute('DROP TABLE IF EXISTS batch_peaks')
+        self.db.execute('CREATE TABLE IF NOT EXISTS batch_files ('
+                        'path TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+                        'npeaks INTEGER, secs REAL, error TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS batch_peaks ('
+                        'path TEXT, trace TEXT, peak INTEGER, time REAL, '
+                        't0 REAL, t1 REAL, height REAL, width REAL, '
+                        'area REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS batch_peaks_path '
+                        'ON batch_peaks (path)')
+        self.db.commit()
+
+    def done(self):
+        """
+        The size and modification time of every file processed
+        without an error.
+        """
+        q = 'SELECT path, size, mtime FROM batch_files WHERE error IS NULL'
+        return {p: (s, m) for p, s, m in self.db.execute(q)}
+
+    def add(self, filename, stamp, rows, error, secs):
+        self.db.execute('DELETE FROM batch_peaks WHERE path = ?', \
+                        (filename,))
+        self.db.executemany('INSERT INTO batch_peaks VALUES ' + \
+                            '(?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.db.execute('INSERT OR REPLACE INTO batch_files VALUES ' + \
+                        '(?, ?, ?, ?, ?, ?)', (filename, stamp[0], \
+                        stamp[1], len(rows), secs, error))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class CSVResults(object):
+    """
+    Appends peak tables to a CSV file; the files that have been
+    processed are listed in a second file next to it (*.done).
+    """
+    def __init__(self, filename, restart=False):
+        self.done_filename = filename + '.done'
+        if restart:
+            for fn in (filename, self.done_filename):
+                if op.exists(fn):
+                    os.remove(fn)
+        new = not op.exists(filename)
+        self.f = open(filename, 'a')
+        self.writer = csv.writer(self.f)
+        if new:
+            self.writer.writerow(PEAK_COLUMNS)
+        self.done_f = open(self.done_filename, 'a')
+
+    def done(self):
+        done = {}
+        with open(self.done_filename) as f:
+            for line in f:
+                path, size, mtime = line.rstrip('\n').rsplit('\t', 2)
+                done[path] = (int(size), float(mtime))
+        return done
+
+    def add(self, filename, stamp, rows, error, secs):
+        if error is not None:
+            # don't mark it done, so it's retried next time
+            return
+        self.writer.writerows(rows)
+        self.f.flush()
+        self.done_f.write('{}\t{}\t{!r}\n'.format(filename, *stamp))
+        self.done_f.flush()
+
+    def close(self):
+        self.f.close()
+        self.done_f.close()
+
+
+def open_results(filename, restart=False):
+    """
+    Opens the right kind of output for filename (a CSV file if it
+    ends in .csv and an SQLite database otherwise).
+    """
+    if filename.lower().endswith('.csv'):
+        return CSVResults(filename, restart)
+    return SQLiteResults(filename, restart)
+
+
+def process_directory(path, output, traces=('tic',), peak_finder='simple', \
+                      integrator='drop', pf_opts=None, int_opts=None, \
+                      processes=None, restart=False, log=sys.stderr):
+    """
+    Finds and integrates the peaks in every data file under path and
+    writes the peak tables to output.
+
+    Parameters
+    ----------
+    path : str
+    output : str
+        An SQLite database or a *.csv file.
+    traces : list of str, optional
+        Names of the traces to integrate in each file.
+    peak_finder, integrator : str, optional
+        Keys of PEAK_FINDERS and INTEGRATORS.
+    pf_opts, int_opts : dict, optional
+        Extra arguments for the peak finder and integrator.
+    processes : int, optional
+        Number of worker processes (1 runs everything in this one).
+    restart : bool, optional
+        Throw out previous results instead of resuming.
+    log : file, optional
+        Where progress is written (None to be quiet).
+
+    Returns
+    -------
+    dict
+        Summary of what was done.
+    """
+    from aston.database.Create import walk_directory
+    from aston.peaks.Workers import worker_pool
+    if peak_finder not in PEAK_FINDERS:
+        raise ValueError('Unknown peak finder: ' + peak_finder)
+    if integrator not in INTEGRATORS:
+        raise ValueError('Unknown integrator: ' + integrator)
+    if not op.isdir(path):
+        raise IOError('No such directory: ' + path)
+
+    t_start = time.time()
+    results = open_results(output, restart)
+    try:
+        done = results.done()
+        todo, stamps, skipped = [], {}, 0
+        outputs = {op.abspath(output), op.abspath(output) + '.done'}
+        for filename, _, _, _, _ in walk_directory(path):
+            filename = op.abspath(filename)
+            if filename in outputs:
+                continue
+            stamps[filename] = _stamp(filename)
+            if tuple(done.get(filename, ())) == stamps[filename]:
+                skipped += 1
+            else:
+                todo.append(filename)
+
+        opts = {'traces': tuple(traces), 'peak_finder': peak_finder, \
+                'integrator': integrator, 'pf_opts': pf_opts, \
+                'int_opts': int_opts}
+        tasks = [(filename, opts) for filename in todo]
+        if processes == 1:
+            finished = (_process_task(t) for t in tasks)
+        else:
+            finished = worker_pool(processes).imap_unordered(_process_task, \
+                                                             tasks)
+
+        npeaks, nbytes, errors = 0, 0, 0
+        for n, (filename, rows, error, secs) in enumerate(finished):
+            results.add(filename, stamps[filename], rows, error, secs)
+            npeaks += len(rows)
+            nbytes += stamps[filename][0]
+            errors += error is not None
+            if log is not None:
+                status = 'ERROR' if error else '{} peaks'.format(len(rows))
+                print('[{}/{}] {} ({}, {:.1f} s)'.format(n + 1, len(tasks), \
+                      op.relpath(filename, path), status, secs), file=log)
+                if error:
+                    print(error, file=log)
+    finally:
+        results.close()
+
+    elapsed = time.time() - t_start
+    summary = {'files': len(tasks), 'skipped': skipped, 'errors': errors, \
+               'peaks': npeaks, 'bytes': nbytes, 'seconds': elapsed}
+    if log is not None:
+        print('{} files ({} already done, {} errors), {} peaks in {:.1f} s'
+              .format(len(tasks), skipped, errors, npeaks, elapsed), file=log)
+        if elapsed > 0 and len(tasks) > 0:
+            print('{:.2f} files/s, {:.2f} MB/s'.format(len(tasks) / elapsed, \
+                  nbytes / elapsed / 1024 ** 2), file=log)
+    return summary
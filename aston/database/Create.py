@@ -1,20 +1,19 @@
 import os
 import os.path as op
 from collections import Counter
-from aston.tracefile.Common import file_type, tfclasses
+from aston.tracefile.Common import file_type, file_md5
+import aston.tracefile.FrameCache as FrameCache
+from aston.tracefile.TraceFile import TraceFile
 from aston.database.File import Project, Run, Analysis
 from aston.database.Palette import Palette
 from aston.database.User import User, Group
 
 
-def read_directory(path, db, group=None):
-    #TODO: update with group also for permissions support
-    ftype_to_cls = {tf.__name__: tf for tf in tfclasses()}
-
-    # create blank project
-    if db.execute('SELECT 1 FROM projects WHERE name = ""').scalar() is None:
-        db.add(Project(name='', directory=op.abspath(path)))
-
+def _candidate_files(path):
+    """
+    Finds every file under path that might be a data file, along with
+    the names of the project and run that it would belong to.
+    """
     for fold, dirs, files in os.walk(path):
         # for some reason, the scanning code at the end of this loop
         # doesn't always work?
@@ -46,17 +45,356 @@ def read_directory(path, db, group=None):
                    (ufn.startswith('DAD') and ufn != 'DAD1A.CH'):
                     continue
 
-            # figure out if this is a chromatography file
-            ftype = file_type(op.join(fold, filename))
-            if ftype is None:
+            yield op.join(fold, filename), projname, projpath, runname
+
+
+def walk_directory(path):
+    """
+    Finds every data file under path that Aston can read.
+
+    Yields
+    ------
+    filename, ftype, projname, projpath, runname
+        The full path and type of each file and the names of the
+        project and run that it belongs to.
+    """
+    for filename, projname, projpath, runname in _candidate_files(path):
+        # figure out if this is a chromatography file
+        ftype = file_type(filename)
+        if ftype is not None:
+            yield filename, ftype, projname, projpath, runname
+
+
+def _run_path(filename, projpath, runname):
+    if runname == '':
+        runpath = filename
+    else:
+        path = filename.split(op.sep)
+        runpath = op.sep.join(path[:path.index(runname) + 1])
+    return op.relpath(op.abspath(runpath), projpath)
+
+
+def _trace_names(other_traces, traces):
+    """
+    Names the traces of a new analysis so they don't clash with the
+    traces of the other analyses (other_traces) in the same run.
+    """
+    other_traces = Counter(i.rstrip('0123456789') for \
+                           i in ','.join(other_traces).split(','))
+    return ','.join(i if i not in other_traces \
+                    else i + str(other_traces[i] + 1) for i in traces)
+
+
+def _read_file(task, moved=(), sample=None):
+    """
+    Identifies a file and reads its info; runs in the import pool.
+
+    Parameters
+    ----------
+    task : tuple
+        The filename and the (size, mtime) and hash it was last read
+        with (or None if it's new).
+    moved : set, optional
+        Hashes of files that have disappeared from the database.
+    sample : int, optional
+        Passed on to file_md5.
+
+    Returns
+    -------
+    tuple or None
+        ('read', stamp, md5, info, traces) for files that have to be
+        added or updated, ('touched', stamp, md5) for files that have a
+        new mtime but the same contents, ('moved', stamp, md5) for new
+        files that match one in moved, and None for files that aren't
+        data files or haven't changed.
+    """
+    filename, known = task
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    stamp = (st.st_size, st.st_mtime)
+    if known is not None and known[0] == stamp and known[1] is not None:
+        return None
+
+    if file_type(filename) is None:
+        return None
+    try:
+        md5 = file_md5(filename, sample)
+    except (IOError, OSError):
+        return None
+    if known is not None and known[1] == md5:
+        return 'touched', stamp, md5
+    elif known is None and md5 in moved:
+        return 'moved', stamp, md5
+
+    tf = TraceFile(filename)
+    try:
+        info, traces = tf.info, list(tf.traces)
+    except Exception:
+        # unreadable or corrupt; it'll be tried again next time
+        return None
+    info['filename'], info['filetype'] = filename, tf.ftype
+    return 'read', stamp, md5, info, traces
+
+
+class _DirectoryImport(object):
+    """
+    Adds the data files under a directory to a database, caching every
+    project, run and analysis already there so nothing has to be
+    looked up file by file, and writing new rows in bulk.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.projects, self.proj_dirs = {}, {}
+        for p in db.query(Project._project_id, Project.name, \
+                          Project.directory):
+            self.projects[p.name] = p._project_id
+            self.proj_dirs[p._project_id] = p.directory
+        # runs and analyses are keyed by (project id, relative path)
+        self.runs, run_keys = {}, {}
+        for r in db.query(Run._run_id, Run._project_id, Run.path, \
+                          Run.name, Run.info):
+            key = r._project_id, r.path
+            self.runs[key] = {'_run_id': r._run_id, 'path': r.path, \
+                              'name': r.name, 'info': r.info, \
+                              'traces': []}
+            run_keys[r._run_id] = key
+        self.analyses = {}
+        for a in db.query(Analysis._analysis_id, Analysis._run_id, \
+                          Analysis.path, Analysis.trace, Analysis.size, \
+                          Analysis.mtime, Analysis.md5hash):
+            if a._run_id not in run_keys:
+                continue
+            run_key = run_keys[a._run_id]
+            self.analyses[run_key[0], a.path] = { \
+                '_analysis_id': a._analysis_id, 'trace': a.trace, \
+                'run': self.runs[run_key], 'md5hash': a.md5hash, \
+                'stamp': (a.size, a.mtime)}
+            if a.trace is not None:
+                self.runs[run_key]['traces'].append(a.trace)
+        self._clear()
+
+    def _clear(self):
+        self.new_runs, self.new_analyses = [], []
+        self.changed_runs, self.changed_analyses = {}, {}
+
+    def known(self, projname, anal_path):
+        """
+        The stamp and hash an analysis was last read with, if any.
+        """
+        anal = self.analyses.get((self.projects.get(projname), anal_path))
+        if anal is None:
+            return None
+        return anal['stamp'], anal['md5hash']
+
+    def missing(self, seen):
+        """
+        Hashes of the analyses that aren't in seen and whose
+        files don't exist anymore.
+        """
+        missing = {}
+        for key, anal in self.analyses.items():
+            if key in seen or anal['md5hash'] is None:
+                continue
+            if not op.exists(self.filename(key)):
+                missing[anal['md5hash']] = key
+        return missing
+
+    def filename(self, key):
+        return op.join(self.proj_dirs[key[0]], key[1])
+
+    def project_id(self, projname, projpath):
+        if projname not in self.projects:
+            proj = {'name': projname, 'directory': projpath}
+            self.db.bulk_insert_mappings(Project, [proj], \
+                                         return_defaults=True)
+            self.projects[projname] = proj['_project_id']
+            self.proj_dirs[proj['_project_id']] = projpath
+        return self.projects[projname]
+
+    def run(self, projname, projpath, runname, filename, like=None):
+        """
+        Finds the run that filename belongs in, creating it (as a copy
+        of the run like, if given) if it doesn't exist.
+        """
+        proj_id = self.project_id(projname, projpath)
+        runpath = _run_path(filename, projpath, runname)
+        run = self.runs.get((proj_id, runpath))
+        if run is None:
+            run = {'path': runpath, 'name': runname, 'info': None, \
+                   'traces': [], '_project_id': proj_id}
+            if like is not None:
+                run['name'], run['info'] = like['name'], like['info']
+            self.runs[proj_id, runpath] = run
+            self.new_runs.append(run)
+        return proj_id, run
+
+    def _update(self, anal, **kwargs):
+        anal.update(kwargs)
+        if 'stamp' in kwargs:
+            anal['size'], anal['mtime'] = kwargs['stamp']
+        self.changed_analyses[anal['_analysis_id']] = anal
+
+    def touched(self, key, filename, stamp):
+        self._update(self.analyses[key], stamp=stamp)
+        FrameCache.rekey(filename, filename)
+
+    def moved(self, old_key, projname, projpath, runname, anal_path, \
+              filename, stamp):
+        """
+        Points an analysis at the new location of its file.
+        """
+        anal = self.analyses.pop(old_key)
+        old_filename = self.filename(old_key)
+        old_run = anal['run']
+        proj_id, run = self.run(projname, projpath, runname, filename, \
+                                like=old_run)
+        if anal['trace'] in old_run['traces']:
+            old_run['traces'].remove(anal['trace'])
+        run['traces'].append(anal['trace'])
+        self.analyses[proj_id, anal_path] = anal
+        self._update(anal, path=anal_path, run=run, stamp=stamp)
+        FrameCache.rekey(old_filename, filename)
+
+    def add(self, projname, projpath, runname, anal_path, stamp, md5, \
+            info, traces):
+        filename = info.pop('filename')
+        filetype = info.pop('filetype')
+        proj_id, run = self.run(projname, projpath, runname, filename)
+
+        anal = self.analyses.get((proj_id, anal_path))
+        if anal is not None:
+            # the file has changed since it was read; just update it
+            if anal['trace'] in run['traces']:
+                run['traces'].remove(anal['trace'])
+            trace = _trace_names(run['traces'], traces)
+            run['traces'].append(trace)
+            self._update(anal, filetype=filetype, trace=trace, \
+                         stamp=stamp, md5hash=md5)
+            FrameCache.invalidate(filename)
+            return
+
+        anal = {'path': anal_path, 'filetype': filetype, 'run': run, \
+                'trace': _trace_names(run['traces'], traces), \
+                'size': stamp[0], 'mtime': stamp[1], 'stamp': stamp, \
+                'md5hash': md5}
+        self.analyses[proj_id, anal_path] = anal
+        self.new_analyses.append(anal)
+        run['traces'].append(anal['trace'])
+
+        # update info in the containing run
+        if run['name'] == '':
+            run['name'] = op.split(filename)[1]
+        if 'name' in info:
+            run['name'] = info.pop('name')
+        run_info = dict(run['info'] or {})
+        run_info.update(info)
+        run['info'] = run_info
+        if '_run_id' in run:
+            self.changed_runs[run['_run_id']] = run
+
+    def commit(self):
+        cols = lambda d, ks: {k: d[k] for k in ks if k in d}
+        run_cols = ('_run_id', '_project_id', 'path', 'name', 'info')
+        new_runs = [cols(r, run_cols) for r in self.new_runs]
+        self.db.bulk_insert_mappings(Run, new_runs, return_defaults=True)
+        for run, mapping in zip(self.new_runs, new_runs):
+            run['_run_id'] = mapping['_run_id']
+        self.db.bulk_update_mappings(Run, [cols(r, run_cols) for r in \
+                                           self.changed_runs.values()])
+
+        anal_cols = ('_analysis_id', 'path', 'filetype', 'trace', \
+                     'size', 'mtime', 'md5hash')
+
+        def anal_mapping(anal):
+            mapping = cols(anal, anal_cols)
+            mapping['_run_id'] = anal['run']['_run_id']
+            return mapping
+
+        new_anals = [anal_mapping(a) for a in self.new_analyses]
+        self.db.bulk_insert_mappings(Analysis, new_anals, \
+                                     return_defaults=True)
+        for anal, mapping in zip(self.new_analyses, new_anals):
+            anal['_analysis_id'] = mapping['_analysis_id']
+        self.db.bulk_update_mappings(Analysis, [anal_mapping(a) for a \
+                                     in self.changed_analyses.values()])
+        self.db.commit()
+        self._clear()
+
+
+def read_directory(path, db, group=None, threads=None, batch_size=500, \
+                   hash_sample=None):
+    """
+    Adds every data file under path into the database.
+
+    Files are identified and read in a pool of threads. Files that are
+    already in the database with the same size and modification time
+    are skipped; the rest are hashed, so that files which were only
+    touched or moved can be updated without reading them again.
+
+    Parameters
+    ----------
+    path : str
+    db : Session
+    group : Group, optional
+    threads : int, optional
+        Number of threads reading files (defaults to the CPU count).
+    batch_size : int, optional
+        Number of files added between commits.
+    hash_sample : int, optional
+        Only hash this many bytes at each end of every file.
+    """
+    #TODO: update with group also for permissions support
+    from functools import partial
+    from multiprocessing.pool import ThreadPool
+
+    importer = _DirectoryImport(db)
+    # create blank project
+    importer.project_id('', op.abspath(path))
+
+    files, seen = [], set()
+    for filename, projname, projpath, runname in _candidate_files(path):
+        anal_path = op.relpath(op.abspath(filename), projpath)
+        files.append(((filename, importer.known(projname, anal_path)), \
+                      (projname, projpath, runname, anal_path)))
+        seen.add((importer.projects.get(projname), anal_path))
+    missing = importer.missing(seen)
+
+    read_file = partial(_read_file, moved=set(missing), sample=hash_sample)
+    pool = ThreadPool(threads)
+    try:
+        read = pool.imap(read_file, [f[0] for f in files], chunksize=8)
+        n = 0
+        for ((filename, known), loc), result in zip(files, read):
+            if result is None:
                 continue
+            if result[0] == 'moved' and result[2] not in missing:
+                # another copy of this file was already relinked
+                result = _read_file((filename, None), sample=hash_sample)
+                if result is None:
+                    continue
 
-            tf = ftype_to_cls[ftype](op.join(fold, filename))
-            tf.info['filename'] = op.relpath(op.join(fold, filename), path)
-            add_analysis(db, projname, projpath, runname, tf)
+            projname, projpath, runname, anal_path = loc
+            kind, stamp, md5 = result[:3]
+            if kind == 'touched':
+                key = importer.projects[projname], anal_path
+                importer.touched(key, filename, stamp)
+            elif kind == 'moved':
+                importer.moved(missing.pop(md5), projname, projpath, \
+                               runname, anal_path, filename, stamp)
+            else:
+                importer.add(*(loc + result[1:]))
+            n += 1
+            if n % batch_size == 0:
+                importer.commit()
+        importer.commit()
+    finally:
+        pool.close()
+        pool.join()
 
-    db.commit()
-    db.flush()
+    # anything already loaded from the database may be out of date
+    db.expire_all()
     #TODO: maybe give names to runs without them here?
 
 
@@ -68,38 +406,26 @@ def add_analysis(db, projname, projpath, runname, tf):
         db.add(project)
 
     # find the run; if it doesn't exist, create it
-    if runname == '':
-        runpath = tf.info['filename']
-    else:
-        path = tf.info['filename'].split(op.sep)
-        runpath = op.sep.join(path[:path.index(runname) + 1])
-    runpath = op.relpath(op.abspath(runpath), projpath)
+    runpath = _run_path(tf.filename, projpath, runname)
     run = db.query(Run).filter_by(path=runpath).first()
     if run is None:
         run = Run(name=runname, path=runpath, project=project)
         db.add(run)
 
-    #TODO: filter by md5hash also to weed out uniques
-    #TODO: also use md5hash to update filenames of moved files
-    analpath = op.relpath(op.abspath(tf.info['filename']), projpath)
+    analpath = op.relpath(op.abspath(tf.filename), projpath)
     analysis = db.query(Analysis).filter_by(path=analpath).first()
     if analysis is None:
         # add this analysis into the database
         info = tf.info.copy()
         analysis = Analysis(path=analpath, filetype=info['filetype'],
-                            run=run)
+                            run=run, md5hash=tf.md5hash())
         if run.name == '':
             run.name = op.split(info['filename'])[1]
         del info['filename'], info['filetype']
 
         # add in list of traces
-        other_traces = ','.join(a.trace for a in run.analyses \
-                                if a.trace is not None)
-        other_traces = Counter(i.rstrip('0123456789') for \
-                               i in other_traces.split(','))
-        analysis.trace = ','.join(i if i not in other_traces \
-                                  else i + str(other_traces[i] + 1) \
-                                  for i in tf.traces)
+        analysis.trace = _trace_names([a.trace for a in run.analyses \
+                                       if a.trace is not None], tf.traces)
 
         #TODO: add trace info in
         db.add(analysis)
@@ -1,5 +1,6 @@
 import os.path as op
-from sqlalchemy import Column, Integer, UnicodeText, Unicode, ForeignKey
+from sqlalchemy import Column, Integer, Float, UnicodeText, Unicode, \
+        ForeignKey
 from sqlalchemy.orm import relationship
 from aston.database import Base, JSONDict
 from aston.database.User import Group
@@ -46,6 +47,10 @@ class Analysis(Base):
     path = Column(UnicodeText)
     filetype = Column(Unicode(32))
     trace = Column(UnicodeText)
+    # size and modification time of the file when it was last read
+    size = Column(Integer)
+    mtime = Column(Float)
+    md5hash = Column(Unicode(32))
 
     @property
     def name(self):
@@ -138,6 +138,31 @@ class PaletteRun(Base):
             #except ValueError:
             #    return None
 
+    def traces(self, istrs, twin=None):
+        """
+        Resolves many trace names at once. Every plain m/z (or m/z
+        range) coming from the same 2D source is extracted together.
+        """
+        sources = self.avail_sources()
+        trs, batches = {}, {}
+        for istr in istrs:
+            ion, source = token_source(istr, sources)
+            mz_tol = _mz_tol(ion)
+            df = None if source is None else self.datafile(source)
+            if mz_tol is None or df is None or \
+               not any(t.startswith('#') for t in df.traces):
+                trs[istr] = self.trace(istr, twin)
+            else:
+                batches.setdefault(source, []).append((istr, ion, mz_tol))
+
+        for source, ions in batches.items():
+            mzs, tols = zip(*[i[2] for i in ions])
+            xics = self.datafile(source).traces_for(mzs, tols, twin)
+            for n, (istr, ion, _) in enumerate(ions):
+                trs[istr] = AstonSeries(xics.values[:, n], xics.index, \
+                                        name=ion)
+        return [trs[i] for i in istrs]
+
 
 class Plot(Base):
     __tablename__ = 'plots'
@@ -165,7 +190,7 @@ class Plot(Base):
     def name_type(self):
         return istr_type(self.name.lower())
 
-    def scan(self, t, dt=None):
+    def scan(self, t, dt=None, aggfunc=None):
         source = istr_best_2d_source(self.name.lower(), \
                                      self.paletterun.avail_sources())
         if source is None:
@@ -177,7 +202,7 @@ class Plot(Base):
             if dt is not None:
                 dt /= self.x_scale
             # find the scan
-            scan = self.paletterun.datafile(source).scan(t, dt)
+            scan = self.paletterun.datafile(source).scan(t, dt, aggfunc)
             scan.source = source
             return scan
 
@@ -190,7 +215,8 @@ class Plot(Base):
 
         # get a trace given my name
         tr_resolver = self.paletterun.trace
-        trace = parse_ion_string(self.name.lower(), tr_resolver, twin)
+        trace = parse_ion_string(self.name.lower(), tr_resolver, twin, \
+                                 batch_resolver=self.paletterun.traces)
 
         if trace is None:
             self.is_valid = False
@@ -240,3 +266,23 @@ class Plot(Base):
             ls = {'solid': '-', 'dash': '--', 'dot': ':', \
                   'dash-dot': '-.'}
             trace.plot(ax=ax, style=ls[style], color=color, label=label)
+
+
+def _mz_tol(ion):
+    """
+    Returns the m/z and tolerance of a plain ion name like "57",
+    "57:58" or "57±0.3" (or None if it's something else).
+    """
+    try:
+        if ':' in ion:
+            st, en = [float(i) for i in ion.split(':')]
+            return 0.5 * (en + st), 0.5 * (en - st)
+        elif u'±' in ion:
+            mz, tol = ion.split(u'±')
+            return float(mz), float(tol)
+        elif ion != '' and set(ion).issubset('0123456789.'):
+            return float(ion), 0.5
+    except ValueError:
+        pass
+    return None
+
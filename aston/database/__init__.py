@@ -35,11 +35,33 @@ MutableDict.associate_with(JSONDict)
 Base = declarative_base()
 
 
+def add_missing_columns(engine):
+    """
+    Adds any columns that were added to the tables since the database
+    was created (create_all only creates tables that are missing).
+    """
+    from sqlalchemy import inspect
+    from sqlalchemy.schema import CreateColumn
+
+    insp = inspect(engine)
+    tables = set(insp.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        cols = set(c['name'] for c in insp.get_columns(table.name))
+        for col in table.columns:
+            if col.name not in cols:
+                coldef = CreateColumn(col).compile(dialect=engine.dialect)
+                engine.execute('ALTER TABLE {} ADD COLUMN {}'.format( \
+                    table.name, coldef))
+
+
 def initialize_sql(engine):
     DBSession = scoped_session(sessionmaker(expire_on_commit=False))
     DBSession.configure(bind=engine)
     Base.metadata.bind = engine
     Base.metadata.create_all(engine)
+    add_missing_columns(engine)
     return DBSession
 
 
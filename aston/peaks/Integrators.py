@@ -1,4 +1,3 @@
-import multiprocessing
 import functools
 import numpy as np
 from aston.peaks.Peak import Peak, PeakComponent
@@ -69,8 +68,7 @@ def drop_integrate(ts, peak_list):
         if 'y0' in pks[0] and 'y1' in pks[-1]:
             y0, y1 = pks[0]['y0'], pks[-1]['y1']
         else:
-            y0 = ts.get_point(pks[0]['t0'])
-            y1 = ts.get_point(pks[-1]['t1'])
+            y0, y1 = ts.get_point(np.array([pks[0]['t0'], pks[-1]['t1']]))
         ys = np.array([y0, y1])
         xs = np.array([pks[0]['t0'], pks[-1]['t1']])
 
@@ -189,6 +187,8 @@ def _peakcomp_to_name(pkc):
 def merge_peaks_by_time(pks_list, time_diff=0.01):
     sort_pks = sorted([pk for pks in pks_list for pk in pks], \
                       key=lambda pk: pk.time())
+    if len(sort_pks) == 0:
+        return []
 
     # add the first component in as a peak
     pkc = sort_pks[0]
@@ -233,14 +233,12 @@ def _integrate_mpwrap(ts_and_pks, integrate, fopts):
 
 def integrate_peaks(tss, peaks_found, int_f, f_opts={}, \
                     as_first=False, mp=False):
-    f = functools.partial(_integrate_mpwrap, integrate=int_f, fopts=f_opts)
     if mp:
-        po = multiprocessing.Pool()
-        all_pks = po.map(f, zip(tss, peaks_found))
-        po.close()
-        po.join()
-    else:
-        all_pks = list(map(f, zip(tss, peaks_found)))
+        from aston.peaks.Workers import integrate_peaks_batch
+        return integrate_peaks_batch([tss], [peaks_found], int_f, \
+                                     f_opts, as_first)[0]
+    f = functools.partial(_integrate_mpwrap, integrate=int_f, fopts=f_opts)
+    all_pks = list(map(f, zip(tss, peaks_found)))
 
     # merge peaks from all_pks together
     if as_first:
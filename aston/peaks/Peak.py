@@ -1,6 +1,7 @@
 import numpy as np
-from scipy import convolve
+from numpy import convolve
 from aston.spectra.Scan import Scan
+from aston.spectra.Merge import merge_spectra
 from aston.trace.Trace import AstonSeries
 #from aston.spectra.Isotopes import delta13C_Santrock, delta13C_Craig
 from aston.peaks.PeakFitting import fit, guess_initc
@@ -56,8 +57,11 @@ class Peak(object):
 
         if mz in {'', 'x', 'tic', None}:
             # sum up all the components
-            trace = self.components[0].trace
+            # copy these so summing in place doesn't change the components
+            trace = self.components[0].trace.copy()
             b_trace = self.components[0].baseline
+            if b_trace is not None:
+                b_trace = b_trace.copy()
             for c in self.components[1:]:
                 trace += c.trace
                 if c.baseline is not None:
@@ -78,8 +82,8 @@ class Peak(object):
 
         # merge the trace and baseline
         if sub_base and b_trace is not None:
-            trace -= np.interp(trace.index, b_trace.index, \
-                               b_trace.values)
+            trace = trace - np.interp(trace.index, b_trace.index, \
+                                      b_trace.values)
             t, z = trace.index, trace.values
         elif b_trace is None:
             t, z = trace.index, trace.values
@@ -87,12 +91,10 @@ class Peak(object):
             t = np.hstack([trace.index, b_trace.index[::-1]])
             z = np.hstack([trace.values, b_trace.values[::-1]])
 
-        if hasattr(self, 'dbplot'):
+        if getattr(self, 'dbplot', None) is not None:
             #scale and offset according to parent
-            t *= self.dbplot.x_scale
-            t += self.dbplot.x_offset
-            z *= self.dbplot.y_scale
-            z += self.dbplot.y_offset
+            t = t * self.dbplot.x_scale + self.dbplot.x_offset
+            z = z * self.dbplot.y_scale + self.dbplot.y_offset
 
         return np.vstack([t, z]).T
 
@@ -194,7 +196,31 @@ class Peak(object):
             return np.sum(fdata[:, 1])
 
     def as_scan(self, aggtype=None):
-        return Scan()
+        """
+        The spectrum of this peak: all of the spectra under it merged
+        together if it's on a plot of a file with spectra, or otherwise
+        the areas of its components at each m/z.
+
+        Parameters
+        ----------
+        aggtype : {'sum', 'mean', 'max'}, optional
+            How the spectra (or components at the same m/z) are combined.
+        """
+        if getattr(self, 'dbplot', None) is not None and \
+           len(self.components) > 0:
+            t = self.as_poly()[:, 0]
+            scn = self.dbplot.scan(t.min(), t.max() - t.min(), aggtype)
+            if scn is not None:
+                return scn
+
+        mzs, areas = [], []
+        for c in self.components:
+            try:
+                mzs.append([float(c._trace.name)])
+            except (TypeError, ValueError):
+                continue
+            areas.append([Peak(components=c).area()])
+        return Scan(*merge_spectra(mzs, areas, how=aggtype or 'sum'))
 
 
 class PeakComponent(object):
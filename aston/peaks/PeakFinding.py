@@ -1,4 +1,3 @@
-import multiprocessing
 import functools
 import numpy as np
 #from aston.trace.MathSeries import savitzkygolay
@@ -222,10 +221,8 @@ def find_peaks(tss, pf_f, f_opts={}, mp=False):
     f = functools.partial(_peak_find_mpwrap, peak_find=pf_f, \
                           fopts=f_opts)
     if mp:
-        po = multiprocessing.Pool()
-        peaks_found = po.map(f, tss)
-        po.close()
-        po.join()
+        from aston.peaks.Workers import find_peaks_batch
+        peaks_found = find_peaks_batch([tss], pf_f, f_opts)[0]
     else:
         peaks_found = list(map(f, tss))
     return peaks_found
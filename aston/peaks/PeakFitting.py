@@ -1,5 +1,9 @@
 import numpy as np
-from scipy.optimize import leastsq, fmin, anneal, fmin_l_bfgs_b
+from scipy.optimize import leastsq, fmin, fmin_l_bfgs_b
+try:
+    from scipy.optimize import anneal
+except ImportError:  # removed in scipy 0.16
+    anneal = None
 
 # bounding code inspired by http://newville.github.com/lmfit-py/bounds.html
 # which was inspired by leastsqbound, which was inspired by MINUIT
@@ -128,6 +132,8 @@ def fit(ts, fs=[], all_params=[], fit_vars=None, \
         fit_p, _ = fmin(errfunc, initc, args=(ts.index, ts.values, \
                                               peak_params))
     elif alg == 'anneal':
+        if anneal is None:
+            raise ImportError('this version of scipy has no anneal')
         fit_p, _ = anneal(errfunc, initc, args=(ts.index, ts.values, \
                                                 peak_params))
     elif alg == 'lbfgsb':
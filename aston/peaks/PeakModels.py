@@ -20,6 +20,11 @@ import numpy as np
 from numpy import exp, sqrt, abs, log
 from scipy.special import erfc, i1, gamma
 
+try:
+    getargspec = inspect.getfullargspec
+except AttributeError:  # python 2
+    getargspec = inspect.getargspec
+
 
 # These functions allow us to use commonsense notation
 # in labelling parameter bounds. The sqrt is to allow
@@ -60,7 +65,7 @@ def peak_model(f):
                 kw[v] = def_vals[v]
 
         # this copies all of the defaults into what the peak function needs
-        anames, _, _, _ = inspect.getargspec(f)
+        anames = getargspec(f)[0]
         fkw = dict([(arg, kw[arg]) for arg in anames if arg in kw])
 
         # some functions use location or width parameters explicitly
@@ -78,7 +83,7 @@ def peak_model(f):
         return kw['v'] + kw['h'] / max(mod) * mod
 
     args = set(['v', 'h', 'x', 'w'])
-    anames, _, _, _ = inspect.getargspec(f)
+    anames = getargspec(f)[0]
     wrapped_f._peakargs = list(args.union([a for a in anames \
                                            if a not in ('t', 'r')]))
     return wrapped_f
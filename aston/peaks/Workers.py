@@ -0,0 +1,287 @@
+"""
+Peak finding and integration for many traces (and runs) at once.
+
+The traces for a whole batch are copied into one memory-mapped file
+that the worker processes read directly, instead of every AstonSeries
+being pickled to them, and the work is farmed out to one process pool
+that stays alive for as long as the application. Peaks are sent back
+as slices of the traces the workers were given where possible.
+"""
+import atexit
+import multiprocessing
+import os
+import os.path as op
+import tempfile
+import numpy as np
+from aston.trace.Trace import AstonSeries
+from aston.peaks.Peak import PeakComponent
+from aston.peaks.PeakFinding import _peak_find_mpwrap, find_peaks_as_first
+from aston.peaks.Integrators import _integrate_mpwrap, \
+        merge_peaks_by_order, merge_peaks_by_time
+
+_POOL = None
+_POOL_SIZE = None
+
+
+def worker_pool(processes=None):
+    """
+    Returns the process pool shared by the whole application,
+    starting it the first time this is called. It's restarted if
+    a different number of processes is asked for.
+    """
+    global _POOL, _POOL_SIZE
+    if _POOL is not None and processes is not None and \
+       processes != _POOL_SIZE:
+        close_worker_pool()
+    if _POOL is None:
+        _POOL_SIZE = processes or multiprocessing.cpu_count()
+        _POOL = multiprocessing.Pool(_POOL_SIZE)
+    return _POOL
+
+
+def close_worker_pool():
+    global _POOL
+    if _POOL is not None:
+        _POOL.close()
+        _POOL.join()
+        _POOL = None
+
+
+atexit.register(close_worker_pool)
+
+
+class SharedTraces(object):
+    """
+    A group of AstonSeries copied into one memory-mapped file (in
+    shared memory, if the OS has a tmpfs for it) that other processes
+    can open with only a small handle for each trace.
+    """
+    def __init__(self, tss):
+        self.names = [ts.name for ts in tss]
+        self.offsets = np.zeros(len(tss) + 1, dtype=int)
+        np.cumsum([len(ts) for ts in tss], out=self.offsets[1:])
+
+        shm_dir = '/dev/shm' if op.isdir('/dev/shm') else None
+        fd, self.filename = tempfile.mkstemp(prefix='aston-', \
+                                             suffix='.npy', dir=shm_dir)
+        os.close(fd)
+        npts = max(int(self.offsets[-1]), 1)
+        arr = np.lib.format.open_memmap(self.filename, mode='w+', \
+                                        dtype=float, shape=(2, npts))
+        for ts, st, en in zip(tss, self.offsets[:-1], self.offsets[1:]):
+            arr[0, st:en] = ts.index
+            arr[1, st:en] = ts.values
+        arr.flush()
+        del arr
+
+    def handle(self, i):
+        return (self.filename, int(self.offsets[i]), \
+                int(self.offsets[i + 1]), self.names[i])
+
+    def close(self):
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _load_traces(handles):
+    """
+    Opens the traces for one task. The shared file is only mapped for
+    as long as the task holds onto them, so workers don't keep a batch
+    in (shared) memory after it's finished.
+    """
+    arrs, tss = {}, []
+    for handle in handles:
+        if isinstance(handle, AstonSeries):
+            # running in the same process; nothing was shared
+            tss.append(handle)
+            continue
+        filename, st, en, name = handle
+        if filename not in arrs:
+            arrs[filename] = np.load(filename, mmap_mode='r')
+        arr = arrs[filename]
+        tss.append(AstonSeries(arr[1, st:en], arr[0, st:en], name=name))
+    return tss
+
+
+def _compact(ts, comps):
+    """
+    Reduces PeakComponents to tuples that are cheap to pickle; traces
+    that are just a piece of ts are replaced by their position in it.
+    """
+    compact = []
+    for c in comps:
+        tr = c._trace
+        st = int(np.searchsorted(ts.index, tr.index[0])) if len(tr) else 0
+        en = st + len(tr)
+        if tr.name == ts.name and en <= len(ts) and \
+           np.array_equal(ts.index[st:en], tr.index) and \
+           np.array_equal(ts.values[st:en], tr.values):
+            tr = ('slice', st, en)
+        else:
+            tr = ('data', tr.values, tr.index, tr.name)
+        bl = c.baseline
+        if bl is not None:
+            bl = (bl.values, bl.index, bl.name)
+        compact.append((c.info, tr, bl))
+    return compact
+
+
+def _expand(ts, compact):
+    comps = []
+    for info, tr, bl in compact:
+        if tr[0] == 'slice':
+            trace = ts[tr[1]:tr[2]]
+        else:
+            trace = AstonSeries(tr[1], tr[2], name=tr[3])
+        if bl is not None:
+            bl = AstonSeries(bl[0], bl[1], name=bl[2])
+        comps.append(PeakComponent(info, trace, bl))
+    return comps
+
+
+def _batch_task(task):
+    """
+    Finds and/or integrates the peaks in a group of traces.
+    """
+    handles, pf_f, pf_opts, int_f, int_opts, as_first, found = task
+    tss = _load_traces(handles)
+
+    if pf_f is not None:
+        if as_first:
+            found = find_peaks_as_first(tss, pf_f, pf_opts)
+        else:
+            found = [_peak_find_mpwrap(ts, pf_f, pf_opts) for ts in tss]
+
+    comps = None
+    if int_f is not None:
+        comps = [_integrate_mpwrap((ts, pks), int_f, int_opts) \
+                 for ts, pks in zip(tss, found)]
+        if not isinstance(handles[0], AstonSeries):
+            comps = [_compact(ts, c) for ts, c in zip(tss, comps)]
+    return found, comps
+
+
+def _run_batch(runs, pf_f=None, pf_opts=None, int_f=None, int_opts=None, \
+               as_first=False, peaks_found=None, mp=True):
+    """
+    Schedules every trace of every run in one pass over the pool.
+
+    Returns
+    -------
+    found, comps : list
+        The peaks found and the PeakComponents integrated for each
+        trace of each run (comps is None without an integrator).
+    """
+    if peaks_found is None:
+        peaks_found = [[None] * len(tss) for tss in runs]
+    all_tss = [ts for tss in runs for ts in tss]
+
+    shared = SharedTraces(all_tss) if mp and len(all_tss) > 0 else None
+    handles, i = [], 0
+    for tss in runs:
+        n = len(tss)
+        handles.append([shared.handle(j) if shared else all_tss[j] \
+                        for j in range(i, i + n)])
+        i += n
+
+    tasks = []
+    for hs, fnd in zip(handles, peaks_found):
+        if as_first and pf_f is not None:
+            # every trace is found relative to the first one
+            tasks.append((hs, pf_f, pf_opts, int_f, int_opts, True, fnd))
+        else:
+            tasks += [([h], pf_f, pf_opts, int_f, int_opts, False, [f]) \
+                      for h, f in zip(hs, fnd)]
+
+    try:
+        if shared is not None:
+            results = worker_pool().map(_batch_task, tasks)
+        else:
+            results = [_batch_task(t) for t in tasks]
+    finally:
+        if shared is not None:
+            shared.close()
+
+    # put the results for each task back together by run
+    found, comps, results = [], [], iter(results)
+    for tss in runs:
+        r_found, r_comps = [], []
+        while len(r_found) < len(tss):
+            t_found, t_comps = next(results)
+            r_found += t_found
+            if t_comps is not None:
+                r_comps += t_comps
+        if shared is not None:
+            r_comps = [_expand(ts, c) for ts, c in zip(tss, r_comps)]
+        found.append(r_found)
+        comps.append(r_comps if int_f is not None else None)
+    return found, comps
+
+
+def _merge(comps, as_first):
+    if as_first:
+        return merge_peaks_by_order(comps)
+    return merge_peaks_by_time(comps)
+
+
+def find_peaks_batch(runs, pf_f, f_opts={}, as_first=False, mp=True):
+    """
+    Finds the peaks in every trace of many runs at once.
+
+    Parameters
+    ----------
+    runs : list of list of AstonSeries
+    pf_f : function
+        Peak finder, e.g. simple_peak_find.
+    f_opts : dict, optional
+    as_first : bool, optional
+        Find the peaks in the first trace of each run and shift those
+        onto the other traces (like find_peaks_as_first).
+    mp : bool, optional
+        Use the worker pool.
+
+    Returns
+    -------
+    list
+        The peaks found in each trace of each run.
+    """
+    return _run_batch(runs, pf_f, f_opts, as_first=as_first, mp=mp)[0]
+
+
+def integrate_peaks_batch(runs, peaks_found, int_f, f_opts={}, \
+                          as_first=False, mp=True):
+    """
+    Integrates the peaks found in every trace of many runs at once.
+
+    Returns
+    -------
+    list
+        The merged Peaks for each run.
+    """
+    _, comps = _run_batch(runs, int_f=int_f, int_opts=f_opts, \
+                          peaks_found=peaks_found, mp=mp)
+    return [_merge(c, as_first) for c in comps]
+
+
+def find_and_integrate(runs, pf_f, int_f, pf_opts={}, int_opts={}, \
+                       as_first=False, mp=True):
+    """
+    Finds and integrates the peaks in every trace of many runs, with
+    each trace only being sent to the workers once.
+
+    Returns
+    -------
+    list
+        The merged Peaks for each run.
+    """
+    _, comps = _run_batch(runs, pf_f, pf_opts, int_f, int_opts, \
+                          as_first=as_first, mp=mp)
+    return [_merge(c, as_first) for c in comps]
@@ -17,6 +17,7 @@ from aston.qtgui.TablePalette import PaletteTreeModel
 import aston.qtgui.MenuOptions
 from aston.peaks.PeakFinding import find_peaks, find_peaks_as_first
 from aston.peaks.Integrators import integrate_peaks
+from aston.spectra.Library import load_library
 from aston.qtgui.Fields import aston_field_opts
 
 
@@ -392,6 +393,17 @@ class AstonWindow(QtGui.QMainWindow):
             self.pal_tab.db.commit()
         self.plot_data(update_bounds=False)
 
+    def spectral_library(self):
+        """
+        The library set in the preferences (loaded once), or None.
+        """
+        lib_file = get_pref('Default.SPECTRAL_LIBRARY')
+        if lib_file is None or lib_file.strip() == '':
+            return None
+        if getattr(self, '_spec_lib', (None, None))[0] != lib_file:
+            self._spec_lib = (lib_file, load_library(lib_file))
+        return self._spec_lib[1]
+
     def showFilterWindow(self):
         if self.obj_tab.active_file() is not None:
             self.dlg = FilterWindow(self)
@@ -424,10 +424,9 @@ class PaletteTreeModel(TableModel):
         #    self._add_menu_opt(self.tr('Merge Peaks'), \
         #                       self.merge_peaks, fts, menu)
 
-        #fts = [s for s in sel if s.db_type in ('spectrum', 'peak')]
-        #if len(fts) > 0:
-        #    self._add_menu_opt(self.tr('Find in Lib'), \
-        #                       self.find_in_lib, fts, menu)
+        fts = [s for s in sel if isinstance(s, (PaletteRun, Plot, Peak))]
+        if len(fts) > 0:
+            add_menu_opt(self.tr('Find in Lib'), self.find_in_lib, fts, menu)
 
         ###Things we can do with files
         ##fts = [s for s in sel if s.db_type == 'file']
@@ -482,15 +481,29 @@ class PaletteTreeModel(TableModel):
                 obj._children += [obj.as_spectrum()]
 
     def find_in_lib(self, objs):
+        lib = self.master_window.spectral_library()
+        if lib is None:
+            self.master_window.show_status(self.tr('No Spectral Library Set'))
+            return
+
+        # search for every selected peak at once
+        pks = []
         for obj in objs:
-            if obj.db_type == 'peak':
-                spc = obj.as_spectrum().data
-            elif obj.db_type == 'spectrum':
-                spc = obj.data
-            lib_spc = self.master_window.cmpd_tab.db.find_spectrum(spc)
-            if lib_spc is not None:
-                obj.info['name'] = lib_spc.info['name']
-                obj.save_changes()
+            if isinstance(obj, PaletteRun):
+                pks += [pk for plt in obj.plots for pk in plt.peaks]
+            elif isinstance(obj, Plot):
+                pks += obj.peaks
+            elif isinstance(obj, Peak):
+                pks.append(obj)
+        if len(pks) == 0:
+            return
+        hits, _ = lib.search([pk.as_scan() for pk in pks], top_k=1, \
+                             method='composite')
+        for pk, hit in zip(pks, hits[:, 0]):
+            if hit >= 0:
+                pk.name = str(lib.names[hit])
+                self.db.merge(pk)
+        self.db.commit()
 
     #def makeMethod(self, objs):
     #    self.master_window.cmpd_tab.addObjects(None, objs)
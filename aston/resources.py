@@ -1,5 +1,5 @@
+import os
 import os.path as op
-import pkg_resources
 
 
 # look up for resource files
@@ -9,6 +9,7 @@ def resfile(res_pkg, res_path):
     if op.exists(op.join(op.join(*res_pkg), res_path)):
         return op.join(op.join(*res_pkg), res_path)
     else:
+        import pkg_resources
         res_pkg = '.'.join(res_pkg)
         return pkg_resources.resource_filename(res_pkg, res_path)
 
@@ -18,9 +19,28 @@ try:
 except ImportError:  # Python 2
     from aston.cache import lru_cache as cache
 
-# translation function
-from PyQt4.QtCore import QObject
-tr = lambda s: QObject().trUtf8(s)
+
+def file_stamp(filename):
+    """
+    The size and modification time (in ns) of filename, to tell if
+    it's changed since something was derived from it.
+    """
+    st = os.stat(filename)
+    try:
+        mtime = st.st_mtime_ns
+    except AttributeError:  # Python 2
+        mtime = int(st.st_mtime * 1e9)
+    return [st.st_size, mtime]
+
+
+def tr(s):
+    """
+    Translates a string for display in the GUI.
+    """
+    # imported here, so that everything outside of the GUI
+    # works without Qt installed
+    from PyQt4.QtCore import QObject
+    return QObject().trUtf8(s)
 
 
 def get_pref(key):
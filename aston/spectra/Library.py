@@ -0,0 +1,444 @@
+import os
+import os.path as op
+import re
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse
+from aston.resources import cache, file_stamp
+from aston.spectra.Scan import Scan
+from aston.spectra.Math import stein_weights, ratio_scores, composite_scores
+
+
+class SpectralLibrary(object):
+    """
+    Reference spectra that many spectra can be searched against at once.
+
+    The spectra are kept as the rows of a CSR matrix, binned to m/z
+    columns and normalized to unit length, so cosine similarities for
+    a whole batch of queries are one sparse matrix product. An inverted
+    index from every m/z to the spectra with it as one of their top_n
+    peaks limits that product to plausible candidates.
+
+    Parameters
+    ----------
+    names : array-like of str
+    matrix : scipy.sparse.csr_matrix
+        (spectra x m/z's) with every row normalized to unit length.
+    mzs : np.ndarray
+        The m/z of every column in matrix.
+    norms : np.ndarray
+        The length of every row before normalizing (with the largest
+        peak in each spectrum scaled to 1).
+    inv_indptr, inv_rows : np.ndarray
+        The inverted index: the rows inv_rows[inv_indptr[i]:
+        inv_indptr[i + 1]] have column i as one of their top_n peaks.
+    mz_bin : float, optional
+        The width of each m/z column.
+    top_n : int, optional
+        The number of peaks of each spectrum in the inverted index.
+    precursors : np.ndarray, optional
+        The precursor m/z (or molecular weight) of every spectrum, for
+        neutral loss searches; NaN where it's unknown.
+    """
+    def __init__(self, names, matrix, mzs, norms, inv_indptr, inv_rows, \
+                 mz_bin=1., top_n=8, precursors=None):
+        self.names = names
+        self.matrix = matrix
+        self.mzs = mzs
+        self.norms = norms
+        self.inv_indptr = inv_indptr
+        self.inv_rows = inv_rows
+        self.mz_bin = mz_bin
+        self.top_n = top_n
+        if precursors is None:
+            precursors = np.nan * np.ones(matrix.shape[0])
+        self.precursors = precursors
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @classmethod
+    def build(cls, names, spectra, mz_bin=1., top_n=8, precursors=None):
+        """
+        Creates a library out of names and spectra (a list of Scans or
+        of (m/z's, abundances) pairs) and optionally their precursors.
+        """
+        rows, keys, abns = _flatten(spectra, mz_bin)
+        mz_keys, cols = np.unique(keys, return_inverse=True)
+        mat = scipy.sparse.csr_matrix((abns, (rows, cols.ravel())), \
+                                      shape=(len(spectra), len(mz_keys)))
+        mat.sum_duplicates()
+
+        # scale the largest peak of every spectrum to 1
+        maxs = mat.max(axis=1).toarray().ravel()
+        mat.data /= np.repeat(np.where(maxs > 0, maxs, 1.), \
+                              np.diff(mat.indptr))
+        norms = np.sqrt(np.asarray(mat.multiply(mat).sum(axis=1)).ravel())
+        mat.data /= np.repeat(np.where(norms > 0, norms, 1.), \
+                              np.diff(mat.indptr))
+
+        # every spectrum's top_n peaks, sorted by m/z column
+        top, _ = _top_peaks(mat, top_n)
+        top_rows = np.repeat(np.arange(mat.shape[0]), np.diff(mat.indptr))[top]
+        top_cols = mat.indices[top]
+        srt = np.argsort(top_cols, kind='stable')
+        inv_indptr = np.zeros(len(mz_keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(top_cols, minlength=len(mz_keys)), \
+                  out=inv_indptr[1:])
+        return cls(np.array(names, dtype=str), mat, mz_bin * mz_keys, \
+                   norms, inv_indptr, top_rows[srt], mz_bin, top_n, \
+                   None if precursors is None else \
+                   np.array(precursors, dtype=float))
+
+    def save(self, path, stamp=None):
+        """
+        Saves the library into the directory path, as one file per
+        array so that they can be memory-mapped when loaded.
+
+        The files are written to a new directory that then replaces
+        path, so libraries loaded from path before keep working.
+        """
+        path = op.abspath(path)
+        tmp = tempfile.mkdtemp(prefix='.' + op.basename(path) + '-', \
+                               dir=op.dirname(path))
+        arrays = {'names': self.names, 'data': self.matrix.data, \
+                  'indices': self.matrix.indices, \
+                  'indptr': self.matrix.indptr, 'mzs': self.mzs, \
+                  'norms': self.norms, 'inv_indptr': self.inv_indptr, \
+                  'inv_rows': self.inv_rows, \
+                  'precursors': self.precursors, \
+                  'params': np.array([self.mz_bin, self.top_n]), \
+                  'stamp': np.array([] if stamp is None else stamp)}
+        try:
+            for name, arr in arrays.items():
+                np.save(op.join(tmp, name + '.npy'), np.asarray(arr))
+            if op.exists(path):
+                # directories can't be replaced, so move the old one away
+                old = tmp + '-old'
+                os.rename(path, old)
+                os.rename(tmp, path)
+                shutil.rmtree(old, ignore_errors=True)
+            else:
+                os.rename(tmp, path)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-maps a library saved with save.
+        """
+        ld = lambda name: np.load(op.join(path, name + '.npy'), \
+                                  mmap_mode='r')
+        indptr, mzs = ld('indptr'), ld('mzs')
+        mat = scipy.sparse.csr_matrix((ld('data'), ld('indices'), indptr), \
+                                      shape=(len(indptr) - 1, len(mzs)))
+        mz_bin, top_n = ld('params')
+        has_precs = op.exists(op.join(path, 'precursors.npy'))
+        lib = cls(ld('names'), mat, mzs, ld('norms'), ld('inv_indptr'), \
+                  ld('inv_rows'), float(mz_bin), int(top_n), \
+                  ld('precursors') if has_precs else None)
+        lib.stamp = ld('stamp').tolist()
+        return lib
+
+    def spectrum(self, idx):
+        """
+        The spectrum at idx (with its largest peak scaled to 1).
+        """
+        st, en = self.matrix.indptr[idx], self.matrix.indptr[idx + 1]
+        return Scan(self.mzs[self.matrix.indices[st:en]], \
+                    self.norms[idx] * self.matrix.data[st:en], \
+                    name=self.names[idx])
+
+    def _query_matrix(self, spectra, mz_power=0., int_power=1.):
+        """
+        Bins spectra onto the library's m/z columns, weights their peaks
+        with stein_weights and normalizes them to unit length (including
+        any peaks the library doesn't have).
+
+        Returns the matrix and the number of peaks in every spectrum.
+        """
+        rows, keys, abns = _flatten(spectra, self.mz_bin)
+        # sum up the points of each spectrum in each bin
+        k0 = keys.min() if len(keys) > 0 else 0
+        span = keys.max() - k0 + 1 if len(keys) > 0 else 1
+        pairs, inv = np.unique(rows * span + (keys - k0), return_inverse=True)
+        abns = np.bincount(inv.ravel(), weights=abns, minlength=len(pairs))
+        rows, keys = pairs // span, pairs % span + k0
+        if (mz_power, int_power) != (0., 1.):
+            abns = stein_weights(self.mz_bin * keys, abns, mz_power, \
+                                 int_power)
+
+        norms = np.sqrt(np.bincount(rows, weights=abns ** 2, \
+                                    minlength=len(spectra)))
+        lib_keys = np.round(self.mzs / self.mz_bin).astype(np.int64)
+        cols = np.clip(np.searchsorted(lib_keys, keys), 0, \
+                       max(len(lib_keys) - 1, 0))
+        found = (lib_keys[cols] == keys) if len(lib_keys) > 0 else \
+                np.zeros(len(keys), dtype=bool)
+        vals = abns[found] / np.where(norms > 0, norms, 1.)[rows[found]]
+        query = scipy.sparse.csr_matrix((vals, (rows[found], cols[found])), \
+                                        shape=(len(spectra), len(lib_keys)))
+        return query, np.bincount(rows, minlength=len(spectra))
+
+    @cache(maxsize=4)
+    def _weighted_matrix(self, mz_power, int_power):
+        """
+        The library matrix with its peaks weighted by stein_weights (and
+        every row normalized to unit length again).
+        """
+        if (mz_power, int_power) == (0., 1.):
+            return self.matrix
+        indptr = self.matrix.indptr
+        rows = np.repeat(np.arange(len(self)), np.diff(indptr))
+        wts = stein_weights(self.mzs[self.matrix.indices], \
+                            self.norms[rows] * self.matrix.data, \
+                            mz_power, int_power)
+        norms = np.sqrt(np.bincount(rows, weights=wts ** 2, \
+                                    minlength=len(self)))
+        wts /= np.where(norms > 0, norms, 1.)[rows]
+        return scipy.sparse.csr_matrix((wts, self.matrix.indices, indptr), \
+                                       shape=self.matrix.shape)
+
+    @cache(maxsize=1)
+    def losses(self):
+        """
+        A library of the neutral losses from every spectrum's precursor.
+        """
+        spectra = [self.spectrum(i) for i in range(len(self))]
+        losses = _neutral_losses(spectra, self.precursors, self.mz_bin)
+        return SpectralLibrary.build(self.names, losses, self.mz_bin, \
+                                     self.top_n, self.precursors)
+
+    def _candidates(self, query):
+        """
+        A (queries x spectra) matrix, nonzero wherever a library spectrum
+        shares a top_n peak with a query's top_n peaks.
+        """
+        top, _ = _top_peaks(query, self.top_n)
+        qrows = np.repeat(np.arange(query.shape[0]), np.diff(query.indptr))
+        qtop = scipy.sparse.csr_matrix((np.ones(len(top)), \
+                                        (qrows[top], query.indices[top])), \
+                                       shape=query.shape)
+        inv = scipy.sparse.csr_matrix((np.ones(len(self.inv_rows)), \
+                                       self.inv_rows, self.inv_indptr), \
+                                      shape=(query.shape[1], len(self)))
+        return qtop.dot(inv)
+
+    def search(self, spectra, top_k=5, prefilter=True, method='cosine', \
+               reverse=False, mz_power=None, int_power=None, \
+               precursors=None):
+        """
+        Finds the top_k most similar library spectra for every one of
+        spectra in one batch.
+
+        Parameters
+        ----------
+        spectra : list of Scan or of (array-like, array-like)
+        top_k : int, optional
+        prefilter : bool, optional
+            Only score library spectra that share one of their top peaks
+            with one of a query's top peaks.
+        method : {'cosine', 'dot', 'composite'}, optional
+            'cosine' is the cosine similarity of the abundances, 'dot' is
+            Stein & Scott's weighted dot product (the squared cosine
+            similarity of the weighted peaks) and 'composite' averages
+            that with their ratio of neighbouring peaks term (for the
+            10 * top_k best hits by 'dot').
+        reverse : bool, optional
+            Ignore any peaks in a query that aren't in the library
+            spectrum (e.g. from coeluting compounds).
+        mz_power, int_power : float, optional
+            Peaks are weighted by m/z ** mz_power * abundance ** int_power;
+            by default 0 and 1 for 'cosine' and 3 and 0.6 otherwise.
+        precursors : array-like, optional
+            The precursor m/z of every query. If given, the neutral losses
+            from the precursors are compared instead of the peaks.
+
+        Returns
+        -------
+        hits : np.ndarray
+            (len(spectra) x top_k) indices of the matching library
+            spectra, best first; -1 if there aren't top_k matches.
+        scores : np.ndarray
+            The similarity (from 0 to 1) of every hit.
+        """
+        if method not in {'cosine', 'dot', 'composite'}:
+            raise ValueError('Unknown scoring method: {}'.format(method))
+        if precursors is not None:
+            return self.losses().search(_neutral_losses(spectra, \
+                                          precursors, self.mz_bin), \
+                                        top_k, prefilter, method, reverse, \
+                                        mz_power, int_power)
+        if mz_power is None:
+            mz_power = 0. if method == 'cosine' else 3.
+        if int_power is None:
+            int_power = 1. if method == 'cosine' else 0.6
+
+        query, npeaks = self._query_matrix(spectra, mz_power, int_power)
+        lib = self._weighted_matrix(mz_power, int_power)
+        if prefilter:
+            # the inverted index is of the unweighted top peaks
+            if (mz_power, int_power) != (0., 1.):
+                cands = self._candidates(self._query_matrix(spectra)[0])
+            else:
+                cands = self._candidates(query)
+            cands = cands.tocsc()
+            cand_rows = np.flatnonzero(np.diff(cands.indptr))
+            lib = lib[cand_rows]
+            scores = query.dot(lib.T).multiply(cands[:, cand_rows] > 0)
+        else:
+            cand_rows = np.arange(len(self))
+            scores = query.dot(lib.T)
+        scores = scipy.sparse.csr_matrix(scores)
+
+        if reverse:
+            # renormalize the queries with only the peaks in each spectrum
+            shared_norms = query.multiply(query).dot((lib > 0).T)
+            scores = scipy.sparse.csr_matrix( \
+                scores.multiply(shared_norms.power(-0.5)))
+        if method != 'cosine':
+            scores.data **= 2
+        if method == 'composite':
+            # only rescore the best hits by weighted dot product
+            cols, dots = _top_k(scores, 10 * top_k)
+            qrows, ranks = np.nonzero(cols >= 0)
+            cols, dots = cols[qrows, ranks], dots[qrows, ranks]
+            ratios, nshared = ratio_scores(query[qrows], lib[cols])
+            nunk = nshared if reverse else npeaks[qrows]
+            scores = scipy.sparse.csr_matrix((composite_scores(dots, \
+                ratios, nunk, nshared), (qrows, cols)), shape=scores.shape)
+        hits, scores = _top_k(scores, top_k)
+        # map back to library rows (and keep the -1's for no match)
+        return np.r_[cand_rows, -1][hits], scores
+
+
+def _flatten(spectra, mz_bin):
+    """
+    The spectrum, m/z bin and abundance of every point in spectra.
+    """
+    pts = [(s.x, s.abn) if isinstance(s, Scan) else s for s in spectra]
+    rows = np.repeat(np.arange(len(pts)), [np.size(x) for x, _ in pts])
+    mzs = np.concatenate([np.ravel(x) for x, _ in pts] + [[]])
+    abns = np.concatenate([np.ravel(y) for _, y in pts] + [[]])
+    keys = np.round(mzs.astype(float) / mz_bin).astype(np.int64)
+    return rows, keys, abns.astype(float)
+
+
+def _neutral_losses(spectra, precursors, mz_bin=1.):
+    """
+    The losses from each precursor to the peaks of each spectrum (less
+    the precursor itself); empty where the precursor is NaN.
+    """
+    losses = []
+    for s, prec in zip(spectra, precursors):
+        mzs, abns = (s.x, s.abn) if isinstance(s, Scan) else s
+        loss = prec - np.asarray(mzs, dtype=float)
+        keep = loss >= 0.5 * mz_bin  # NaN precursors keep nothing
+        losses.append((loss[keep], np.asarray(abns, dtype=float)[keep]))
+    return losses
+
+
+def _top_peaks(mat, n):
+    """
+    The positions in mat.data of the n largest values in every row
+    (row by row, largest first) and their ranks within their rows.
+    The values have to be between 0 and 1.
+    """
+    rows = np.repeat(np.arange(mat.shape[0]), np.diff(mat.indptr))
+    # one float key sorts much faster than np.lexsort
+    order = np.argsort(rows + 0.5 * (1. - np.clip(mat.data, 0., 1.)))
+    rank = np.arange(len(order)) - mat.indptr[rows[order]]
+    return order[rank < n], rank[rank < n]
+
+
+def _top_k(scores, k):
+    """
+    The columns and values of the k largest values in every row of
+    the sparse matrix scores.
+    """
+    scores.eliminate_zeros()
+    top, rank = _top_peaks(scores, k)
+    rows = np.repeat(np.arange(scores.shape[0]), np.diff(scores.indptr))[top]
+    hits = -np.ones((scores.shape[0], k), dtype=np.int64)
+    vals = np.zeros((scores.shape[0], k))
+    hits[rows, rank] = scores.indices[top]
+    vals[rows, rank] = scores.data[top]
+    return hits, vals
+
+
+def read_msp(filename):
+    """
+    Reads the names, spectra and precursors out of an NIST/AMDIS *.msp
+    file. The precursor is the PrecursorMZ (or else the MW) of each
+    entry, and NaN if neither is present.
+    """
+    names, spectra, precursors = [], [], []
+    num = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+    with open(filename, 'r') as f:
+        name, pts, prec = None, [], {}
+        for line in f:
+            if ':' in line and not line.lstrip().startswith('('):
+                key, val = line.split(':', 1)
+                key = key.strip().lower()
+                if key == 'name':
+                    if name is not None:
+                        names.append(name)
+                        spectra.append(_msp_peaks(pts))
+                        precursors.append(_msp_precursor(prec))
+                    name, pts, prec = val.strip(), [], {}
+                elif key in {'precursormz', 'mw'}:
+                    prec[key] = val
+            elif name is not None and line.strip() != '':
+                # drop any annotations of the peaks
+                pts += num.findall(re.sub(r'"[^"]*"', '', line))
+        if name is not None:
+            names.append(name)
+            spectra.append(_msp_peaks(pts))
+            precursors.append(_msp_precursor(prec))
+    return names, spectra, precursors
+
+
+def _msp_peaks(pts):
+    pts = np.array(pts[:len(pts) - len(pts) % 2], dtype=float)
+    return pts[0::2], pts[1::2]
+
+
+def _msp_precursor(prec):
+    for key in ('precursormz', 'mw'):
+        try:
+            return float(prec[key].split()[0])
+        except (KeyError, IndexError, ValueError):
+            pass
+    return np.nan
+
+
+def load_library(filename, mz_bin=1., top_n=8):
+    """
+    Opens a library saved with SpectralLibrary.save or an *.msp file.
+
+    The library built from an *.msp file is saved next to it (as
+    filename + '.astonlib'), so it only has to be parsed once.
+    """
+    if op.isdir(filename):
+        return SpectralLibrary.load(filename)
+
+    stamp = file_stamp(filename)
+    lib_path = filename + '.astonlib'
+    try:
+        lib = SpectralLibrary.load(lib_path)
+        if lib.stamp == stamp and lib.mz_bin == mz_bin and \
+           lib.top_n == top_n:
+            return lib
+    except (IOError, OSError, ValueError):
+        pass  # missing or corrupt
+
+    names, spectra, precursors = read_msp(filename)
+    lib = SpectralLibrary.build(names, spectra, mz_bin, top_n, precursors)
+    try:
+        lib.save(lib_path, stamp)
+    except (IOError, OSError):
+        pass  # e.g. a read-only share; we'll just rebuild it next time
+    return lib
@@ -1,9 +1,8 @@
 import numpy as np
+import scipy.sparse
 from scipy.sparse import dia_matrix
 from scipy.sparse import lil_matrix
 
-#TODO: implementations of Stein & Scott 1994 algorithms
-
 
 def find_spectrum_match(spec, spec_lib, method='euclidian'):
     """
@@ -25,3 +24,62 @@ def find_spectrum_match(spec, spec_lib, method='euclidian'):
         dist_sp = spec_lib.multiply(spec_lib) - 2 * spec_lib.dot(st_spc)
         dist = dist_sp.sum(axis=1).A + np.sum(spec ** 2)
     return (dist.argmin(), dist.min())
+
+
+def stein_weights(mzs, abns, mz_power=3., int_power=0.6):
+    """
+    Weights peaks by their m/z and abundance, as in Stein & Scott 1994:
+    abns ** int_power * mzs ** mz_power.
+
+    The defaults are the exponents NIST MS Search uses for EI spectra.
+    """
+    return np.asarray(abns, dtype=float) ** int_power * \
+            np.asarray(mzs, dtype=float) ** mz_power
+
+
+def ratio_scores(unk, ref):
+    """
+    Stein & Scott's ratio of neighbouring peaks term, for every pair of
+    rows of unk and ref (sparse matrices of weighted abundances with the
+    same m/z columns).
+
+    For the n peaks (in m/z order) that two spectra share, this is the
+    mean over their n - 1 neighbours of:
+
+        (ref[i] / ref[i - 1] * unk[i - 1] / unk[i]) ** k
+
+    with k = 1 or -1 so that every term is at most 1. (Stein & Scott
+    divide by n, but then identical spectra wouldn't score 1.)
+
+    Returns
+    -------
+    ratios : np.ndarray
+        The ratio term for every row.
+    nshared : np.ndarray
+        The number of peaks in both spectra in every row.
+    """
+    unk = scipy.sparse.csr_matrix(unk)
+    unk.eliminate_zeros()
+    # ref / unk at every shared peak in one elementwise product
+    rel = scipy.sparse.csr_matrix(ref).multiply(unk.power(-1.)).tocsr()
+    rel.eliminate_zeros()
+    rel.sort_indices()
+
+    nshared = np.diff(rel.indptr)
+    rows = np.repeat(np.arange(rel.shape[0]), nshared)
+    steps = rel.data[1:] / rel.data[:-1]
+    in_row = rows[1:] == rows[:-1]
+    terms = np.where(steps > 1, 1. / steps, steps)[in_row]
+    ratios = np.bincount(rows[1:][in_row], weights=terms, \
+                         minlength=rel.shape[0])
+    return ratios / np.maximum(nshared - 1, 1), nshared
+
+
+def composite_scores(dots, ratios, nunk, nshared):
+    """
+    Stein & Scott's composite score: the (squared) weighted dot product
+    and the ratio term averaged together, weighted by the number of
+    peaks in the unknown and the number of shared peaks.
+    """
+    total = np.asarray(nunk + nshared, dtype=float)
+    return (nunk * dots + nshared * ratios) / np.where(total > 0, total, 1.)
@@ -0,0 +1,94 @@
+import numpy as np
+from aston.spectra.Scan import Scan
+
+
+def merge_spectra(mzs, abns, tol=None, units='da', how='sum'):
+    """
+    Combines many spectra (whose m/z's don't have to line up) into one.
+
+    Every point is concatenated together and sorted by m/z once, so
+    this scales to thousands of high resolution spectra per call.
+
+    Parameters
+    ----------
+    mzs : list of array-like
+        The m/z's of the points in each spectrum.
+    abns : list of array-like
+        The abundances of the points in each spectrum.
+    tol : float, optional
+        Neighbouring m/z's closer than this are binned together (so
+        bins can be wider than tol if there are points all along them)
+        and labelled with their abundance-weighted centroid. By default
+        only identical m/z's are combined.
+    units : {'da', 'ppm'}, optional
+        The units of tol.
+    how : {'sum', 'mean', 'max'}, optional
+        How the abundances in a bin from different spectra are combined.
+        Spectra without any points in a bin count as 0 for 'mean'.
+
+    Returns
+    -------
+    mzs : np.ndarray
+        The sorted m/z of every bin.
+    abns : np.ndarray
+        The combined abundance of every bin.
+    """
+    if how not in {'sum', 'mean', 'max'}:
+        raise ValueError('Unknown aggregation: {}'.format(how))
+    if units not in {'da', 'ppm'}:
+        raise ValueError('Unknown m/z tolerance units: {}'.format(units))
+    nspec = len(mzs)
+    x = np.concatenate([np.ravel(m) for m in mzs] + [[]]).astype(float)
+    a = np.concatenate([np.ravel(v) for v in abns] + [[]]).astype(float)
+    if len(x) == 0:
+        return np.array([]), np.array([])
+
+    srt = np.argsort(x)
+    x, a = x[srt], a[srt]
+
+    # find where each bin starts
+    gaps = np.diff(x)
+    if tol is None:
+        new_bin = gaps > 0
+    elif units == 'ppm':
+        new_bin = gaps > 1e-6 * tol * x[1:]
+    else:
+        new_bin = gaps > tol
+    starts = np.flatnonzero(np.r_[True, new_bin])
+    sums = np.add.reduceat(a, starts)
+
+    if tol is None:
+        bin_mzs = x[starts]
+    else:
+        # bins without any abundance get the plain mean of their m/z's
+        npts = np.diff(np.r_[starts, len(x)])
+        wts = np.where(sums != 0, sums, 1.)
+        bin_mzs = np.where(sums != 0, np.add.reduceat(a * x, starts) / wts, \
+                           np.add.reduceat(x, starts) / npts)
+
+    if how == 'sum':
+        return bin_mzs, sums
+    elif how == 'mean':
+        return bin_mzs, sums / nspec
+
+    # for the max, first sum each spectrum's points in every bin; one
+    # integer key for (bin, spectrum) sorts faster than np.lexsort
+    rows = np.repeat(np.arange(nspec), [np.size(m) for m in mzs])[srt]
+    bins = np.cumsum(np.r_[True, new_bin]) - 1
+    keys = bins * nspec + rows
+    cell_srt = np.argsort(keys)
+    keys = keys[cell_srt]
+    cells = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    cell_sums = np.add.reduceat(a[cell_srt], cells)
+    cell_bins = keys[cells] // nspec
+    bin_st = np.flatnonzero(np.r_[True, cell_bins[1:] != cell_bins[:-1]])
+    return bin_mzs, np.maximum.reduceat(cell_sums, bin_st)
+
+
+def merge_scans(scans, tol=None, units='da', how='sum'):
+    """
+    Combines many Scans into one; see merge_spectra for the options.
+    """
+    mzs, abns = merge_spectra([s.x for s in scans], \
+                              [s.abn for s in scans], tol, units, how)
+    return Scan(mzs, abns)
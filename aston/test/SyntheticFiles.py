@@ -0,0 +1,435 @@
+"""
+Writers for small, fake vendor files. These only fill in the parts
+of each format that Aston actually reads, but that's enough to test
+the readers (and benchmark them) without needing real instrument data.
+"""
+import os
+import struct
+import numpy as np
+
+
+def random_ms_scans(nscans=100, npts=200, mz_range=(40, 400), seed=0):
+    """
+    Generates times and (m/z, abundance) pairs for a fake GC-MS run.
+    """
+    rnd = np.random.RandomState(seed)
+    times = np.linspace(1., 60., nscans)
+    scans = []
+    for _ in range(nscans):
+        mzs = np.sort(rnd.choice(np.arange(*mz_range), npts, replace=False))
+        abns = rnd.randint(0, 2 ** 16, npts)
+        scans.append((mzs, abns))
+    return times, scans
+
+
+def write_agilent_ms(filename, times, scans):
+    """
+    Writes out a Chemstation *.MS file.
+
+    Parameters
+    ----------
+    times : array-like
+        Times of each scan in minutes.
+    scans : list of (array-like, array-like)
+        Pairs of m/z (as floats) and raw abundances (in the 16-bit
+        mantissa/exponent encoding that Agilent uses) for each scan.
+    """
+    header = bytearray(0x200)
+    header[0:2] = b'\x01\x32'
+    struct.pack_into('>H', header, 0x10A, (len(header) + 2) // 2)
+    struct.pack_into('>H', header, 0x118, len(scans))
+
+    with open(filename, 'wb') as f:
+        f.write(header)
+        for t, (mzs, abns) in zip(times, scans):
+            npts = len(mzs)
+            pts = np.empty(2 * npts, dtype='>u2')
+            pts[0::2] = np.round(np.asarray(mzs) * 20)
+            pts[1::2] = abns
+            abns = np.asarray(abns, dtype=np.int64)
+            tic = np.sum((abns & 16383) * 8 ** (abns >> 14))
+            f.write(struct.pack('>HI6xH4x', 14 + 2 * npts, \
+                                int(round(t * 60000)), npts))
+            f.write(pts.tobytes())
+            f.write(struct.pack('>6xI', min(tic, 2 ** 32 - 1)))
+
+
+def write_mzml(filename, times, scans, indexed=True):
+    """
+    Writes out an mzML file with one spectrum per scan and a TIC
+    chromatogram, optionally wrapped as an indexedmzML file.
+
+    Parameters
+    ----------
+    times : array-like
+        Scan start times.
+    scans : list of (array-like, array-like)
+        Pairs of m/z and abundance for each scan.
+    """
+    import base64
+
+    def cv(acc, value=''):
+        return '<cvParam cvRef="MS" accession="{}" name="" value="{}"/>' \
+                .format(acc, value)
+
+    def bin_arr(a, acc):
+        d = base64.b64encode(np.asarray(a, dtype='<f8').tobytes())
+        return '<binaryDataArray encodedLength="{}">'.format(len(d)) + \
+                cv('MS:1000523') + cv('MS:1000576') + cv(acc) + \
+                '<binary>' + d.decode('ascii') + '</binary></binaryDataArray>'
+
+    xml = '<?xml version="1.0" encoding="utf-8"?>\n'
+    if indexed:
+        xml += '<indexedmzML xmlns="http://psi.hupo.org/ms/mzml">\n'
+    xml += '<mzML xmlns="http://psi.hupo.org/ms/mzml" version="1.1.0">\n'
+    xml += '<run id="R1">\n<spectrumList count="{}">\n'.format(len(scans))
+
+    offsets = {'spectrum': [], 'chromatogram': []}
+    for i, (t, (mzs, abns)) in enumerate(zip(times, scans)):
+        offsets['spectrum'].append(len(xml.encode('utf-8')))
+        xml += '<spectrum index="{0}" id="scan={0}" '.format(i) + \
+                'defaultArrayLength="{}">'.format(len(mzs)) + \
+                cv('MS:1000579') + '<scanList count="1"><scan>' + \
+                cv('MS:1000016', t) + '</scan></scanList>' + \
+                '<binaryDataArrayList count="2">' + \
+                bin_arr(mzs, 'MS:1000514') + bin_arr(abns, 'MS:1000515') + \
+                '</binaryDataArrayList></spectrum>\n'
+    xml += '</spectrumList>\n<chromatogramList count="1">\n'
+    offsets['chromatogram'].append(len(xml.encode('utf-8')))
+    xml += '<chromatogram index="0" id="TIC">' + cv('MS:1000235') + \
+            '<binaryDataArrayList count="2">' + \
+            bin_arr(times, 'MS:1000595') + \
+            bin_arr([np.sum(s[1]) for s in scans], 'MS:1000515') + \
+            '</binaryDataArrayList></chromatogram>\n'
+    xml += '</chromatogramList>\n</run>\n</mzML>\n'
+
+    if indexed:
+        idx_offset = len(xml.encode('utf-8'))
+        xml += '<indexList count="2">\n'
+        for name in ('spectrum', 'chromatogram'):
+            xml += '<index name="{}">\n'.format(name)
+            for i, off in enumerate(offsets[name]):
+                xml += '<offset idRef="{}">{}</offset>\n'.format(i, off)
+            xml += '</index>\n'
+        xml += '</indexList>\n'
+        xml += '<indexListOffset>{}</indexListOffset>\n'.format(idx_offset)
+        xml += '</indexedmzML>\n'
+
+    with open(filename, 'wb') as f:
+        f.write(xml.encode('utf-8'))
+
+
+def _ch_deltas(values, marker, every, escape, order=1):
+    """
+    Encodes integers as the (big-endian int16) differences used in
+    Agilent *.ch files, escaping to an absolute value at the start,
+    every so often, and whenever a difference won't fit.
+
+    Returns
+    -------
+    list of bytes
+        The encoded words for each value.
+    """
+    out, prev, delt = [], None, 0
+    for i, v in enumerate(int(v) for v in values):
+        d = None
+        if prev is not None and i % every != 0:
+            d = v - prev if order == 1 else v - prev - delt
+        if d is None or not -32767 <= d < 32767:
+            out.append(struct.pack('>h', marker) + escape(v))
+            delt = 0
+        else:
+            out.append(struct.pack('>h', d))
+            delt += d
+        prev = v
+    return out
+
+
+def write_agilent_ch(filename, times, values, kind='MWD', \
+                     wavelength=254, del_ab=1e-3, every=300):
+    """
+    Writes out a Chemstation *.ch file.
+
+    Parameters
+    ----------
+    times : array-like
+        Times in minutes (only the first and last are stored).
+    values : array-like
+        The signal (in multiples of del_ab, for the UV formats).
+    kind : {'MWD', 'MWD2', 'FID'}
+        MWD and MWD2 are the old and new UV formats; FID is an old
+        (0238) FID file.
+    every : int, optional
+        Number of values between absolute values.
+    """
+    values = np.round(np.asarray(values)).astype(np.int64)
+    st_t, en_t = int(round(times[0] * 60000)), int(round(times[-1] * 60000))
+    sig = 'DAD1 A, Sig={},4 Ref=off'.format(wavelength)
+    if kind == 'FID':
+        header = bytearray(0x400)
+        header[0:2] = b'\x02\x38'
+        struct.pack_into('>f', header, 0x11A, st_t)
+        esc = lambda v: struct.pack('>iH', v // 65534, v % 65534)
+        words = _ch_deltas(values, 32767, every, esc, order=2)
+        with open(filename, 'wb') as f:
+            f.write(header + b''.join(words))
+        return
+
+    esc = lambda v: struct.pack('>i', v)
+    words = _ch_deltas(values, -32768, every, esc)
+    if kind == 'MWD':
+        header = bytearray(0x400)
+        header[0:4] = b'\x02\x33\x02\x33'
+        header[0x254] = len(sig)
+        header[0x255:0x255 + len(sig)] = sig.encode('ascii')
+        struct.pack_into('>d', header, 0x284, del_ab)
+    else:
+        header = bytearray(0x1800)
+        header[0:2] = b'\x03\x31'
+        header[0x1075] = len(sig)
+        header[0x1076:0x1076 + 2 * len(sig)] = sig.encode('utf-16-le')
+        struct.pack_into('>d', header, 0x127C, del_ab)
+    struct.pack_into('>ii', header, 0x11A, st_t, en_t)
+
+    with open(filename, 'wb') as f:
+        f.write(header)
+        for i in range(0, len(words), 255):
+            rec = words[i:i + 255]
+            f.write(struct.pack('>BB', 0x10, len(rec)) + b''.join(rec))
+        f.write(b'\x00\x00')
+
+
+def write_agilent_uv(filename, times, wvs, spectra, kind='CSDAD', \
+                     every=50, pad=False):
+    """
+    Writes out a Chemstation *.uv file of diode array spectra.
+
+    Parameters
+    ----------
+    times : array-like
+        Times of each scan in minutes.
+    wvs : tuple
+        The start, end (exclusive) and step of the wavelengths (in
+        multiples of 0.05 nm).
+    spectra : array-like
+        The absorbances (in multiples of 1/2000) at each wavelength of
+        each scan.
+    kind : {'CSDAD', 'CSDAD2'}
+        The old (0233) or new (0331) format.
+    pad : bool
+        Add a byte to the end of every other scan, so the ones after
+        them start on odd offsets.
+    """
+    spectra = np.round(np.asarray(spectra)).astype(np.int64)
+    data_st = 0x202 if kind == 'CSDAD' else 0x1002
+    header = bytearray(data_st)
+    header[0:2] = b'\x02\x33' if kind == 'CSDAD' else b'\x03\x31'
+    struct.pack_into('>i', header, 0x116, len(times))
+
+    esc = lambda v: struct.pack('<i', v)
+    with open(filename, 'wb') as f:
+        f.write(header)
+        for i, (t, spc) in enumerate(zip(times, spectra)):
+            words = _ch_deltas(spc, -32768, every, esc)
+            # swap the differences into little-endian
+            words = [w[1::-1] + w[2:] for w in words]
+            if kind == 'CSDAD':
+                words = [b'\x00\x00'] + words
+            body = b''.join(words)
+            if pad and i % 2 == 0:
+                body += b'\x00'
+            f.write(struct.pack('<HIHHH8x', 20 + len(body), \
+                                int(round(t * 60000)), *wvs))
+            f.write(body)
+
+
+def write_agilent_dad(filename, times, wvs, spectra, pad=False):
+    """
+    Writes out the *.sd (headers) and *.sp (spectra) files of an
+    Agilent DAD run; filename should end in .sd.
+
+    Parameters
+    ----------
+    wvs : tuple
+        The first wavelength, the step, and the number of them.
+    pad : bool
+        Leave gaps of different sizes between the scans.
+    """
+    spectra = np.asarray(spectra, dtype='<f8')
+    header = bytearray(0xA4)
+    struct.pack_into('<Q', header, 0x50, len(times))
+    offset = 0x44
+    with open(filename[:-3] + '.sd', 'wb') as fhead, \
+         open(filename[:-3] + '.sp', 'wb') as fdata:
+        fhead.write(header)
+        fdata.write(bytearray(offset))
+        for i, (t, spc) in enumerate(zip(times, spectra)):
+            fhead.write(struct.pack('<IdddIQIIdddd', 0, t, 0, wvs[1], 0, \
+                                    offset, 0, wvs[2], wvs[0], 0, 0, 0))
+            gap = bytearray(i % 3 if pad else 0)
+            fdata.write(bytearray(16) + spc.tobytes() + gap)
+            offset += 16 + 8 * len(spc) + len(gap)
+
+
+def write_andi_ms(filename, times, scans):
+    """
+    Writes out the point arrays of an AIA/ANDI *.CDF file.
+
+    Parameters
+    ----------
+    times : array-like
+        Times of each scan in minutes.
+    scans : list of (array-like, array-like)
+        The m/z's and abundances of the points in each scan.
+    """
+    from aston.tracefile.NetCDF import NetCDFFile
+
+    npts = np.array([len(mzs) for mzs, _ in scans], dtype='i')
+    f = NetCDFFile(filename, 'w')
+    f.createDimension('scan_number', len(scans))
+    f.createDimension('point_number', int(npts.sum()))
+    for name, dtype, dim, values in ( \
+      ('scan_acquisition_time', '>d', 'scan_number', 60. * np.asarray(times)), \
+      ('total_intensity', '>d', 'scan_number', \
+       [np.sum(abns) for _, abns in scans]), \
+      ('point_count', '>i', 'scan_number', npts), \
+      ('scan_index', '>i', 'scan_number', np.cumsum(npts) - npts), \
+      ('mass_values', '>f', 'point_number', \
+       np.concatenate([mzs for mzs, _ in scans])), \
+      ('intensity_values', '>f', 'point_number', \
+       np.concatenate([abns for _, abns in scans]))):
+        f.createVariable(name, dtype, (dim,))[:] = values
+    f.close()
+
+
+def write_waters_autospec(filename, times, scans):
+    """
+    Writes out a Waters Autospec *.IDX file and the *.DAT file next
+    to it.
+
+    Parameters
+    ----------
+    times : array-like
+        Times of each scan.
+    scans : list of (array-like, array-like)
+        The (integer) ions and abundances of the points in each scan.
+    """
+    dat = open(filename[:-4] + '.DAT', 'wb')
+    with open(filename, 'wb') as f:
+        for t, (ions, abns) in zip(times, scans):
+            pts = np.empty((len(ions), 2), dtype='<u2')
+            pts[:, 0], pts[:, 1] = abns, ions
+            f.write(struct.pack('<IHHffhhh', dat.tell(), 4 * len(ions), 0, \
+                                np.sum(abns), t, 0, 10, 0x80))
+            dat.write(pts.tobytes())
+    dat.close()
+
+
+def write_bruker_ami(filename, times, scans):
+    """
+    Writes out a Bruker *.AMI file.
+
+    Parameters
+    ----------
+    times : array-like
+        Times of each scan in minutes.
+    scans : list of (array-like, array-like)
+        The m/z's and abundances of the points in each scan.
+    """
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('<ii', 0, len(times)))
+        f.write((60. * np.asarray(times, dtype='<f8')).tobytes())
+        f.write(struct.pack('<i', len(times)))
+        for mzs, abns in scans:
+            f.write(struct.pack('<i', len(mzs)))
+            f.write(np.asarray(mzs, dtype='<f4').tobytes())
+            f.write(struct.pack('<i', len(abns)))
+            f.write(np.asarray(abns, dtype='<f4').tobytes())
+
+
+_MH_XSD = """<?xml version="1.0" encoding="utf-8"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:complexType name="SpectrumParamsType">
+    <xs:sequence>
+      <xs:element name="SpectrumFormatID" type="xs:byte"/>
+      <xs:element name="SpectrumOffset" type="xs:long"/>
+      <xs:element name="ByteCount" type="xs:int"/>
+      <xs:element name="PointCount" type="xs:int"/>
+      <xs:element name="MinX" type="xs:double"/>
+      <xs:element name="MaxX" type="xs:double"/>
+    </xs:sequence>
+  </xs:complexType>
+  <xs:complexType name="ScanRecordType">
+    <xs:sequence>
+      <xs:element name="ScanID" type="xs:int"/>
+      <xs:element name="ScanTime" type="xs:double"/>
+      <xs:element name="TIC" type="xs:double"/>
+      <xs:element name="BasePeakMZ" type="xs:double"/>
+      <xs:element name="MzOfInterest" type="xs:double"/>
+      <xs:element name="SpectrumParamValues" type="SpectrumParamsType"/>
+    </xs:sequence>
+  </xs:complexType>
+</xs:schema>
+"""
+
+
+def write_agilent_mh(filename, times, scans, compress=False):
+    """
+    Writes out a MassHunter MSScan.bin file (and the MSScan.xsd and
+    MSProfile.bin files next to it).
+
+    Parameters
+    ----------
+    times : array-like
+        Times of each scan in minutes.
+    scans : list of (array-like, array-like)
+        The m/z's and abundances of the points in each scan. Only the
+        first and last m/z are stored (the rest are assumed to be evenly
+        spaced between them).
+    compress : bool, optional
+        Store the profiles as deflated integers instead of floats.
+    """
+    import zlib
+
+    path = os.path.dirname(filename)
+    with open(os.path.join(path, 'MSScan.xsd'), 'w') as f:
+        f.write(_MH_XSD)
+
+    prof = open(os.path.join(path, 'MSProfile.bin'), 'wb')
+    with open(filename, 'wb') as f:
+        f.write(b'\x01\x01' + (0x58 - 2) * b'\x00')
+        f.write(struct.pack('<i', 0x60) + 4 * b'\x00')
+        for i, (t, (mzs, abns)) in enumerate(zip(times, scans)):
+            if compress:
+                d = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+                data = struct.pack('dd', 0, 0) + \
+                        np.asarray(abns, dtype='<i4').tobytes()
+                data = d.compress(data) + d.flush()
+            else:
+                data = struct.pack('dd', 0, 0) + \
+                        np.asarray(abns, dtype='<f4').tobytes()
+            f.write(struct.pack('<iddddbqiidd', i, t, np.sum(abns), \
+                                mzs[np.argmax(abns)], 0, 1 if compress else 2, \
+                                prof.tell(), len(data), len(abns), \
+                                mzs[0], mzs[-1]))
+            prof.write(data)
+    prof.close()
+
+
+def write_msp(filename, names, spectra, precursors=None):
+    """
+    Writes out a NIST/AMDIS *.msp library of names and spectra (a list
+    of (m/z's, abundances) pairs) and optionally their precursor m/z's.
+    """
+    if precursors is None:
+        precursors = [None] * len(names)
+    with open(filename, 'w') as f:
+        for name, (mzs, abns), prec in zip(names, spectra, precursors):
+            f.write('Name: {}\n'.format(name))
+            if prec is not None:
+                f.write('PrecursorMZ: {:g}\n'.format(prec))
+            f.write('Num Peaks: {}\n'.format(len(mzs)))
+            for i in range(0, len(mzs), 5):
+                f.write(' '.join('{:g} {:g};'.format(m, a) for m, a \
+                                 in zip(mzs[i:i + 5], abns[i:i + 5])) + '\n')
+            f.write('\n')
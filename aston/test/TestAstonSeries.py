@@ -1,6 +1,7 @@
 import numpy as np
 import base64
-from aston.trace.Trace import AstonSeries
+import scipy.sparse
+from aston.trace.Trace import AstonSeries, AstonFrame
 from aston.trace.Trace import decompress
 
 
@@ -24,9 +25,10 @@ def test_add():
 def test_compress():
     a = AstonSeries(np.array([10, 20, 30, 40, 50]), \
                     np.array([1, 2, 3, 4, 5]), name='X')
-    zdata = 'eJxjZWBgEAHiaKUIpVgGhgZ7INsBiIC4' + \
-            'AYgXADEIqEBpEyhtB6VdoLSnAwAZfgbw'
-    assert base64.b64encode(a.compress()).decode('ascii') == zdata
+    b = decompress(a.compress())
+    assert b.name == 'X'
+    assert np.all(np.equal(a.values, b.values))
+    assert np.all(np.equal(a.index, b.index))
 
 
 def test_decompress():
@@ -36,9 +38,97 @@ def test_decompress():
     assert ts.name == 'X'
 
 
+def test_compress_frame():
+    t = np.linspace(0, 10, 2000)
+    v = scipy.sparse.random(2000, 30, density=0.1, format='csr', \
+                            random_state=0)
+    a = AstonFrame(v, t, list(range(30)))
+    b = decompress(a.compress())
+    assert scipy.sparse.issparse(b.values)
+    assert (b.values != a.values).nnz == 0
+    assert np.all(np.equal(a.index, b.index))
+    assert b.columns == list(range(30))
+
+    # only decompress part of the frame
+    c = decompress(a.compress(), twin=(2, 3))
+    assert abs(c.index[0] - 2) < 0.01 and abs(c.index[-1] - 3) < 0.01
+    st = np.searchsorted(t, c.index[0])
+    assert (c.values != a.values[st:st + len(c.index)]).nnz == 0
+
+
 #def test_tsfunc():
 #    a = AstonSeries(np.array([[0, 1, 2, 1, 0], [0, 0, 2, 0, 0]]).T, \
 #                   np.array([1, 2, 3, 4, 5]), [1, 2])
 #    grad = ts_func(np.gradient)
 #    c = grad(a.trace(1)) / grad(AstonSeries(a.times, a.times))
 #    assert np.all(c.y == np.array([1., 1., 0., -1., -1.]))
+
+
+def test_traces_for():
+    vals = np.arange(20.).reshape(4, 5)
+    cols = ['57', '57.2', '71', 'x', '85']
+    for v in (vals, scipy.sparse.csr_matrix(vals)):
+        a = AstonFrame(v, np.array([1, 2, 3, 4]), cols)
+        xics = a.traces_for([57, 71, 100], tol=0.5)
+        assert xics.columns == [57, 71, 100]
+        assert np.all(xics.values[:, 0] == vals[:, 0] + vals[:, 1])
+        assert np.all(xics.values[:, 1] == vals[:, 2])
+        assert np.all(np.isnan(xics.values[:, 2]))
+        assert np.all(a.trace('85').values == vals[:, 4])
+        assert np.all(a.traces_for([57], 0.1).values[:, 0] == vals[:, 0])
+
+
+def test_twin():
+    t = np.array([1., 2., 2., 3., 4.5, 5., 7.])
+    a = AstonSeries(np.arange(7), t, name='X')
+    b = AstonSeries(np.arange(7), t[::-1], name='X')
+    for twin in [(0, 10), (1.9, 3.1), (2.5, 4.75), (3.8, 6), (6.5, 8)]:
+        for ts in (a, b):
+            st = np.abs(ts.index - twin[0]).argmin()
+            en = np.abs(ts.index - twin[1]).argmin() + 1
+            assert np.all(ts.twin(twin).values == ts.values[st:en])
+
+
+def test_get_point():
+    t = np.array([1., 2., 3., 4., 5.])
+    a = AstonSeries(np.array([10, 20, 30, 40, 50]), t, name='X')
+    assert a.get_point(2.5) == 25
+    pts = a.get_point(np.array([0., 1., 3.25, 5., 6.]))
+    assert np.allclose(pts, [0, 10, 32.5, 50, 0])
+    b = AstonSeries(a.values[::-1], t[::-1], name='X')
+    assert np.allclose(b.get_point(np.array([0., 3.25])), [0, 32.5])
+
+
+def test_retime_math():
+    a = AstonSeries(np.array([10., 20, 30, 40, 50]), \
+                    np.array([1., 2, 3, 4, 5]), name='X')
+    b = AstonSeries(np.array([1., 2, 3]), np.array([1.5, 2.5, 3.5]), name='Y')
+    c = a + b
+    assert np.allclose(c.values, [10, 21.5, 32.5, 40, 50])
+    assert np.allclose((2 - b).values, [1, 0, -1])
+    assert np.allclose((a / b).values[1:3], [20 / 1.5, 30 / 2.5])
+
+
+def test_inplace_math():
+    t = np.array([1, 2, 3])
+    a = AstonSeries(np.array([1., 2, 3]), t, name='X')
+    vals = a.values
+    a += AstonSeries(np.array([1., 1, 1]), t, name='Y')
+    a *= 2
+    assert a.values is vals
+    assert np.all(a.values == [4, 6, 8])
+
+    b = AstonSeries(np.array([1, 2, 3]), t, name='X')
+    b /= 2
+    assert np.allclose(b.values, [0.5, 1, 1.5])
+
+
+def test_frame_math():
+    vals = np.arange(6.).reshape(3, 2)
+    a = AstonFrame(vals.copy(), np.array([1, 2, 3]), ['57', '71'])
+    s = AstonSeries(np.array([1., 2, 3]), np.array([1, 2, 3]), name='X')
+    assert np.all((a * s).values == vals * [[1], [2], [3]])
+    assert np.all((-a).values == -vals)
+    sp = AstonFrame(scipy.sparse.csr_matrix(vals), a.index, a.columns)
+    assert scipy.sparse.issparse((sp * 2).values)
+    assert np.all((sp + 1).values == vals + 1)
@@ -0,0 +1,120 @@
+import csv
+import os
+import shutil
+import sqlite3
+import tempfile
+import numpy as np
+from aston.batch import process_directory
+from aston.peaks.Workers import close_worker_pool
+from aston.test.SyntheticFiles import write_agilent_ms
+
+
+def _write_runs(path, nruns=3):
+    t = np.linspace(1, 20, 1500)
+    for i in range(nruns):
+        run_dir = os.path.join(path, 'proj', 'run{}.D'.format(i))
+        os.makedirs(run_dir)
+        y = sum(np.exp(-0.5 * ((t - x) / 0.05) ** 2) for x in (5, 9 + i, 15))
+        scans = [(np.array([57., 71.]), np.array([int(1000 + 8000 * v), 500])) \
+                 for v in y]
+        write_agilent_ms(os.path.join(run_dir, 'DATA.MS'), t, scans)
+
+
+def test_process_directory_sqlite():
+    data_dir, out_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+    try:
+        _write_runs(data_dir)
+        out = os.path.join(out_dir, 'peaks.db')
+        summary = process_directory(data_dir, out, processes=1, log=None)
+        assert summary['files'] == 3 and summary['errors'] == 0
+        assert summary['peaks'] == 9
+
+        db = sqlite3.connect(out)
+        times = [r[0] for r in db.execute('SELECT time FROM batch_peaks ' \
+                                          'ORDER BY time')]
+        db.close()
+        assert len(times) == 9
+        assert abs(times[0] - 5) < 0.05 and abs(times[-1] - 15) < 0.05
+
+        # nothing changed, so nothing is redone
+        summary = process_directory(data_dir, out, processes=1, log=None)
+        assert summary['files'] == 0 and summary['skipped'] == 3
+
+        # unless the file changes
+        fn = os.path.join(data_dir, 'proj', 'run0.D', 'DATA.MS')
+        st = os.stat(fn)
+        os.utime(fn, (st.st_atime, st.st_mtime + 10))
+        summary = process_directory(data_dir, out, processes=1, log=None)
+        assert summary['files'] == 1 and summary['skipped'] == 2
+    finally:
+        shutil.rmtree(data_dir)
+        shutil.rmtree(out_dir)
+
+
+def test_process_directory_csv():
+    data_dir = tempfile.mkdtemp()
+    try:
+        _write_runs(data_dir, nruns=2)
+        # the output lives in the directory being processed
+        out = os.path.join(data_dir, 'peaks.csv')
+        summary = process_directory(data_dir, out, traces=['tic', '57'], \
+                                    processes=1, log=None)
+        assert summary['files'] == 2 and summary['peaks'] == 12
+
+        with open(out) as f:
+            rows = list(csv.reader(f))
+        assert tuple(rows[0]) == ('path', 'trace', 'peak', 'time', 't0', \
+                                  't1', 'height', 'width', 'area')
+        assert len(rows) == 13
+        assert set(r[1] for r in rows[1:]) == set(['tic', '57'])
+
+        summary = process_directory(data_dir, out, traces=['tic', '57'], \
+                                    processes=1, log=None)
+        assert summary['files'] == 0 and summary['skipped'] == 2
+
+        summary = process_directory(data_dir, out, traces=['tic'], \
+                                    processes=1, restart=True, log=None)
+        assert summary['files'] == 2 and summary['peaks'] == 6
+    finally:
+        shutil.rmtree(data_dir)
+
+
+def test_process_missing_directory():
+    out_dir = tempfile.mkdtemp()
+    try:
+        out = os.path.join(out_dir, 'peaks.csv')
+        try:
+            process_directory(os.path.join(out_dir, 'missing'), out, \
+                              processes=1, log=None)
+            assert False
+        except IOError:
+            pass
+        assert not os.path.exists(out)
+    finally:
+        shutil.rmtree(out_dir)
+
+
+def test_process_directory_pool():
+    data_dir, out_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+    try:
+        _write_runs(data_dir)
+        serial = process_directory(data_dir, \
+                                   os.path.join(out_dir, 'serial.csv'), \
+                                   traces=['tic', '57'], processes=1, \
+                                   log=None)
+        pooled = process_directory(data_dir, \
+                                   os.path.join(out_dir, 'pooled.csv'), \
+                                   traces=['tic', '57'], processes=2, \
+                                   log=None)
+        assert pooled['files'] == 3 and pooled['errors'] == 0
+        assert pooled['peaks'] == serial['peaks'] == 18
+
+        rows = {}
+        for name in ('serial', 'pooled'):
+            with open(os.path.join(out_dir, name + '.csv')) as f:
+                rows[name] = sorted(tuple(r) for r in csv.reader(f))
+        assert rows['serial'] == rows['pooled']
+    finally:
+        close_worker_pool()
+        shutil.rmtree(data_dir)
+        shutil.rmtree(out_dir)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from aston.database import quick_sqlite
+from aston.database.File import Project, Run, Analysis
+from aston.database.Palette import Palette, PaletteRun
+from aston.database.Create import read_directory, simple_auth
+from aston.test.SyntheticFiles import random_ms_scans, write_agilent_ms
+
+
+def test_read_directory():
+    path = tempfile.mkdtemp()
+    try:
+        times, scans = random_ms_scans(10, 10)
+        for proj in ('proj0', 'proj1'):
+            for i in range(3):
+                run_dir = os.path.join(path, proj, 'run{}.D'.format(i))
+                os.makedirs(run_dir)
+                write_agilent_ms(os.path.join(run_dir, 'DATA.MS'), \
+                                 times, scans)
+                with open(os.path.join(run_dir, 'notes.txt'), 'w') as f:
+                    f.write('not a data file')
+
+        db = quick_sqlite(os.path.join(path, 'aston.sqlite'))
+        simple_auth(db)
+        read_directory(path, db, batch_size=4)
+        assert db.query(Project).count() == 3
+        assert db.query(Run).count() == 6
+        assert db.query(Analysis).count() == 6
+        anal = db.query(Analysis).join(Run).join(Project) \
+                .filter(Project.name == 'proj1', Run.path == 'run2.D').one()
+        assert anal.path == os.path.join('run2.D', 'DATA.MS')
+        assert anal.filetype == 'AgilentMS' and anal.trace == '#ms'
+        assert anal.size == os.path.getsize(anal.datafile.filename)
+
+        # reading it again doesn't add anything
+        read_directory(path, db)
+        assert db.query(Analysis).count() == 6
+
+        # but changed files are read again
+        fn = anal.datafile.filename
+        st = os.stat(fn)
+        os.utime(fn, (st.st_atime, st.st_mtime + 10))
+        read_directory(path, db)
+        assert db.query(Analysis).count() == 6
+        db.refresh(anal)
+        assert anal.mtime == st.st_mtime + 10
+        db.close()
+    finally:
+        shutil.rmtree(path)
+
+
+def test_read_directory_moved():
+    path = tempfile.mkdtemp()
+    try:
+        times, scans = random_ms_scans(10, 10)
+        for i in range(2):
+            run_dir = os.path.join(path, 'proj', 'run{}.D'.format(i))
+            os.makedirs(run_dir)
+            write_agilent_ms(os.path.join(run_dir, 'DATA.MS'), \
+                             times, scans[i:] + scans[:i])
+
+        db = quick_sqlite(os.path.join(path, 'aston.sqlite'))
+        simple_auth(db)
+        read_directory(path, db)
+        anal = db.query(Analysis).filter(Analysis.path.like('run1.D%')).one()
+        assert anal.md5hash == anal.datafile.md5hash()
+        anal_id, md5 = anal._analysis_id, anal.md5hash
+
+        # moving a run relinks its analysis instead of adding a new one
+        os.rename(os.path.join(path, 'proj', 'run1.D'), \
+                  os.path.join(path, 'proj', 'moved.D'))
+        read_directory(path, db)
+        assert db.query(Analysis).count() == 2
+        anal = db.query(Analysis).filter_by(_analysis_id=anal_id).one()
+        assert anal.path == os.path.join('moved.D', 'DATA.MS')
+        assert anal.run.path == 'moved.D' and anal.md5hash == md5
+
+        # changing the contents of a file updates its hash
+        write_agilent_ms(anal.datafile.filename, times, scans[:5])
+        read_directory(path, db)
+        db.refresh(anal)
+        assert anal.md5hash != md5
+        assert anal.md5hash == anal.datafile.md5hash()
+        db.close()
+    finally:
+        shutil.rmtree(path)
+
+
+def test_palette_run_traces():
+    path = tempfile.mkdtemp()
+    try:
+        times, scans = random_ms_scans(30, 40)
+        run_dir = os.path.join(path, 'proj', 'run0.D')
+        os.makedirs(run_dir)
+        write_agilent_ms(os.path.join(run_dir, 'DATA.MS'), times, scans)
+
+        db = quick_sqlite(':memory:')
+        simple_auth(db)
+        read_directory(path, db)
+        prun = PaletteRun(run=db.query(Run).one(), enabled=True)
+        prun.palette = db.query(Palette).first()
+        db.add(prun)
+        db.commit()
+
+        mz = str(int(scans[0][0][0]))
+        istrs = ['tic', mz, '{}:{}'.format(mz, int(mz) + 2), \
+                 u'{}±0.3'.format(mz), mz + '#ms', 'nothing#ms']
+        batch = prun.traces(istrs, twin=(5., 20.))
+        assert len(batch) == len(istrs)
+        for istr, tr in zip(istrs, batch):
+            ref = prun.trace(istr, twin=(5., 20.))
+            assert np.allclose(tr.index, ref.index)
+            assert np.allclose(tr.values, ref.values, equal_nan=True)
+        assert np.any(batch[1].values > 0)
+        db.close()
+    finally:
+        shutil.rmtree(path)
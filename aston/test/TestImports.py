@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+
+CHECK_IMPORTS = """
+import sys
+import aston.trace.Trace, aston.trace.Parser, aston.trace.MathFrames
+import aston.trace.Events
+import aston.peaks.Peak, aston.peaks.PeakFinding, aston.peaks.Integrators
+import aston.peaks.PeakFitting, aston.peaks.Workers
+import aston.spectra.Scan
+import aston.database.File, aston.database.Create, aston.database.Palette
+import aston.batch
+from aston.tracefile.Common import tfclasses
+tfclasses()
+gui = [m for m in sys.modules if m.split('.')[0] in \\
+       ('PyQt4', 'sip', 'matplotlib')]
+print(','.join(gui))
+"""
+
+
+def test_headless_imports():
+    # run in a new interpreter, because the rest of the tests
+    # may have already imported these
+    root = os.path.dirname(os.path.dirname(os.path.dirname( \
+        os.path.abspath(__file__))))
+    out = subprocess.check_output([sys.executable, '-c', CHECK_IMPORTS], \
+                                  cwd=root)
+    assert out.decode('ascii').strip() == ''
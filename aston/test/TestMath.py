@@ -1,3 +1,11 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from aston.spectra.Scan import Scan
+from aston.spectra.Merge import merge_spectra, merge_scans
+from aston.spectra.Library import SpectralLibrary, load_library, read_msp
+from aston.spectra.Math import stein_weights, ratio_scores, composite_scores
 from aston.spectra.Isotopes import delta13C_Santrock
 
 
@@ -8,3 +16,178 @@ def test_delta13c():
     d13c = delta13C_Santrock(r45sam, r46sam, d13cstd, r45std, r46std,
                     ks='Isodat', d18ostd=-21.097)
     assert abs(d13c - (-40.30)) < 0.002
+
+
+def test_merge_spectra():
+    mzs = [[57., 71., 85.], [71., 57.01], [100.]]
+    abns = [[10., 20., 30.], [5., 40.], [1.]]
+    x, y = merge_spectra(mzs, abns)
+    assert np.allclose(x, [57., 57.01, 71., 85., 100.])
+    assert np.allclose(y, [10., 40., 25., 30., 1.])
+
+    # binning labels each bin with its centroid
+    x, y = merge_spectra(mzs, abns, tol=0.05)
+    assert np.allclose(x, [(57. * 10 + 57.01 * 40) / 50, 71., 85., 100.])
+    assert np.allclose(y, [50., 25., 30., 1.])
+    x, y = merge_spectra(mzs, abns, tol=200, units='ppm')
+    assert np.allclose(y, [50., 25., 30., 1.])
+    x, y = merge_spectra(mzs, abns, tol=10, units='ppm')
+    assert len(x) == 5
+
+    x, y = merge_spectra(mzs, abns, tol=0.05, how='mean')
+    assert np.allclose(y, np.array([50., 25., 30., 1.]) / 3)
+    x, y = merge_spectra(mzs, abns, tol=0.05, how='max')
+    assert np.allclose(y, [40., 20., 30., 1.])
+    # points from the same spectrum in a bin are summed first
+    x, y = merge_spectra([[57., 57.01], [57.]], [[10., 15.], [20.]], \
+                         tol=0.05, how='max')
+    assert np.allclose(y, [25.])
+
+    x, y = merge_spectra([], [])
+    assert len(x) == 0 and len(y) == 0
+
+
+def test_merge_scans_large():
+    rnd = np.random.RandomState(0)
+    scans = [Scan(np.sort(rnd.uniform(50, 500, 1000)), \
+                  rnd.uniform(0, 100, 1000)) for _ in range(200)]
+    scn = merge_scans(scans, tol=20, units='ppm')
+    assert np.all(np.diff(scn.x) > 0)
+    assert np.isclose(np.sum(scn.abn), sum(np.sum(s.abn) for s in scans))
+
+
+def _random_spectra(nspec, seed=0):
+    rnd = np.random.RandomState(seed)
+    spectra = []
+    for _ in range(nspec):
+        npts = rnd.randint(5, 40)
+        mzs = np.sort(rnd.choice(np.arange(30., 400.), npts, replace=False))
+        spectra.append((mzs, rnd.exponential(100., npts)))
+    return spectra
+
+
+def test_spectral_library():
+    spectra = _random_spectra(300)
+    lib = SpectralLibrary.build(['c{}'.format(i) for i in range(300)], \
+                                spectra)
+    assert len(lib) == 300
+    assert np.isclose(lib.spectrum(5).abn.max(), 1.)
+    assert np.allclose(lib.spectrum(5).x, spectra[5][0])
+
+    # noisy copies of the library spectra should find the originals
+    rnd = np.random.RandomState(1)
+    queries = [Scan(mzs + rnd.normal(0, 0.1, len(mzs)), \
+                    5 * abns * rnd.uniform(0.9, 1.1, len(abns))) \
+               for mzs, abns in spectra[:50]]
+    hits, scores = lib.search(queries, top_k=3)
+    assert hits.shape == (50, 3)
+    assert np.all(hits[:, 0] == np.arange(50))
+    assert np.all(scores[:, 0] > 0.98)
+    assert np.all(np.diff(scores, axis=1) <= 0)
+
+    # the prefilter shouldn't change the best hits
+    full_hits, full_scores = lib.search(queries, top_k=3, prefilter=False)
+    assert np.all(full_hits[:, 0] == hits[:, 0])
+    assert np.allclose(full_scores[:, 0], scores[:, 0])
+
+    # spectra that don't match anything
+    hits, scores = lib.search([([1000.], [1.]), ([], [])], top_k=2)
+    assert np.all(hits == -1) and np.all(scores == 0)
+
+
+def test_library_files():
+    from aston.test.SyntheticFiles import write_msp
+
+    path = tempfile.mkdtemp()
+    try:
+        spectra = _random_spectra(20)
+        names = ['compound {}'.format(i) for i in range(20)]
+        msp = os.path.join(path, 'test.msp')
+        write_msp(msp, names, spectra, [100. + i for i in range(20)])
+        rd_names, rd_spectra, rd_precs = read_msp(msp)
+        assert rd_names == names
+        assert np.allclose(rd_precs, 100. + np.arange(20))
+        assert np.allclose(rd_spectra[3][0], spectra[3][0])
+
+        lib = load_library(msp)
+        assert os.path.isdir(msp + '.astonlib')
+        # the second time the saved library is memory-mapped
+        lib2 = load_library(msp)
+        assert isinstance(lib2.norms, np.memmap)
+        assert not lib2.matrix.data.flags.writeable
+        hits, _ = lib2.search([Scan(*spectra[7])], top_k=1)
+        assert lib2.names[hits[0, 0]] == 'compound 7'
+        assert np.allclose(lib2.matrix.toarray(), lib.matrix.toarray())
+        assert np.allclose(lib2.precursors, lib.precursors)
+
+        # rebuilding a changed library leaves the old mapping alone
+        old_data = np.array(lib2.matrix.data)
+        write_msp(msp, names[:5], spectra[:5])
+        os.utime(msp, (0, 0))
+        lib3 = load_library(msp)
+        assert len(lib3) == 5
+        assert np.allclose(lib2.matrix.data, old_data)
+        assert sorted(os.listdir(path)) == ['test.msp', 'test.msp.astonlib']
+    finally:
+        shutil.rmtree(path)
+
+
+def test_stein_scott():
+    assert np.allclose(stein_weights([10., 20.], [4., 9.], 1., 0.5), \
+                       [20., 60.])
+
+    unk = np.array([[0., 1., 2., 4.], [1., 0., 0., 0.]])
+    ref = np.array([[3., 1., 4., 4.], [1., 1., 0., 0.]])
+    ratios, nshared = ratio_scores(unk, ref)
+    # ref / unk is 1, 2, 1 at the shared peaks, so both terms are 0.5
+    assert np.allclose(ratios, [0.5, 0.])
+    assert np.all(nshared == [3, 1])
+    ratios, _ = ratio_scores(unk, unk)
+    assert np.allclose(ratios, [1., 0.])
+
+    assert np.allclose(composite_scores(np.array([0.9, 1.]), ratios, \
+                                        np.array([3, 1]), nshared), \
+                       [(3 * 0.9 + 3.) / 6, 0.5])
+
+
+def test_library_scoring():
+    spectra = _random_spectra(300)
+    precs = [mzs[-1] + 20. for mzs, _ in spectra]
+    lib = SpectralLibrary.build(['c{}'.format(i) for i in range(300)], \
+                                spectra, precursors=precs)
+    rnd = np.random.RandomState(1)
+    queries = [(mzs, abns * rnd.uniform(0.9, 1.1, len(abns))) \
+               for mzs, abns in spectra[:30]]
+    for method in ('cosine', 'dot', 'composite'):
+        for reverse in (False, True):
+            hits, scores = lib.search(queries, top_k=2, method=method, \
+                                      reverse=reverse)
+            assert np.all(hits[:, 0] == np.arange(30))
+            assert np.all(scores[:, 0] > 0.8)
+            assert np.all(scores[:, 0] >= scores[:, 1])
+    hits, scores = lib.search(queries[:3], method='dot', prefilter=False)
+    assert np.all(hits[:, 0] == np.arange(3))
+    try:
+        lib.search(queries, method='euclidian')
+        assert False
+    except ValueError:
+        pass
+
+    # peaks from something else only matter for the forward search
+    mzs, abns = spectra[0]
+    extra = np.setdiff1d(np.arange(30., 400.), mzs)[:20]
+    mixed = [(np.r_[mzs, extra], np.r_[abns, 50. * np.ones(20)])]
+    _, fwd = lib.search(mixed, top_k=1)
+    hits, rev = lib.search(mixed, top_k=1, reverse=True)
+    assert hits[0, 0] == 0 and np.isclose(rev[0, 0], 1.)
+    assert fwd[0, 0] < rev[0, 0]
+
+    # shifting the precursor and every peak keeps the same losses
+    shifted = [(mzs + 14., abns) for mzs, abns in spectra[:10]]
+    shifted_precs = [p + 14. for p in precs[:10]]
+    hits, scores = lib.search(shifted, top_k=1, method='composite', \
+                              precursors=shifted_precs)
+    assert np.all(hits[:, 0] == np.arange(10))
+    assert np.allclose(scores[:, 0], 1.)
+    hits, _ = lib.search(shifted, top_k=1)
+    assert not np.all(hits[:, 0] == np.arange(10))
@@ -0,0 +1,41 @@
+import numpy as np
+from aston.trace.Trace import AstonSeries
+from aston.trace.Parser import compile_ion_string, ion_tree_leaves
+from aston.trace.Parser import parse_ion_string
+
+
+def test_compile():
+    tree = compile_ion_string('alkanes')
+    assert compile_ion_string('alkanes') is tree
+    assert tree == ('op', '+', (('trace', '57#ms'), ('trace', '71#ms'), \
+                                ('trace', '85#ms')))
+    tree = compile_ion_string('(57+71)*57/!2')
+    assert ion_tree_leaves(tree) == ['57', '71']
+
+
+def test_parse_ion_string():
+    t = np.array([1., 2., 3.])
+    trs = {'57': AstonSeries([1., 2., 3.], t, name='57'),
+           '71': AstonSeries([2., 2., 2.], t, name='71')}
+    calls = []
+
+    def resolver(istr, twin):
+        calls.append(istr)
+        return trs[istr]
+
+    ts = parse_ion_string('(57+71)*57/!2', resolver)
+    assert sorted(calls) == ['57', '71']
+    assert np.allclose(ts.values, [1.5, 4, 7.5])
+    # the leaves must not have been changed in place
+    assert np.all(trs['57'].values == [1, 2, 3])
+
+    ts = parse_ion_string('-abs(57-71)', resolver)
+    assert np.allclose(ts.values, [-1, 0, -1])
+
+    def batch_resolver(istrs, twin):
+        calls.append(tuple(istrs))
+        return [trs[i] for i in istrs]
+
+    ts = parse_ion_string('57+71+57', None, batch_resolver=batch_resolver)
+    assert calls[-1] == ('57', '71')
+    assert np.allclose(ts.values, [4, 6, 8])
@@ -2,6 +2,7 @@ import unittest
 import numpy as np
 from aston.trace.Trace import AstonSeries
 from aston.peaks.Peak import Peak, PeakComponent
+from aston.spectra.Scan import Scan
 
 
 class TestBoxPeak(unittest.TestCase):
@@ -27,3 +28,35 @@ class TestGaussianPeak(TestBoxPeak):
         baseline = AstonSeries([0, 9], [0, 0], name=1)
         c = PeakComponent(info, trace, baseline)
         self.peak = Peak('gaussian', components=c)
+
+
+class TestPeakScan(unittest.TestCase):
+    def setUp(self):
+        baseline = AstonSeries([0, 0], [0, 9], name=1)
+        self.comps = [PeakComponent({}, AstonSeries(h * np.ones(10), \
+                                    np.arange(10), name=mz), baseline) \
+                      for mz, h in ((57, 1.), (71, 2.), (57, 3.))]
+
+    def test_components(self):
+        scn = Peak('ms', components=self.comps).as_scan()
+        areas = [Peak(components=c).area() for c in self.comps]
+        assert np.allclose(scn.x, [57, 71])
+        assert np.allclose(scn.abn, [areas[0] + areas[2], areas[1]])
+        scn = Peak('ms', components=self.comps).as_scan('max')
+        assert np.allclose(scn.abn, [areas[2], areas[1]])
+
+    def test_plot_scan(self):
+        from aston.database.Palette import Plot
+        args = []
+
+        def scan(t, dt=None, aggfunc=None):
+            args.append((t, dt, aggfunc))
+            return Scan([57.], [1.])
+
+        plot = Plot(x_scale=2., x_offset=1., y_scale=1., y_offset=0.)
+        plot.scan = scan
+        peak = Peak('ms', components=self.comps[:1])
+        peak.dbplot = plot
+        assert np.allclose(peak.as_scan('mean').x, [57.])
+        # the plot gets the (scaled) times that the peak covers
+        assert args == [(1., 18., 'mean')]
@@ -1,7 +1,516 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse
+from aston.trace.Trace import AstonFrame
 from aston.tracefile.TraceFile import TraceFile
+from aston.tracefile.AgilentMS import AgilentMS, AgilentMSMSScan
+from aston.tracefile.FrameCache import load_frame, save_frame, evict, \
+                                       rekey
+from aston.tracefile.Common import file_md5
+from aston.tracefile.MZML import mzML
+from aston.tracefile.NetCDF import write_netcdf
+from aston.test.SyntheticFiles import random_ms_scans, write_agilent_ms, \
+                                      write_mzml, write_agilent_ch, \
+                                      write_agilent_uv, write_agilent_dad, \
+                                      write_andi_ms, write_waters_autospec, \
+                                      write_bruker_ami, write_agilent_mh
+
 
 def test_thermo_dxf():
     #TODO: change this to the right class
     #df = TraceFile(filename)
     #assert len(df.events()) > 0
     pass
+
+
+def test_agilent_ms_data():
+    times, scans = random_ms_scans(20, 30)
+    fd, filename = tempfile.mkstemp(suffix='.MS')
+    os.close(fd)
+    try:
+        write_agilent_ms(filename, times, scans)
+        df = AgilentMS(filename).data
+    finally:
+        os.remove(filename)
+
+    assert df.shape[0] == 20
+    assert np.allclose(df.index, times)
+    assert np.all(np.diff(df.columns) > 0)
+    for i in (0, 7, 19):
+        mzs, abns = scans[i]
+        row = df.values[i].toarray()[0]
+        cols = np.searchsorted(df.columns, mzs)
+        assert np.allclose(df.columns[cols], mzs)
+        assert np.allclose(row[cols], (abns & 16383) * 8. ** (abns >> 14))
+        assert np.count_nonzero(row) == np.count_nonzero(abns & 16383)
+
+
+def test_agilent_ms_lazy():
+    times, scans = random_ms_scans(50, 40)
+    fd, filename = tempfile.mkstemp(suffix='.MS')
+    os.close(fd)
+    try:
+        write_agilent_ms(filename, times, scans)
+        full = AgilentMS(filename, lazy=False)
+        lazy = AgilentMS(filename, lazy=True)
+
+        s1, s2 = full.data.scan(15.3, 2.), lazy.data.scan(15.3, 2.)
+        assert np.allclose(s1.abn[s1.abn > 0], s2.abn[s2.abn > 0])
+        assert np.allclose(s1.x[s1.abn > 0], s2.x[s2.abn > 0])
+
+        tic = lazy.data.trace('tic', twin=(10., 20.))
+        assert tic.index[0] >= 9. and tic.index[-1] <= 21.
+        assert np.allclose(tic.values, lazy.total_trace((10., 20.)).values)
+
+        # both kinds of frame give the same traces for a window
+        for name in ('tic', str(scans[0][0][0])):
+            ftr = full.data.trace(name, twin=(10., 20.))
+            ltr = lazy.data.trace(name, twin=(10., 20.))
+            assert len(ftr) < len(full.data.index)
+            assert np.allclose(ftr.index, ltr.index)
+            assert np.allclose(ftr.values, ltr.values)
+
+        # the columns come from the scan index and nothing decoded is
+        # kept, so a window only decodes its own scans
+        calls = []
+        decoder = lazy.data._decoder
+        lz = lazy.data
+        lz._decoder = lambda st, en: calls.append((st, en)) or decoder(st, en)
+        assert np.allclose(lz.columns, full.data.columns)
+        assert lz.shape == full.data.shape
+        assert calls == []
+        assert np.allclose(lz.values.toarray(), full.data.values.toarray())
+        assert calls == [(0, len(lz.index))]
+        assert np.allclose(lz.trace('tic', twin=(10., 20.)).values, \
+                           tic.values)
+        assert len(calls) == 2 and calls[1][1] - calls[1][0] < len(lz.index)
+        del full, lazy
+    finally:
+        os.remove(filename)
+
+
+def test_frame_cache():
+    times, scans = random_ms_scans(20, 30)
+    cache_path = tempfile.mkdtemp()
+    fd, filename = tempfile.mkstemp(suffix='.MS')
+    os.close(fd)
+    try:
+        write_agilent_ms(filename, times, scans)
+        df = AgilentMS(filename).data
+        assert load_frame(filename, cache_path) is None
+        save_frame(filename, df, cache_path)
+        cdf = load_frame(filename, cache_path)
+        assert np.allclose(cdf.index, df.index)
+        assert np.allclose(cdf.columns, df.columns)
+        assert (cdf.values != df.values).nnz == 0
+
+        # changing the file invalidates the entry
+        write_agilent_ms(filename, times[:10], scans[:10])
+        os.utime(filename, (0, 0))
+        assert load_frame(filename, cache_path) is None
+        assert os.listdir(cache_path) == []
+
+        # a touched (or moved) file can keep its entry
+        save_frame(filename, df, cache_path)
+        os.utime(filename, (10, 10))
+        assert load_frame(filename, cache_path) is None
+        save_frame(filename, df, cache_path)
+        os.utime(filename, (20, 20))
+        rekey(filename, filename, cache_path)
+        assert load_frame(filename, cache_path) is not None
+        assert len(os.listdir(cache_path)) == 1
+
+        # evicting down to nothing clears the cache
+        save_frame(filename, df, cache_path)
+        evict(0, cache_path)
+        assert os.listdir(cache_path) == []
+    finally:
+        os.remove(filename)
+        shutil.rmtree(cache_path)
+
+
+def test_tracefile_registry():
+    # every reader in aston.tracefile is registered, with the
+    # same magic bytes, extension and file name as the class
+    import glob
+    import inspect
+    from importlib import import_module
+    from aston.tracefile.Common import TRACEFILES, tfclass
+    from aston.tracefile.TraceFile import ScanListFile
+
+    found = set()
+    mydir = os.path.dirname(inspect.getfile(TraceFile))
+    for filename in glob.glob(os.path.join(mydir, '*.py')):
+        modname = os.path.splitext(os.path.basename(filename))[0]
+        module = import_module('aston.tracefile.' + modname)
+        for cls in vars(module).values():
+            if inspect.isclass(cls) and cls.__module__ == module.__name__ \
+               and cls.__base__ in (TraceFile, ScanListFile) and \
+               cls is not ScanListFile:
+                found.add((modname, cls.__name__, cls.mgc, cls.ext, cls.fnm))
+    assert found == set(TRACEFILES)
+    assert tfclass('AgilentMS') is AgilentMS
+    assert tfclass('NotAFileType') is None
+
+
+def test_agilent_ch():
+    rnd = np.random.RandomState(0)
+    times = np.linspace(0, 10, 3000)
+    signal = np.cumsum(rnd.randint(-3000, 3000, len(times)))
+    # an escape whose second word looks like another escape
+    signal[100:102] = [0x18000, 0x18000 + 40000]
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for kind in ('MWD', 'MWD2', 'FID'):
+            os.mkdir(os.path.join(tmpdir, kind))
+            filename = os.path.join(tmpdir, kind, kind[:3] + '1A.CH')
+            write_agilent_ch(filename, times, signal, kind=kind)
+            tf = TraceFile(filename)
+            if kind == 'FID':
+                assert tf.ftype == 'AgilentFID'
+                assert np.array_equal(tf.total_trace().values.ravel(), \
+                                      signal)
+            else:
+                assert tf.ftype == 'AgilentMWD' + kind[3:]
+                df = tf.data
+                assert df.columns == [254.]
+                assert np.allclose(df.index, times, atol=1e-4)
+                assert np.allclose(df.values[:, 0], 1e-3 * signal)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_agilent_uv():
+    rnd = np.random.RandomState(0)
+    times = np.linspace(0, 5, 200)
+    wvs = (190 * 20, 400 * 20, 40)
+    spectra = np.cumsum(rnd.randint(-30000, 30000, \
+                                    (200, len(range(*wvs)))), axis=1)
+    twin, wvwin = (1., 2.), (250., 260.)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for kind in ('CSDAD', 'CSDAD2', 'DAD'):
+            if kind == 'DAD':
+                filename = os.path.join(tmpdir, 'DAD1.sd')
+                expected = spectra[:, :100] / 7.
+                write_agilent_dad(filename, times, (190., 2., 100), expected)
+            else:
+                filename = os.path.join(tmpdir, kind + '.UV')
+                expected = spectra / 2000.
+                write_agilent_uv(filename, times, wvs, spectra, kind=kind)
+            tf = TraceFile(filename)
+            assert tf.ftype == 'Agilent' + kind
+            df = TraceFile(filename, lazy=False).data
+            assert df.columns[:3] == [190., 192., 194.]
+            assert np.allclose(df.index, times, atol=1e-4)
+            assert np.allclose(df.values, expected)
+
+            # only part of the file is decoded for a window
+            tidx = (df.index >= twin[0]) & (df.index <= twin[1])
+            widx = (np.array(df.columns) >= wvwin[0]) & \
+                    (np.array(df.columns) <= wvwin[1])
+            win = tf.read_window(twin, wvwin)
+            assert win.shape == (40, 6)
+            assert np.allclose(win.values, df.values[tidx][:, widx])
+            lazy = TraceFile(filename, lazy=True).data
+            assert np.allclose(lazy.columns, df.columns)
+            trace = tf.data.trace('254', twin=twin)
+            assert np.allclose(trace.values, df.trace('254', twin=twin).values)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_agilent_uv_unaligned():
+    rnd = np.random.RandomState(0)
+    times = np.linspace(0, 5, 50)
+    wvs = (190 * 20, 400 * 20, 40)
+    spectra = np.cumsum(rnd.randint(-30000, 30000, \
+                                    (50, len(range(*wvs)))), axis=1)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # scans that start on odd bytes or aren't evenly spaced
+        for kind in ('CSDAD', 'CSDAD2', 'DAD'):
+            if kind == 'DAD':
+                filename = os.path.join(tmpdir, 'DAD1.sd')
+                expected = spectra[:, :100] / 7.
+                write_agilent_dad(filename, times, (190., 2., 100), \
+                                  expected, pad=True)
+            else:
+                filename = os.path.join(tmpdir, kind + '.UV')
+                expected = spectra / 2000.
+                write_agilent_uv(filename, times, wvs, spectra, kind=kind, \
+                                 pad=True)
+            df = TraceFile(filename, lazy=False).data
+            assert np.allclose(df.values, expected)
+            win = TraceFile(filename).read_window((1., 2.), (250., 260.))
+            assert win.shape == (10, 6)
+            assert np.allclose(win.values, df.values[10:20, 30:36])
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_netcdf():
+    times, scans = random_ms_scans(50, 20, mz_range=(40, 100))
+    rnd = np.random.RandomState(1)
+    # high resolution m/z's wander a little around each nominal mass
+    scans = [(mzs + rnd.uniform(-0.05, 0.05, len(mzs)), abns) \
+             for mzs, abns in scans]
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'DATA.CDF')
+        write_andi_ms(filename, times, scans)
+        tf = TraceFile(filename, lazy=False)
+        assert tf.ftype == 'NetCDF'
+        df = tf.data
+        assert scipy.sparse.issparse(df.values)
+        all_mzs = np.concatenate([mzs for mzs, _ in scans]).astype('f4')
+        assert df.shape == (50, len(np.unique(all_mzs)))
+        assert df.columns == sorted(df.columns)
+        assert np.allclose(df.index, times)
+        assert np.allclose(df.values.sum(axis=1).A1, [a.sum() for _, a in scans])
+
+        # a tolerance puts each nominal mass in its own column
+        win = tf.read_window((10., 20.), mz_tol=0.2)
+        in_win = [s for s, t in zip(scans, times) if 10. <= t <= 20.]
+        nominal = np.unique(np.round(np.concatenate([m for m, _ in in_win])))
+        assert win.shape == (len(in_win), len(nominal))
+        assert np.array_equal(np.round(win.columns), nominal)
+        col = int(np.flatnonzero(nominal == 58)[0])
+        mz58 = [a[np.round(m) == 58].sum() for m, a in in_win]
+        assert np.allclose(win.values[:, col].toarray().ravel(), mz58)
+        assert np.allclose(win.values.sum(axis=1).A1, \
+                           [a.sum() for _, a in in_win])
+        assert np.allclose(tf.total_trace().values, \
+                           [a.sum() for _, a in scans])
+
+        lazy = TraceFile(filename, lazy=True).data
+        assert np.allclose(lazy.trace('tic', twin=(10., 20.)).values, \
+                           df.trace('tic', twin=(10., 20.)).values)
+        assert np.allclose(lazy.columns, df.columns)
+        assert lazy.shape == df.shape
+
+        # the file isn't kept open after it's been read
+        if os.path.isdir('/proc/self/fd'):
+            fds = [os.path.realpath('/proc/self/fd/' + fd) \
+                   for fd in os.listdir('/proc/self/fd')]
+            assert os.path.realpath(filename) not in fds
+
+        # files we write can be read back in
+        dense = AstonFrame(np.array([[1., 0, 2], [0, 3, 4]]), \
+                           np.array([1., 2.]), [50., 51., 52.5])
+        filename = os.path.join(tmpdir, 'WRITTEN.CDF')
+        write_netcdf(filename, dense)
+        df = TraceFile(filename, lazy=False).data
+        assert df.columns == [50., 51., 52.5]
+        assert np.allclose(df.values.toarray(), dense.values)
+        del tf, df, win, lazy
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_waters_autospec():
+    times, scans = random_ms_scans(50, 20)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'RUN.IDX')
+        write_waters_autospec(filename, times, scans)
+        tf = TraceFile(filename, lazy=False)
+        assert tf.ftype == 'WatersAutospec'
+        df = tf.data
+        assert scipy.sparse.issparse(df.values)
+        assert df.columns == sorted(set(np.concatenate([i for i, _ in scans])))
+        assert np.allclose(df.index, times)
+        mz = df.columns[5]
+        assert np.allclose(df.trace(str(mz)).values, \
+                           [a[i == mz].sum() for i, a in scans])
+        assert np.allclose(tf.total_trace().values, \
+                           df.trace('tic').values)
+
+        lazy = TraceFile(filename, lazy=True).data
+        assert np.allclose(lazy.trace('tic', twin=(10., 20.)).values, \
+                           df.trace('tic', twin=(10., 20.)).values)
+        assert np.allclose(lazy.columns, df.columns)
+        assert lazy.shape == df.shape
+        del tf, df, lazy
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_bruker_msms():
+    times, scans = random_ms_scans(50, 20)
+    rnd = np.random.RandomState(1)
+    scans = [(mzs + rnd.uniform(-0.3, 0.3, len(mzs)), abns) \
+             for mzs, abns in scans]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'RUN.AMI')
+        write_bruker_ami(filename, times, scans)
+        tf = TraceFile(filename, lazy=False)
+        assert tf.ftype == 'BrukerMSMS'
+        df = tf.data
+        assert scipy.sparse.issparse(df.values)
+        nominal = np.unique(np.round(np.concatenate([m for m, _ in scans])))
+        assert df.columns == nominal.tolist()
+        assert np.allclose(df.index, times)
+        assert np.allclose(df.trace('57').values, \
+                           [a[np.round(m) == 57].sum() for m, a in scans])
+
+        win = tf.read_window((10., 20.), mz_round=None)
+        in_win = [s for s, t in zip(scans, times) if 10. <= t <= 20.]
+        assert win.shape == (len(in_win), \
+                             sum(len(np.unique(m)) for m, _ in in_win))
+        assert np.allclose(win.values.sum(axis=1).A1, \
+                           [a.sum() for _, a in in_win])
+
+        lazy = TraceFile(filename, lazy=True).data
+        assert np.allclose(lazy.trace('tic', twin=(10., 20.)).values, \
+                           df.trace('tic', twin=(10., 20.)).values)
+        assert np.allclose(lazy.columns, df.columns)
+        assert lazy.shape == df.shape
+        del tf, df, lazy
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_file_md5():
+    import hashlib
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        data = np.arange(100000, dtype='<i4').tobytes()
+        with open(filename, 'wb') as f:
+            f.write(data)
+        assert file_md5(filename, chunk_size=1000) == \
+                hashlib.md5(data).hexdigest()
+        md5 = hashlib.md5(str(len(data)).encode('ascii'))
+        md5.update(data[:64])
+        md5.update(data[-64:])
+        assert file_md5(filename, sample=64) == md5.hexdigest()
+        # small files are always hashed completely
+        assert file_md5(filename, sample=len(data)) == \
+                hashlib.md5(data).hexdigest()
+    finally:
+        os.remove(filename)
+
+
+def test_mzml_scans():
+    times, scans = random_ms_scans(50, 20)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for indexed in (True, False):
+            filename = os.path.join(tmpdir, str(indexed) + '.mzML')
+            write_mzml(filename, times, scans, indexed)
+            mz = mzML(filename)
+            all_scans = list(mz.scans())
+            assert len(all_scans) == 50
+            assert np.allclose(all_scans[7].x, scans[7][0])
+            assert np.allclose(all_scans[7].abn, scans[7][1])
+
+            win = [float(s.name) for s in mz.scans((10., 20.))]
+            assert win == [t for t in times if 10. <= t <= 20.]
+            assert len(mz.total_trace((10., 20.))) == len(win)
+            # the index gets saved for next time
+            assert os.path.exists(filename + '.astonidx')
+
+            # a single scan is looked up in the index
+            scn = mz.scan(times[7] + 0.1)
+            assert float(scn.name) == times[7]
+            assert np.allclose(scn.abn, scans[7][1])
+            _check_scan_range(mz, times, scans)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_mzml_undecodable_scan():
+    times, scans = random_ms_scans(20, 10)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'RUN.mzML')
+        write_mzml(filename, times, scans)
+        # take away the m/z array of the eighth spectrum
+        with open(filename, 'rb') as f:
+            xml = f.read()
+        st = xml.index(b'id="scan=7"')
+        st = xml.index(b'MS:1000514', st)
+        with open(filename, 'wb') as f:
+            f.write(xml[:st] + b'MS:1000999' + xml[st + 10:])
+
+        mz = mzML(filename)
+        assert len(list(mz.scans())) == 19
+        assert mz.scan(times[7]) is None
+        assert float(mz.scan(times[8]).name) == times[8]
+        scn = mz.scan(times[6], times[8] - times[6])
+        assert np.isclose(scn.abn.sum(), scans[6][1].sum() + \
+                          scans[8][1].sum())
+    finally:
+        shutil.rmtree(tmpdir)
+
+def _check_scan_range(tf, times, scans):
+    # scans in a range are merged by m/z
+    scn = tf.scan(times[3], times[6] - times[3])
+    mzs = np.concatenate([m for m, _ in scans[3:7]])
+    abns = np.concatenate([a for _, a in scans[3:7]])
+    assert np.allclose(scn.x, np.unique(mzs))
+    assert np.allclose(scn.abn, [abns[mzs == m].sum() for m in scn.x])
+    scn = tf.scan(times[3], times[6] - times[3], \
+                  aggfunc=lambda a: a.max(axis=0))
+    assert np.allclose(scn.abn, [abns[mzs == m].max() for m in scn.x])
+    scn = tf.scan(times[3], times[6] - times[3], aggfunc='max')
+    assert np.allclose(scn.abn, [abns[mzs == m].max() for m in scn.x])
+
+
+def test_agilent_mh():
+    rnd = np.random.RandomState(0)
+    times = np.linspace(1., 30., 40)
+    mzs = np.linspace(40., 400., 721)
+    scans = [(mzs, rnd.randint(0, 10000, len(mzs))) for _ in times]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for compress in (False, True):
+            path = os.path.join(tmpdir, str(compress))
+            os.mkdir(path)
+            filename = os.path.join(path, 'MSScan.bin')
+            write_agilent_mh(filename, times, scans, compress)
+            tf = TraceFile(filename)
+            assert tf.ftype == 'AgilentMSMSScan'
+            assert np.allclose(tf.total_trace().values, \
+                               [a.sum() for _, a in scans])
+            assert len(list(tf.scans((10., 20.)))) == \
+                    np.sum((times >= 10.) & (times <= 20.))
+
+            scn = tf.scan(times[7] - 0.1)
+            assert scn.name == times[7]
+            assert np.allclose(scn.x, mzs)
+            assert np.allclose(scn.abn, scans[7][1])
+            _check_scan_range(tf, times, scans)
+
+            # the index gets saved for next time
+            assert os.path.exists(filename + '.astonidx')
+            idx = AgilentMSMSScan(filename)._scan_index()
+            assert np.allclose(idx['times'], times)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_scanlist_traces_for():
+    times, scans = random_ms_scans(30, 40)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'test.mzML')
+        write_mzml(filename, times, scans)
+        mzs = [57., 71., 85.2, 1000.]
+        xics = mzML(filename).traces_for(mzs, tol=[0.5, 0.5, 1., 0.5])
+    finally:
+        shutil.rmtree(tmpdir)
+
+    assert xics.shape == (30, 4)
+    assert xics.columns == mzs
+    for i, (x, abn) in enumerate(scans):
+        assert xics.values[i, 0] == np.sum(abn[np.abs(x - 57.) < 0.5])
+        assert xics.values[i, 2] == np.sum(abn[np.abs(x - 85.2) < 1.])
+    assert np.all(xics.values[:, 3] == 0)
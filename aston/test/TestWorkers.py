@@ -0,0 +1,78 @@
+import glob
+import os.path as op
+import tempfile
+import numpy as np
+from aston.trace.Trace import AstonSeries
+from aston.peaks.PeakModels import gaussian
+from aston.peaks.PeakFinding import simple_peak_find
+from aston.peaks.Integrators import simple_integrate
+from aston.peaks.Workers import find_peaks_batch, find_and_integrate
+from aston.peaks.Workers import close_worker_pool, worker_pool
+
+
+def _runs(nruns=3, ntraces=2):
+    rnd = np.random.RandomState(0)
+    t = np.linspace(0, 20, 2000)
+    runs = []
+    for _ in range(nruns):
+        tss = []
+        for i in range(ntraces):
+            y = sum(gaussian(t, x=x, w=0.1, h=1e4) \
+                    for x in rnd.uniform(2, 18, 4))
+            tss.append(AstonSeries(y, t, name=str(57 + 14 * i)))
+        runs.append(tss)
+    return runs
+
+
+def test_find_peaks_batch():
+    runs = _runs()
+    try:
+        found = find_peaks_batch(runs, simple_peak_find)
+        assert found == find_peaks_batch(runs, simple_peak_find, mp=False)
+        assert [len(f) for f in found] == [2, 2, 2]
+        assert all(len(pks) > 0 for f in found for pks in f)
+    finally:
+        close_worker_pool()
+
+
+def _shared_files():
+    shm_dir = '/dev/shm' if op.isdir('/dev/shm') else tempfile.gettempdir()
+    return set(glob.glob(op.join(shm_dir, 'aston-*.npy')))
+
+
+def test_find_and_integrate():
+    runs = _runs()
+    before = _shared_files()
+    try:
+        pks = find_and_integrate(runs, simple_peak_find, simple_integrate)
+        ref = find_and_integrate(runs, simple_peak_find, simple_integrate, \
+                                 mp=False)
+        # the batch's shared traces are gone once it's done
+        assert _shared_files() == before
+    finally:
+        close_worker_pool()
+
+    assert len(pks) == len(runs)
+    for r_pks, r_ref in zip(pks, ref):
+        assert [p.area() for p in r_pks] == [p.area() for p in r_ref]
+        for p in r_pks:
+            for c in p.components:
+                assert c._trace.name in {'57', '71'}
+
+
+def test_worker_pool_size():
+    runs = _runs(nruns=2)
+    ref = find_peaks_batch(runs, simple_peak_find, mp=False)
+    try:
+        pool = worker_pool(2)
+        # asking for no particular size (or the same one) keeps the
+        # pool there is
+        assert worker_pool() is pool
+        assert worker_pool(2) is pool
+        # a different size starts a new one, which is then kept
+        pool3 = worker_pool(3)
+        assert pool3 is not pool
+        assert worker_pool() is pool3
+        assert find_peaks_batch(runs, simple_peak_find) == ref
+    finally:
+        close_worker_pool()
@@ -0,0 +1,205 @@
+"""
+Chunked, columnar serialization for AstonSeries and AstonFrames.
+
+Layout (all integers little-endian)::
+
+    b'ASTZ' | version (H) | header length (I) | header (JSON) | blocks
+
+The rows are split into time chunks and every array belonging to a
+chunk (times, dense values or the CSR indptr/indices/data) is filtered
+and compressed on its own, so any subset of the chunks can be read back
+without inflating the rest. Sparse matrices are stored as CSR.
+
+Filters are a byte shuffle (all arrays) preceded by a delta on the
+integer representation of times and CSR indices (both lossless). The
+codec is LZ4 if the lz4 package is installed and zlib otherwise.
+"""
+import json
+import struct
+import zlib
+import numpy as np
+import scipy.sparse
+
+try:
+    import lz4.block as lz4_block
+except ImportError:
+    lz4_block = None
+
+MAGIC = b'ASTZ'
+VERSION = 1
+CHUNK_ROWS = 512
+
+
+def is_chunked(zdata):
+    return bytes(zdata[:4]) == MAGIC
+
+
+def _shuffle(a):
+    """
+    Groups the n-th byte of every item together, which makes
+    numeric data compress much better.
+    """
+    a = np.ascontiguousarray(a)
+    if a.dtype.itemsize == 1:
+        return a.tobytes()
+    return a.view(np.uint8).reshape(-1, a.dtype.itemsize).T.tobytes()
+
+
+def _unshuffle(b, dtype):
+    dtype = np.dtype(dtype)
+    a = np.frombuffer(b, dtype=np.uint8)
+    if dtype.itemsize == 1:
+        return a.view(dtype)
+    return a.reshape(dtype.itemsize, -1).T.copy().view(dtype).ravel()
+
+
+def _delta(a):
+    """
+    Differences of the integer representation of a; lossless for any
+    dtype because the integer math just wraps around.
+    """
+    a = np.ascontiguousarray(a)
+    ia = a.view('<i' + str(a.dtype.itemsize))
+    d = np.empty_like(ia)
+    if len(ia) > 0:
+        d[0] = ia[0]
+        np.subtract(ia[1:], ia[:-1], out=d[1:])
+    return d
+
+
+def _undelta(d, dtype):
+    return np.cumsum(d, dtype=d.dtype).view(dtype)
+
+
+def _encode(a, codec, delta=False):
+    dtype = np.dtype(a.dtype).newbyteorder('<')
+    a = np.asarray(a, dtype=dtype)
+    b = _shuffle(_delta(a) if delta else a)
+    if codec == 'lz4':
+        return lz4_block.compress(b, store_size=True)
+    return zlib.compress(b, 1)
+
+
+def _decode(b, dtype, codec, delta=False):
+    dtype = np.dtype(dtype)
+    if codec == 'lz4':
+        if lz4_block is None:
+            raise ImportError('the lz4 package is needed to read this data')
+        b = lz4_block.decompress(b)
+    else:
+        b = zlib.decompress(b)
+    if delta:
+        idtype = np.dtype('<i' + str(dtype.itemsize))
+        return _undelta(_unshuffle(b, idtype), dtype)
+    return _unshuffle(b, dtype)
+
+
+def pack(index, values, labels, kind, chunk_rows=CHUNK_ROWS, codec=None):
+    """
+    Serializes an index, values (dense 1D/2D or a sparse matrix) and the
+    name(s) of the columns into the chunked format.
+
+    Parameters
+    ----------
+    kind : {'series', 'frame'}
+    chunk_rows : int, optional
+        Number of rows compressed together in each chunk.
+    codec : {'lz4', 'zlib'}, optional
+        Defaults to LZ4 if it's available.
+    """
+    if codec is None:
+        codec = 'zlib' if lz4_block is None else 'lz4'
+    index = np.asarray(index, dtype=float)
+    sparse = scipy.sparse.issparse(values)
+    if sparse:
+        values = values.tocsr()
+        vdtype = values.data.dtype
+    else:
+        values = np.asarray(values)
+        vdtype = values.dtype
+    vdtype = np.dtype(vdtype).newbyteorder('<')
+
+    chunks, blocks, pos = [], [], 0
+    for st in range(0, max(len(index), 1), chunk_rows):
+        en = min(st + chunk_rows, len(index))
+        c_blocks = [_encode(index[st:en], codec, delta=True)]
+        if sparse:
+            c_vals = values[st:en]
+            c_blocks.append(_encode(np.diff(c_vals.indptr), codec))
+            c_blocks.append(_encode(c_vals.indices, codec, delta=True))
+            c_blocks.append(_encode(c_vals.data, codec))
+            nnz = int(c_vals.nnz)
+        else:
+            c_blocks.append(_encode(values[st:en].ravel(), codec))
+            nnz = 0
+        lens = [len(b) for b in c_blocks]
+        t0 = float(index[st]) if en > st else None
+        t1 = float(index[en - 1]) if en > st else None
+        chunks.append([st, en, t0, t1, nnz, pos, lens])
+        blocks += c_blocks
+        pos += sum(lens)
+
+    header = json.dumps({
+        'kind': kind,
+        'labels': labels,
+        'shape': list(values.shape),
+        'sparse': sparse,
+        'dtype': vdtype.str,
+        'idx_dtype': values.indices.dtype.str if sparse else None,
+        'codec': codec,
+        'chunks': chunks,
+    }).encode('utf-8')
+    return MAGIC + struct.pack('<HI', VERSION, len(header)) + header + \
+            b''.join(blocks)
+
+
+def unpack(zdata, twin=None):
+    """
+    Reads data serialized by pack; if twin is given, only the chunks
+    overlapping that time window are decompressed.
+
+    Returns
+    -------
+    index, values, labels, kind
+    """
+    zdata = memoryview(zdata)
+    version, lh = struct.unpack('<HI', zdata[4:10])
+    if version > VERSION:
+        raise ValueError('Unknown compressed data version ' + str(version))
+    h = json.loads(bytes(zdata[10:10 + lh]).decode('utf-8'))
+    data_st = 10 + lh
+    codec, dtype = h['codec'], h['dtype']
+
+    chunks = h['chunks']
+    if twin is not None:
+        lo = -np.inf if twin[0] is None else twin[0]
+        hi = np.inf if twin[1] is None else twin[1]
+        chunks = [c for c in chunks if c[2] is not None and \
+                  c[3] >= lo and c[2] <= hi]
+
+    idxs, vals, indptrs, indices = [], [], [], []
+    for st, en, _, _, nnz, pos, lens in chunks:
+        offs = data_st + pos + np.cumsum([0] + lens)
+        blk = lambda i: bytes(zdata[offs[i]:offs[i + 1]])
+        idxs.append(_decode(blk(0), '<f8', codec, delta=True))
+        if h['sparse']:
+            indptrs.append(_decode(blk(1), h['idx_dtype'], codec))
+            indices.append(_decode(blk(2), h['idx_dtype'], codec, True))
+            vals.append(_decode(blk(3), dtype, codec))
+        else:
+            vals.append(_decode(blk(1), dtype, codec))
+
+    cat = lambda l, dt: np.concatenate(l) if len(l) > 0 else \
+            np.array([], dtype=dt)
+    index = cat(idxs, float)
+    shape = h['shape']
+    if h['sparse']:
+        indptr = np.zeros(len(index) + 1, dtype=h['idx_dtype'])
+        np.cumsum(cat(indptrs, h['idx_dtype']), out=indptr[1:])
+        values = scipy.sparse.csr_matrix((cat(vals, dtype), \
+                                          cat(indices, h['idx_dtype']), \
+                                          indptr), \
+                                         shape=(len(index), shape[1]))
+    else:
+        values = cat(vals, dtype).reshape([len(index)] + shape[1:])
+    return index, values, h['labels'], h['kind']
@@ -62,7 +62,7 @@ def noisefilter_(arr, bandwidth=0.2):
     I = np.fft.fftshift(np.fft.fft(arr))  # entering to frequency domain
     # fftshift moves zero-frequency component to the center of the array
     P = np.zeros(len(I), dtype=complex)
-    c1 = len(I) / 2  # spectrum center
+    c1 = len(I) // 2  # spectrum center
     r = float(bandwidth)  # percent of signal to save
     r = int((r * len(I)) / 2)  # convert to coverage of the array
     for i in range(c1 - r, c1 + r):
@@ -129,6 +129,8 @@ def ts_func(f):
     """
     def wrap_func(df, *args):
         #TODO: should vectorize to apply over all columns?
+        if isinstance(df, AstonSeries):
+            return AstonSeries(f(df.values, *args), df.index, name=df.name)
         return AstonFrame(f(df.values, *args), df.index, df.columns)
     return wrap_func
 
@@ -147,6 +149,6 @@ fxns = {'fft': fft,
         'tan': ts_func(np.tan),
         'derivative': ts_func(np.gradient),
         'd': ts_func(np.gradient),
-        'movingaverage': movingaverage,
-        'savitzkygolay': savitzkygolay,
+        'movingaverage': ts_func(movingaverage),
+        'savitzkygolay': ts_func(savitzkygolay),
         }
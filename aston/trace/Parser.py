@@ -1,8 +1,10 @@
 import math
 import re
-from aston.trace.Trace import AstonSeries
+import numpy as np
+from aston.resources import cache
+from aston.trace.Trace import AstonSeries, AstonFrame
+from aston.trace.MathSeries import fxns as functions
 
-functions = {}  # TODO
 istr_type_2d = ['ms', 'uv', 'irms']
 istr_type_evts = ['refgas', 'fia', 'fxn', 'deadvol']
 
@@ -112,7 +114,7 @@ def is_parans_exp(istr):
     Determines if an expression is a valid function "call"
     """
     fxn = istr.split('(')[0]
-    if (not fxn.isalnum() and fxn != '(') or istr[-1] != ')':
+    if (not fxn.isalnum() and fxn != '') or istr[-1] != ')':
         return False
     plevel = 1
     for c in '('.join(istr[:-1].split('(')[1:]):
@@ -125,69 +127,150 @@ def is_parans_exp(istr):
     return True
 
 
-def parse_ion_string(istr, tr_resolver, twin=None):
-    """
-    Recursive string parser that handles "ion" strings.
+OPERATORS = {'/': np.true_divide, '*': np.multiply, '+': np.add, \
+             '-': np.subtract, '^': np.power}
+
+
+@cache(maxsize=256)
+def compile_ion_string(istr):
     """
+    Parses an "ion" string into a tree of tuples that can be evaluated
+    with eval_ion_tree. The nodes are:
+
+    ('trace', istr), ('const', value), ('neg', node),
+    ('fxn', name, node, args) and ('op', operator, nodes).
 
+    None is returned if the string can't be parsed.
+    """
     if istr.strip() == '':
-        return AstonSeries()
+        return None
 
     #remove (unnessary?) pluses from the front
     #TODO: plus should be abs?
     istr = istr.lstrip('+')
+    if istr == '':
+        return None
 
     #invert it if preceded by a minus sign
     if istr[0] == '-':
-        return -parse_ion_string(istr[1:], tr_resolver, twin)
+        return ('neg', compile_ion_string(istr[1:]))
 
     #this is a function or paranthesized expression
     if is_parans_exp(istr):
-        if ')' not in istr:
-            # unbalanced parantheses
-            pass
         fxn = istr.split('(')[0]
-        args = istr[istr.find('(') + 1:istr.find(')')].split(',')
+        args = tokenize(istr[len(fxn) + 1:-1], ',')
         if fxn == '':
             # strip out the parantheses and continue
-            istr = args[0]
+            return compile_ion_string(args[0])
         else:
-            ts = parse_ion_string(args[0], tr_resolver, twin)
-            #FIXME
-            return ts
-            #return _apply_fxn(ts, fxn, *args[1:])
+            return ('fxn', fxn, compile_ion_string(args[0]), \
+                    tuple(args[1:]))
 
     # all the complicated math is gone, so simple lookup
     if set(istr).intersection(set('+-/*()')) == set():
         if istr in SHORTCUTS:
             # allow some shortcuts to pull out common ions
-            return parse_ion_string(SHORTCUTS[istr], tr_resolver, twin)
+            return compile_ion_string(SHORTCUTS[istr])
         elif istr[0] == '!' and all(i in '0123456789.' for i in istr[1:]):
             #TODO: should this handle negative numbers?
-            return float(istr[1:])
+            return ('const', float(istr[1:]))
         elif istr == '!pi':
-            return math.pi
+            return ('const', math.pi)
         elif istr == '!e':
-            return math.e
+            return ('const', math.e)
         else:
-            return tr_resolver(istr, twin)
+            return ('trace', istr)
 
     # go through and handle operators
     for token in '/*+-^':
-        if len(tokenize(istr, token)) != 1:
-            ts = tokenize(istr, token)
-            s = parse_ion_string(ts[0], tr_resolver, twin)
-            for t in ts[1:]:
-                if token == '/':
-                    s /= parse_ion_string(t, tr_resolver, twin)
-                elif token == '*':
-                    s *= parse_ion_string(t, tr_resolver, twin)
-                elif token == '+':
-                    s += parse_ion_string(t, tr_resolver, twin)
-                elif token == '-':
-                    s -= parse_ion_string(t, tr_resolver, twin)
-                elif token == '^':
-                    s **= parse_ion_string(t, tr_resolver, twin)
-            return s
+        ts = tokenize(istr, token)
+        if len(ts) != 1:
+            return ('op', token, tuple(compile_ion_string(t) for t in ts))
     #TODO: shouldn't hit this point?
-    pass
+    return None
+
+
+def ion_tree_leaves(tree):
+    """
+    Returns every distinct trace name in a compiled ion string.
+    """
+    if tree is None or tree[0] == 'const':
+        return []
+    elif tree[0] == 'trace':
+        return [tree[1]]
+    elif tree[0] == 'neg':
+        return ion_tree_leaves(tree[1])
+    elif tree[0] == 'fxn':
+        return ion_tree_leaves(tree[2])
+    leaves = []
+    for node in tree[2]:
+        leaves += [l for l in ion_tree_leaves(node) if l not in leaves]
+    return leaves
+
+
+def _apply_op(f, a, b):
+    # none of the operands are changed in place, because the
+    # same trace can be used in several places in the tree
+    if isinstance(a, (AstonSeries, AstonFrame)):
+        return a._apply_data(f, b)
+    elif isinstance(b, (AstonSeries, AstonFrame)):
+        return b._apply_data(f, a, reverse=True)
+    return f(a, b)
+
+
+def eval_ion_tree(tree, traces):
+    """
+    Evaluates a compiled ion string, given a dictionary of the
+    traces for each of its leaves.
+    """
+    if tree is None:
+        return None
+    elif tree[0] == 'trace':
+        return traces.get(tree[1])
+    elif tree[0] == 'const':
+        return tree[1]
+    elif tree[0] == 'neg':
+        ts = eval_ion_tree(tree[1], traces)
+        return None if ts is None else -ts
+    elif tree[0] == 'fxn':
+        ts = eval_ion_tree(tree[2], traces)
+        if ts is None or tree[1] not in functions:
+            return ts
+        return functions[tree[1]](ts, *tree[3])
+
+    f = OPERATORS[tree[1]]
+    s = eval_ion_tree(tree[2][0], traces)
+    for node in tree[2][1:]:
+        if s is None:
+            break
+        ts = eval_ion_tree(node, traces)
+        s = None if ts is None else _apply_op(f, s, ts)
+    return s
+
+
+def parse_ion_string(istr, tr_resolver, twin=None, batch_resolver=None):
+    """
+    Evaluates an "ion" string.
+
+    Parameters
+    ----------
+    istr : str
+    tr_resolver : callable
+        Called with each trace name in istr and twin; returns the trace.
+    twin : tuple, optional
+    batch_resolver : callable, optional
+        If given, called once with a list of every distinct trace name
+        in istr and twin instead of tr_resolver; returns a list of the
+        traces (so all of them can be extracted together).
+
+    Returns
+    -------
+    AstonSeries, float or None
+    """
+    tree = compile_ion_string(istr)
+    leaves = ion_tree_leaves(tree)
+    if batch_resolver is not None:
+        trs = batch_resolver(leaves, twin)
+    else:
+        trs = [tr_resolver(l, twin) for l in leaves]
+    return eval_ion_tree(tree, dict(zip(leaves, trs)))
@@ -7,9 +7,149 @@ import scipy.signal
 import scipy.sparse
 from scipy.interpolate import interp1d
 from aston.spectra.Scan import Scan
+from aston.trace.Compression import pack, unpack, is_chunked
 
 
-class AstonSeries(object):
+class _TraceMath(object):
+    """
+    Arithmetic for AstonSeries and AstonFrames. Every operator
+    broadcasts a ufunc straight over the values; if the other
+    operand has different times it's linearly interpolated onto
+    these times first (and 0 outside of them).
+    """
+    def _new(self, values):
+        # returns a copy of self with new values
+        raise NotImplementedError
+
+    def _retime(self, new_times, fill=0.0):
+        # this is not exposed because it returns a raw numpy array
+        new_times = np.asarray(new_times, dtype=float)
+        values = self.values
+        if scipy.sparse.issparse(values):
+            values = values.toarray()
+        values = np.asarray(values)
+        if len(self.index) == 0:
+            return fill * np.ones(new_times.shape + values.shape[1:])
+
+        i, j, w, outside = _retime_plan(self.index, new_times)
+        if values.ndim > 1:
+            w = w[:, np.newaxis]
+        new_values = values[i] * (1. - w) + values[j] * w
+        new_values[outside] = fill
+        return new_values
+
+    def _apply_data(self, f, ts, reverse=False, inplace=False):
+        """
+        Convenience function for all of the math stuff.
+
+        Parameters
+        ----------
+        f : np.ufunc
+        ts : number, np.ndarray, AstonSeries or AstonFrame
+            Second operand (None for unary functions).
+        reverse : bool, optional
+            If True, ts is the first operand.
+        inplace : bool, optional
+            Store the result in my values instead of returning a copy.
+        """
+        if isinstance(ts, _TraceMath):
+            if ts.index is self.index or \
+               np.array_equal(ts.index, self.index):
+                d = ts.values
+            else:
+                d = ts._retime(self.index)
+            if scipy.sparse.issparse(d):
+                d = d.toarray()
+            d = np.asarray(d)
+            if d.ndim == 1 and np.ndim(self.values) == 2:
+                # apply a series to every column of a frame
+                d = d[:, np.newaxis]
+        else:
+            d = ts
+
+        values = self.values
+        if scipy.sparse.issparse(values):
+            if not reverse and np.isscalar(d) and \
+               f in {np.multiply, np.true_divide}:
+                # scaling keeps the data sparse
+                values = values * d if f is np.multiply else values / d
+                if inplace:
+                    self.values = values
+                    return self
+                return self._new(values)
+            values = values.toarray()
+
+        args = (values,) if d is None else \
+                ((d, values) if reverse else (values, d))
+        if inplace and values is self.values and not reverse:
+            try:
+                f(*args, out=values, casting='same_kind')
+                return self
+            except (TypeError, ValueError):
+                # e.g. ints divided by floats or a read-only array
+                pass
+        new_values = f(*args)
+        if inplace:
+            self.values = new_values
+            return self
+        return self._new(new_values)
+
+    def __add__(self, ts):
+        return self._apply_data(np.add, ts)
+
+    def __sub__(self, ts):
+        return self._apply_data(np.subtract, ts)
+
+    def __mul__(self, ts):
+        return self._apply_data(np.multiply, ts)
+
+    def __div__(self, ts):
+        return self._apply_data(np.true_divide, ts)
+
+    def __truediv__(self, ts):
+        return self.__div__(ts)
+
+    def __reversed(self):
+        raise NotImplementedError
+
+    def __iadd__(self, ts):
+        return self._apply_data(np.add, ts, inplace=True)
+
+    def __isub__(self, ts):
+        return self._apply_data(np.subtract, ts, inplace=True)
+
+    def __imul__(self, ts):
+        return self._apply_data(np.multiply, ts, inplace=True)
+
+    def __idiv__(self, ts):
+        return self._apply_data(np.true_divide, ts, inplace=True)
+
+    def __itruediv__(self, ts):
+        return self.__idiv__(ts)
+
+    def __radd__(self, ts):
+        return self._apply_data(np.add, ts, reverse=True)
+
+    def __rsub__(self, ts):
+        return self._apply_data(np.subtract, ts, reverse=True)
+
+    def __rmul__(self, ts):
+        return self._apply_data(np.multiply, ts, reverse=True)
+
+    def __rdiv__(self, ts):
+        return self._apply_data(np.true_divide, ts, reverse=True)
+
+    def __rtruediv__(self, ts):
+        return self.__rdiv__(ts)
+
+    def __neg__(self):
+        return self._apply_data(np.negative, None)
+
+    def __abs__(self):
+        return self._apply_data(np.absolute, None)
+
+
+class AstonSeries(_TraceMath):
     def __init__(self, data, index=None, name=''):
         #TODO: reenable this without having to import from pandas
         #if isinstance(data, Series):
@@ -67,9 +207,18 @@ class AstonSeries(object):
         #find max and min of each chunk along with start and stop?
 
     def get_point(self, time, interp_method=None):
+        """
+        Linearly interpolates the value at time, which can also be an
+        array of times to look up all at once. Times outside of the
+        series are 0.
+        """
         #TODO: add more interpolation methods
         if len(self.index) < 2:
-            return np.nan
+            return np.nan * np.ones(np.shape(time)) if np.ndim(time) \
+                    else np.nan
+        if _is_sorted(self):
+            return np.interp(time, self.index, self.values, \
+                             left=0.0, right=0.0)
         f = interp1d(self.index, self.values, \
                      bounds_error=False, fill_value=0.0)
         return f(time)
@@ -80,98 +229,27 @@ class AstonSeries(object):
         adjs.__class__ = AstonSeries
         return adjs
 
-    def _retime(self, new_times, fill=0.0):
-        # this is not exposed because it returns a raw numpy array
-        from scipy.interpolate import interp1d
-        if new_times.shape == self.shape[0]:
-            if np.all(np.equal(new_times, self.index)):
-                return self
-        f = lambda d: interp1d(self.index, d, \
-            bounds_error=False, fill_value=fill)(new_times)
-        return np.apply_along_axis(f, 0, self.values)
+    def _new(self, values):
+        ts = AstonSeries.__new__(AstonSeries)
+        ts.values, ts.index, ts.name = values, self.index, self.name
+        return ts
 
-    def _apply_data(self, f, ts, reverse=False):
-        """
-        Convenience function for all of the math stuff.
+    def compress(self):
         """
-        #TODO: needs to catch np numeric types?
-        if isinstance(ts, (int, float)):
-            d = ts * np.ones(self.shape[0])
-        elif ts is None:
-            d = None
-        elif np.array_equal(ts.index, self.index):
-            d = ts.values
-        else:
-            d = ts._retime(self.index)
-
-        if not reverse:
-            new_data = np.apply_along_axis(f, 0, self.values, d)
-        else:
-            new_data = np.apply_along_axis(f, 0, d, self.values)
-        return AstonSeries(new_data, self.index, name=self.name)
-
-    def __add__(self, ts):
-        return self._apply_data(lambda x, y: x + y, ts)
-
-    def __sub__(self, ts):
-        return self._apply_data(lambda x, y: x - y, ts)
-
-    def __mul__(self, ts):
-        return self._apply_data(lambda x, y: x * y, ts)
-
-    def __div__(self, ts):
-        return self._apply_data(lambda x, y: x / y, ts)
-
-    def __truediv__(self, ts):
-        return self.__div__(ts)
-
-    def __reversed(self):
-        raise NotImplementedError
-
-    #TODO: this should happen in place?
-    def __iadd__(self, ts):
-        return self._apply_data(lambda x, y: x + y, ts)
-
-    def __isub__(self, ts):
-        return self._apply_data(lambda x, y: x - y, ts)
-
-    def __imul__(self, ts):
-        return self._apply_data(lambda x, y: x * y, ts)
-
-    def __idiv__(self, ts):
-        return self._apply_data(lambda x, y: x / y, ts)
-
-    def __radd__(self, ts):
-        return self._apply_data(lambda x, y: x + y, ts, reverse=True)
+        Serializes the AstonSeries.
 
-    def __rsub__(self, ts):
-        return self._apply_data(lambda x, y: x - y, ts, reverse=True)
-
-    def __rmul__(self, ts):
-        return self._apply_data(lambda x, y: x * y, ts, reverse=True)
-
-    def __rdiv__(self, ts):
-        return self._apply_data(lambda x, y: x / y, ts, reverse=True)
-
-    def __neg__(self):
-        return self._apply_data(lambda x, y: -x, None)
-
-    def __abs__(self):
-        return self._apply_data(lambda x, y: abs(x), None)
-
-    def compress(self):
-        i = self.index.astype(np.float32).tostring()
-        li = struct.pack('<L', len(i))
-        c = json.dumps([self.name]).encode('utf-8')
-        lc = struct.pack('<L', len(c))
-        v = self.values.astype(np.float64).tostring()
+        Returns
+        -------
+        bytes
+        """
+        zdata = pack(self.index, self.values, [self.name], 'series')
         try:  # python 2
-            return buffer(zlib.compress(lc + li + c + i + v))
+            return buffer(zdata)
         except NameError:  # python 3
-            return zlib.compress(lc + li + c + i + v)
+            return zdata
 
 
-class AstonFrame(object):
+class AstonFrame(_TraceMath):
     def __init__(self, data=None, index=None, columns=None):
         if data is None:
             self.values = np.array([])
@@ -198,6 +276,9 @@ class AstonFrame(object):
     def shape(self):
         return self.values.shape
 
+    def _new(self, values):
+        return AstonFrame(values, self.index, self.columns)
+
     def copy(self):
         return AstonFrame(self.values.copy(), self.index.copy(), \
                           self.columns.copy())
@@ -249,28 +330,88 @@ class AstonFrame(object):
         if isinstance(name, (int, float, np.float32, np.float64)):
             name = str(name)
 
+        vals = self.values[st_idx:en_idx]
         if name in ['tic', 'x', '']:
-            data = self.values.sum(axis=1)
+            # summing a sparse matrix gives a 2D np.matrix
+            data = np.asarray(vals.sum(axis=1)).ravel()
             name = 'tic'
         elif name == '!':
-            data = self[:, 0]
+            data = vals[:, 0]
+            if scipy.sparse.issparse(data):
+                data = data.toarray()
+            data = np.asarray(data).ravel()
             name = self.columns[0]
         elif set(name).issubset('1234567890.'):
-            cols = np.genfromtxt(np.array(self.columns).astype(bytes))
-            cols = np.abs(cols - float(name)) < tol
-            if not np.any(cols):
-                data = np.zeros(self.shape[0]) * np.nan
-            elif isinstance(self.values, scipy.sparse.spmatrix):
-                data = self.values[:, cols].toarray().sum(axis=1)
-            else:
-                data = self.values[:, cols].sum(axis=1)
+            data = self.traces_for([float(name)], tol, twin).values[:, 0]
         else:
-            data = np.zeros(self.shape[0]) * np.nan
+            data = np.zeros(en_idx - st_idx) * np.nan
             name = ''
 
         #TODO: better way to coerce this into the right class?
-        #TODO: use twin
-        return AstonSeries(data, index=self.index, name=name)
+        return AstonSeries(data, index=self.index[st_idx:en_idx], name=name)
+
+    def _column_index(self):
+        """
+        Returns the numeric value of every column (NaN if a column
+        isn't a number), those values sorted and the column indices
+        that sort them. This is cached until the columns are replaced.
+        """
+        cached = getattr(self, '_col_idx', None)
+        if cached is not None and cached[0] is self.columns and \
+           len(cached[1]) == len(self.columns):
+            return cached[1:]
+
+        try:
+            cols = np.asarray(self.columns, dtype=float)
+        except (TypeError, ValueError):
+            cols = np.array([_to_float(c) for c in self.columns])
+        cols = cols.ravel()
+        order = np.argsort(cols, kind='mergesort')
+        # NaNs sort to the end; leave them out of the searchable part
+        order = order[~np.isnan(cols[order])]
+        self._col_idx = (self.columns, cols, cols[order], order)
+        return self._col_idx[1:]
+
+    def traces_for(self, mzs, tol=0.5, twin=None):
+        """
+        Extracts many traces at once by summing every column within
+        tol of each of mzs.
+
+        Parameters
+        ----------
+        mzs : list of float
+        tol : float or list of float, optional
+        twin : tuple, optional
+
+        Returns
+        -------
+        AstonFrame
+            With one column for each of mzs; a column is all NaN if
+            there are no columns close to its m/z.
+        """
+        st_idx, en_idx = _slice_idxs(self, twin)
+        mzs = np.asarray(mzs, dtype=float)
+        tol = np.broadcast_to(np.asarray(tol, dtype=float), mzs.shape)
+        cols, srt_cols, order = self._column_index()
+
+        # build a sparse (columns x mzs) indicator matrix and take the
+        # product with the data to sum every trace in one pass
+        los = np.searchsorted(srt_cols, mzs - tol, 'right')
+        his = np.maximum(los, np.searchsorted(srt_cols, mzs + tol, 'left'))
+        indptr = np.zeros(len(mzs) + 1, dtype=int)
+        np.cumsum(his - los, out=indptr[1:])
+        indices = order[np.repeat(los - indptr[:-1], his - los) + \
+                        np.arange(indptr[-1])]
+        ind = scipy.sparse.csc_matrix((np.ones(len(indices)), indices, \
+                                       indptr), shape=(len(cols), len(mzs)))
+
+        values = self.values[st_idx:en_idx]
+        data = ind.T.dot(values.T).T
+        if scipy.sparse.issparse(data):
+            data = data.toarray()
+        data = np.asarray(data, dtype=float).reshape(-1, len(mzs))
+        data[:, his == los] = np.nan
+        return AstonFrame(data, self.index[st_idx:en_idx], mzs.tolist())
 
     def plot(self, style='heatmap', legend=False, cmap=None, ax=None):
         """
@@ -303,8 +444,7 @@ class AstonFrame(object):
             from matplotlib.colors import ListedColormap
             gaussian = lambda wvs, x, w: np.exp(-0.5 * ((wvs - x) / w) ** 2)
 
-            wvs = np.genfromtxt(np.array(self.columns).astype(bytes))
-            #wvs = self.columns.astype(float)
+            wvs = self._column_index()[0]
 
             #http://www.ppsloan.org/publications/XYZJCGT.pdf
             vis_filt = np.zeros((3, len(wvs)))
@@ -407,22 +547,32 @@ class AstonFrame(object):
         ----------
         t : float
         dt : float
+        aggfunc : {'sum', 'mean', 'max'} or callable, optional
+            How the spectra from t to t + dt are combined (by default
+            they're summed). A callable gets the rows of the spectra.
         """
-        idx = (np.abs(self.index - t)).argmin()
+        idx = _nearest_idxs(self, t)
 
         if dt is None:
             # only take the spectra at the nearest time
             mz_abn = self.values[idx, :].copy()
         else:
             # sum up all the spectra over a range
-            en_idx = (np.abs(self.index - t - dt)).argmin()
+            en_idx = _nearest_idxs(self, t + dt)
             idx, en_idx = min(idx, en_idx), max(idx, en_idx)
             if aggfunc is None:
                 mz_abn = self.values[idx:en_idx + 1, :].copy().sum(axis=0)
+            elif aggfunc in ('sum', 'mean', 'max'):
+                # both arrays and sparse matrices have these methods
+                mz_abn = getattr(self.values[idx:en_idx + 1, :], \
+                                 aggfunc)(axis=0)
             else:
                 mz_abn = aggfunc(self.values[idx:en_idx + 1, :].copy())
         if isinstance(mz_abn, scipy.sparse.spmatrix):
             mz_abn = mz_abn.toarray()[0]
+        elif isinstance(mz_abn, np.matrix):
+            # summing a sparse matrix gives a 2D np.matrix
+            mz_abn = mz_abn.A1
         return Scan(self.columns, mz_abn)
 
     def compress(self):
@@ -433,41 +583,217 @@ class AstonFrame(object):
         -------
         bytes
         """
-        i = self.index.astype(np.float32).tostring()
-        li = struct.pack('<L', len(i))
-        c = json.dumps(self.columns).encode('utf-8')
-        lc = struct.pack('<L', len(c))
-        v = self.values.astype(np.float64).tostring()
+        columns = [c.item() if isinstance(c, np.generic) else c \
+                   for c in self.columns]
+        zdata = pack(self.index, self.values, columns, 'frame')
         try:  # python 2
-            return buffer(zlib.compress(lc + li + c + i + v))
+            return buffer(zdata)
         except NameError:  # python 3
-            return zlib.compress(lc + li + c + i + v)
+            return zdata
 
 
-def decompress(zdata):
+class LazyAstonFrame(AstonFrame):
+    """
+    An AstonFrame that only decodes the rows that it's asked for.
+
+    Parameters
+    ----------
+    index : np.ndarray
+        The times of every row in the frame.
+    decoder : callable
+        Called with the first and last (exclusive) row to decode and
+        returns an AstonFrame containing only those rows.
+    columns : callable, optional
+        Returns the columns of the whole frame without decoding it
+        (e.g. from the m/z's in a file's scan index). Otherwise, the
+        whole frame is decoded to find them.
+
+    Nothing decoded is kept, so every call decodes its rows again.
+    """
+    def __init__(self, index, decoder, columns=None):
+        self.index = np.array(index)
+        self._decoder = decoder
+        self._find_columns = columns
+        self._columns = None
+
+    def _decode(self, st_idx=0, en_idx=None):
+        if en_idx is None:
+            en_idx = len(self.index)
+        return self._decoder(st_idx, en_idx)
+
+    # anything that needs the whole frame decodes the whole frame
+    @property
+    def values(self):
+        return self._decode().values
+
+    @property
+    def columns(self):
+        if self._find_columns is None:
+            return self._decode().columns
+        if self._columns is None:
+            self._columns = list(self._find_columns())
+        return self._columns
+
+    @property
+    def shape(self):
+        return (len(self.index), len(self.columns))
+
+    @property
+    def traces(self):
+        return self._decode().traces
+
+    def copy(self):
+        return self._decode().copy()
+
+    def __getitem__(self, key):
+        return self._decode()[key]
+
+    def plot(self, *args, **kwargs):
+        return self._decode().plot(*args, **kwargs)
+
+    def as_sound(self, *args, **kwargs):
+        return self._decode().as_sound(*args, **kwargs)
+
+    def compress(self):
+        return self._decode().compress()
+
+    def trace(self, name='tic', tol=0.5, twin=None):
+        st_idx, en_idx = _slice_idxs(self, twin)
+        return self._decode(st_idx, en_idx).trace(name, tol)
+
+    def traces_for(self, mzs, tol=0.5, twin=None):
+        st_idx, en_idx = _slice_idxs(self, twin)
+        return self._decode(st_idx, en_idx).traces_for(mzs, tol)
+
+    def _apply_data(self, f, ts, reverse=False, inplace=False):
+        # the result is a normal AstonFrame, even if inplace
+        return self._decode()._apply_data(f, ts, reverse)
+
+    def scan(self, t, dt=None, aggfunc=None):
+        st_idx = _nearest_idxs(self, t)
+        if dt is None:
+            en_idx = st_idx
+        else:
+            en_idx = _nearest_idxs(self, t + dt)
+            st_idx, en_idx = min(st_idx, en_idx), max(st_idx, en_idx)
+        return self._decode(st_idx, en_idx + 1).scan(t, dt, aggfunc)
+
+
+def decompress(zdata, twin=None):
     """
     Unserializes an AstonFrame.
 
     Parameters
     ----------
     zdata : bytes
+    twin : tuple, optional
+        Only decompress the data between these two times. This is only
+        faster than decompressing everything for the chunked format.
 
     Returns
     -------
     AstonSeries or AstonFrame
 
     """
-    data = zlib.decompress(zdata)
-    lc = struct.unpack('<L', data[0:4])[0]
-    li = struct.unpack('<L', data[4:8])[0]
-    c = json.loads(data[8:8 + lc].decode('utf-8'))
-    i = np.fromstring(data[8 + lc:8 + lc + li], dtype=np.float32)
-    v = np.fromstring(data[8 + lc + li:], dtype=np.float64)
-
-    if len(c) == 1:
-        return AstonSeries(v, i, name=c[0])
+    if is_chunked(zdata):
+        i, v, c, kind = unpack(zdata, twin)
+        if kind == 'series':
+            df = AstonSeries(v, i, name=c[0])
+        else:
+            df = AstonFrame(v, i, c)
     else:
-        return AstonFrame(v.reshape(len(i), len(c)), i, c)
+        # the original format: everything zlib'd together
+        data = zlib.decompress(bytes(zdata))
+        lc = struct.unpack('<L', data[0:4])[0]
+        li = struct.unpack('<L', data[4:8])[0]
+        c = json.loads(data[8:8 + lc].decode('utf-8'))
+        i = np.frombuffer(data[8 + lc:8 + lc + li], dtype=np.float32)
+        v = np.frombuffer(data[8 + lc + li:], dtype=np.float64)
+
+        if len(c) == 1:
+            df = AstonSeries(v, i, name=c[0])
+        else:
+            df = AstonFrame(v.reshape(len(i), len(c)), i, c)
+
+    if twin is not None:
+        st_idx, en_idx = _slice_idxs(df, twin)
+        if isinstance(df, AstonSeries):
+            df = AstonSeries(df.values[st_idx:en_idx], \
+                             df.index[st_idx:en_idx], df.name)
+        else:
+            df = AstonFrame(df.values[st_idx:en_idx], \
+                            df.index[st_idx:en_idx], df.columns)
+    return df
+
+
+def _to_float(c):
+    try:
+        return float(c)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+_RETIME_PLANS = []
+
+
+def _retime_plan(old_times, new_times):
+    """
+    Returns the indices and weights to linearly interpolate data at
+    old_times onto new_times (and a mask of the new_times outside of
+    old_times). The most recent plans are cached, so retiming many
+    traces from one run onto another only works this out once.
+    """
+    for o_t, n_t, plan in _RETIME_PLANS:
+        if np.array_equal(o_t, old_times) and np.array_equal(n_t, new_times):
+            return plan
+
+    old_times = np.asarray(old_times, dtype=float)
+    order = np.argsort(old_times, kind='mergesort')
+    srt = old_times[order]
+    i = np.clip(np.searchsorted(srt, new_times, 'right') - 1, \
+                0, max(len(srt) - 2, 0))
+    j = np.minimum(i + 1, len(srt) - 1)
+    dx = srt[j] - srt[i]
+    w = np.where(dx > 0, (new_times - srt[i]) / np.where(dx > 0, dx, 1.), 0.)
+    outside = (new_times < srt[0]) | (new_times > srt[-1])
+    plan = (order[i], order[j], w, outside)
+
+    _RETIME_PLANS.insert(0, (old_times.copy(), new_times.copy(), plan))
+    del _RETIME_PLANS[16:]
+    return plan
+
+
+def _is_sorted(df):
+    """
+    True if the index of df is in ascending order; this is cached
+    until the index is replaced.
+    """
+    cached = getattr(df, '_srt_idx', None)
+    if cached is None or cached[0] is not df.index:
+        tme = df.index
+        cached = (tme, bool(np.all(tme[1:] >= tme[:-1])))
+        df._srt_idx = cached
+    return cached[1]
+
+
+def _nearest_idxs(df, t):
+    """
+    Returns the index of the time closest to t (which can be an
+    array) in df. Ties go to the earliest time, like argmin.
+    """
+    tme = df.index
+    if not _is_sorted(df):
+        if np.ndim(t):
+            return np.array([np.abs(tme - i).argmin() for i in t])
+        return (np.abs(tme - t)).argmin()
+    if len(tme) < 2:
+        return np.zeros(np.shape(t), dtype=int) if np.ndim(t) else 0
+
+    idx = np.clip(np.searchsorted(tme, t), 1, len(tme) - 1)
+    idx = np.where(t - tme[idx - 1] <= tme[idx] - t, idx - 1, idx)
+    # if that time is repeated, use the first one
+    idx = np.searchsorted(tme, tme[idx])
+    return idx if np.ndim(t) else int(idx)
 
 
 def _slice_idxs(df, twin=None):
@@ -476,17 +802,17 @@ def _slice_idxs(df, twin=None):
     the two times specified. Assumes the array is the same
     length as self.data. Acts in the time() and trace() functions.
     """
-    if twin is None:
-        return 0, df.shape[0]
-
     tme = df.index
 
+    if twin is None:
+        return 0, len(tme)
+
     if twin[0] is None:
         st_idx = 0
     else:
-        st_idx = (np.abs(tme - twin[0])).argmin()
+        st_idx = int(_nearest_idxs(df, twin[0]))
     if twin[1] is None:
-        en_idx = df.shape[0]
+        en_idx = len(tme)
     else:
-        en_idx = (np.abs(tme - twin[1])).argmin() + 1
+        en_idx = int(_nearest_idxs(df, twin[1])) + 1
     return st_idx, en_idx
@@ -2,6 +2,7 @@ import numpy as np
 import struct
 from aston.trace.Trace import AstonSeries
 from aston.tracefile.TraceFile import TraceFile
+from aston.tracefile.Common import delta_decode
 
 
 class AgilentFID(TraceFile):
@@ -28,24 +29,12 @@ class AgilentFID(TraceFile):
         #FIXME: why is there this del_ab code here?
         #f.seek(0x284)
         #del_ab = struct.unpack('>d', f.read(8))[0]
-        data = []
-
+        # the values are stored as differences of their differences,
+        # with a 32767 and then an absolute value every so often
         f.seek(0x400)
-        delt = 0
-        while True:
-            try:
-                inp = struct.unpack('>h', f.read(2))[0]
-            except struct.error:
-                break
-
-            if inp == 32767:
-                inp = struct.unpack('>i', f.read(4))[0]
-                inp2 = struct.unpack('>H', f.read(2))[0]
-                delt = 0
-                data.append(inp * 65534 + inp2)
-            else:
-                delt += inp
-                data.append(data[-1] + delt)
+        abs_val = lambda w: (w[:, 0] << 16 | w[:, 1]).astype(np.uint32) \
+                .view(np.int32).astype(np.int64) * 65534 + w[:, 2]
+        data = delta_decode(f.read(), 32767, 3, abs_val, order=2)
         f.close()
         # TODO: 0.4/60.0 should be obtained from the file???
         times = np.array(start_time + np.arange(len(data)) * (0.2 / 60.0))
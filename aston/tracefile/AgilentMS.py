@@ -1,16 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import os.path as op
-import gzip
-import io
 import struct
+import zlib
 from datetime import datetime
 from xml.etree import ElementTree
 import numpy as np
 import scipy.sparse
 from aston.resources import cache
-from aston.trace.Trace import AstonSeries, AstonFrame
+from aston.trace.Trace import AstonSeries, AstonFrame, LazyAstonFrame
 from aston.tracefile.TraceFile import TraceFile, ScanListFile
+from aston.tracefile.Common import load_index, save_index
+from aston.tracefile.FrameCache import disk_cache
 from aston.spectra.Scan import Scan
 
 
@@ -19,106 +20,49 @@ class AgilentMS(TraceFile):
     mgc = '0132'
     traces = ['#ms']
 
-    def total_trace(self, twin=None):
-        #TODO: use twin?
+    @cache(maxsize=1)
+    def _scan_index(self):
+        """
+        Memory-maps the data block of the file and finds the word offset
+        that every scan starts at. Nothing else is decoded.
+        """
         f = open(self.filename, 'rb')
+        nscans, dstart = _ms_header(f)
+        f.close()
 
-        # get number of scans to read in
-        f.seek(0x5)
-        if f.read(4) == 'GC':
-            f.seek(0x142)
-        else:
-            f.seek(0x118)
-        nscans = struct.unpack('>H', f.read(2))[0]
-
-        # find the starting location of the data
-        f.seek(0x10A)
-        f.seek(2 * struct.unpack('>H', f.read(2))[0] - 2)
+        nwords = (op.getsize(self.filename) - dstart) // 2
+        words = np.memmap(self.filename, dtype='>u2', mode='r', \
+                          offset=dstart, shape=(nwords,))
+        return words, _scan_offsets(words, nscans)
 
-        tme = np.zeros(nscans)
-        tic = np.zeros(nscans)
-        for i in range(nscans):
-            npos = f.tell() + 2 * struct.unpack('>H', f.read(2))[0]
-            tme[i] = struct.unpack('>I', f.read(4))[0] / 60000.
-            f.seek(npos - 4)
-            tic[i] = struct.unpack('>I', f.read(4))[0]
-            f.seek(npos)
-        f.close()
-        return AstonSeries(tic, tme, name='TIC')
+    def total_trace(self, twin=None):
+        words, offs = self._scan_index()
+        # the TIC is stored in the last two words of every scan
+        tic_pos = offs[1:] - 2
+        tic = (words[tic_pos].astype(np.uint32) << 16) | words[tic_pos + 1]
+        tme = _scan_times(words, offs)
+        return AstonSeries(tic.astype(float), tme, name='TIC').twin(twin)
 
     @property
     @cache(maxsize=1)
+    @disk_cache
     def data(self):
-        f = open(self.filename, 'rb')
+        if self.lazy:
+            # only decode the scans that are asked for
+            words, offs = self._scan_index()
+            decode = lambda st, en: _frame_from_scans(words, offs[st:en + 1])
+            return LazyAstonFrame(_scan_times(words, offs), decode, \
+                                  lambda: _scan_ions(words, offs))
 
-        # get number of scans to read in
-        # note that GC and LC chemstation store this in slightly different
-        # places
-        f.seek(0x5)
-        if f.read(4) == 'GC':
-            f.seek(0x142)
-        else:
-            f.seek(0x118)
-        nscans = struct.unpack('>H', f.read(2))[0]
-
-        f.seek(0x10A)
-        f.seek(2 * struct.unpack('>H', f.read(2))[0] - 2)
-        dstart = f.tell()
-
-        # determine total number of measurements in file
-        tot_pts = 0
-        rowst = np.empty(nscans + 1, dtype=int)
-        rowst[0] = 0
-
-        for scn in range(nscans):
-            # get the position of the next scan
-            npos = f.tell() + 2 * struct.unpack('>H', f.read(2))[0]
-
-            # keep a running total of how many measurements
-            tot_pts += (npos - f.tell() - 26) / 4
-            rowst[scn + 1] = tot_pts
-
-            # move forward
-            f.seek(npos)
+        f = open(self.filename, 'rb')
+        nscans, dstart = _ms_header(f)
 
-        # go back to the beginning and load all the other data
+        # read the entire data block in at once as big-endian words
         f.seek(dstart)
-
-        ions = []
-        i_lkup = {}
-        cols = np.empty(tot_pts, dtype=int)
-        vals = np.empty(tot_pts, dtype=np.int32)
-        times = np.empty(nscans)
-
-        for scn in range(nscans):
-            npos = f.tell() + 2 * struct.unpack('>H', f.read(2))[0]
-
-            # the sampling rate is evidentally 60 kHz on all Agilent's MS's
-            times[scn] = struct.unpack('>I', f.read(4))[0] / 60000.
-
-            f.seek(f.tell() + 12)
-            npts = rowst[scn + 1] - rowst[scn]
-            mzs = struct.unpack('>' + npts * 'HH', f.read(npts * 4))
-
-            # there's some bug in the numpy implementation that makes this fail
-            # after the first time
-            #mzs = np.fromfile(f, dtype='>H', count=npts * 2)
-
-            nions = set(mzs[0::2]).difference(i_lkup)
-            i_lkup.update({ion: i + len(ions) for i, ion in enumerate(nions)})
-            ions += nions
-
-            cols[rowst[scn]:rowst[scn + 1]] = \
-              [i_lkup[i] for i in mzs[0::2]]
-            vals[rowst[scn]:rowst[scn + 1]] = mzs[1::2]
-            f.seek(npos)
+        raw = f.read()
         f.close()
-
-        vals = ((vals & 16383) * 8 ** (vals >> 14)).astype(float)
-        data = scipy.sparse.csr_matrix((vals, cols, rowst), \
-          shape=(nscans, len(ions)), dtype=float)
-        ions = np.array(ions) / 20.
-        return AstonFrame(data, times, ions)
+        words = np.frombuffer(raw[:len(raw) - len(raw) % 2], dtype='>u2')
+        return _frame_from_scans(words, _scan_offsets(words, nscans))
 
     @property
     @cache(maxsize=1)
@@ -212,6 +156,110 @@ class AgilentMS(TraceFile):
         return d
 
 
+def _ms_header(f):
+    """
+    Returns the number of scans in a *.MS file and the offset
+    that the first scan starts at.
+    """
+    # note that GC and LC chemstation store this in slightly different
+    # places
+    f.seek(0x5)
+    if f.read(4) == 'GC':
+        f.seek(0x142)
+    else:
+        f.seek(0x118)
+    nscans = struct.unpack('>H', f.read(2))[0]
+
+    f.seek(0x10A)
+    dstart = 2 * struct.unpack('>H', f.read(2))[0] - 2
+    return nscans, dstart
+
+
+def _scan_offsets(words, nscans):
+    """
+    Given the data block of a *.MS file as big-endian words, returns the
+    word offset of every scan (and the end of the last one).
+
+    Each scan starts with its own length in words, so this has to hop
+    from scan to scan, but it's only one lookup per scan.
+    """
+    offs = np.empty(nscans + 1, dtype=int)
+    pos = 0
+    for scn in range(nscans):
+        offs[scn] = pos
+        pos += int(words[pos])
+    offs[nscans] = pos
+    return offs
+
+
+def _scan_times(words, offs):
+    """
+    Times (in minutes) of the scans starting at word offsets offs[:-1].
+    """
+    st = offs[:-1]
+    # the sampling rate is evidentally 60 kHz on all Agilent's MS's
+    return ((words[st + 1].astype(np.uint32) << 16) | words[st + 2]) / 60000.
+
+
+def _decode_scans(words, offs):
+    """
+    Pulls the row pointers, raw m/z's and raw abundances out of the
+    scans starting at word offsets offs[:-1] in one vectorized pass.
+    """
+    st = offs[:-1]
+    # each scan is 14 words of header/footer and two words per point
+    npts = (offs[1:] - st - 14) // 2
+    indptr = np.zeros(len(st) + 1, dtype=int)
+    np.cumsum(npts, out=indptr[1:])
+
+    # the word offset of the m/z of every point in the file
+    pt_pos = np.repeat(st + 9 - 2 * indptr[:-1], npts) + \
+            2 * np.arange(indptr[-1])
+    # gather into native-endian uint16's: the m/z's index the lookup
+    # table in _frame_from_scans and the abundances get split into bit
+    # fields, and both are cheaper on native words than big-endian ones
+    mzs = words[pt_pos].astype(np.uint16)
+    abns = words[pt_pos + 1].astype(np.uint16)
+    return indptr, mzs, abns
+
+
+def _frame_from_scans(words, offs):
+    """
+    Decodes the scans starting at word offsets offs[:-1] into a
+    sparse AstonFrame.
+    """
+    indptr, mzs, abns = _decode_scans(words, offs)
+
+    # map every m/z onto a column of the sparse matrix; this is the
+    # same as np.unique(mzs, return_inverse=True), but because m/z's
+    # are 16-bit we can use a lookup table instead of sorting
+    ions = np.flatnonzero(np.bincount(mzs))
+    lkup = np.zeros(ions[-1] + 1 if len(ions) > 0 else 0, dtype=int)
+    lkup[ions] = np.arange(len(ions))
+    data = scipy.sparse.csr_matrix((_abundance(abns), lkup[mzs], indptr), \
+      shape=(len(offs) - 1, len(ions)), dtype=float)
+    return AstonFrame(data, _scan_times(words, offs), ions / 20.)
+
+
+def _scan_ions(words, offs, chunk=1000):
+    """
+    The (sorted) m/z's in any of the scans starting at word offsets
+    offs[:-1], found a chunk of scans at a time so the points of the
+    whole file are never in memory at once.
+    """
+    seen = np.zeros(2 ** 16, dtype=bool)
+    for st in range(0, len(offs) - 1, chunk):
+        seen[_decode_scans(words, offs[st:st + chunk + 1])[1]] = True
+    return np.flatnonzero(seen) / 20.
+
+
+def _abundance(abns):
+    """
+    Abundances are stored as a 14-bit mantissa and a 2-bit (base 8) exponent.
+    """
+    return (abns & 16383) * 8. ** (abns >> 14)
+
+
 class AgilentMSMSScan(ScanListFile):
     ext = 'BIN'
     mgc = '0101'
@@ -226,9 +274,9 @@ class AgilentMSMSScan(ScanListFile):
                          'xs:byte': 'b', 'xs:double': 'd', 'xs:float': 'f'}
         rfrmt = {}
 
-        for n in r.getchildren():
+        for n in r:
             name = n.get('name')
-            for sn in n.getchildren()[0].getchildren():
+            for sn in n[0]:
                 if rfrmt.get(name, None) is None:
                     rfrmt[name] = []
                 sname = sn.get('name')
@@ -266,59 +314,70 @@ class AgilentMSMSScan(ScanListFile):
             yield (data[l] for l in loc)
         f.close()
 
+    @cache(maxsize=1)
+    def _scan_index(self):
+        """
+        The time, TIC and location of the profile of every scan from
+        the records in MSScan.bin. These are saved next to the file, so
+        this only has to be done once.
+        """
+        idx = load_index(self.filename)
+        if idx is not None:
+            return idx
+
+        flds = ['ScanTime', 'TIC', 'SpectrumFormatID', 'SpectrumOffset', \
+                'ByteCount', 'PointCount', 'MinX', 'MaxX']
+        keys = ['times', 'tic', 'formats', 'offsets', \
+                'bytecounts', 'pointcounts', 'minx', 'maxx']
+        recs = [tuple(r) for r in self._scan_iter(flds)]
+        cols = list(zip(*recs)) if len(recs) > 0 else len(keys) * [()]
+        idx = dict((k, np.array(c)) for k, c in zip(keys, cols))
+        idx['times'] = idx['times'].astype(float)
+        save_index(self.filename, **idx)
+        return idx
+
     def total_trace(self, twin=None):
         if twin is None:
             twin = (-np.inf, np.inf)
-        tme = []
-        tic = []
-        for t, z in self._scan_iter(['ScanTime', 'TIC']):
-            if t < twin[0]:
-                continue
-            elif t > twin[1]:
-                break
-            tme.append(t)
-            tic.append(z)
-        return AstonSeries(np.array(tic), np.array(tme), name='TIC')
-        #TODO: set .twin(twin) bounds on this
+        idx = self._scan_index()
+        win = (idx['times'] >= twin[0]) & (idx['times'] <= twin[1])
+        return AstonSeries(idx['tic'][win].astype(float), \
+                           idx['times'][win], name='TIC')
 
     def scans(self, twin=None):
         if twin is None:
             twin = (-np.inf, np.inf)
-
-        #super hack-y way to disable checksum and length checking
-        gzip.GzipFile._read_eof = lambda _: None
-        # standard prefix for every zip chunk
-        gzprefix = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x04\x00'
-
-        def uncompress(d):
-            return gzip.GzipFile(fileobj=io.BytesIO(gzprefix + d)).read()
-
-        f = open(op.join(op.split(self.filename)[0], 'MSProfile.bin'), 'rb')
-
-        flds = ['ScanTime', 'SpectrumFormatID', 'SpectrumOffset', \
-                'ByteCount', 'PointCount', 'MinX', 'MaxX']
-
-        for t, fmt, off, bc, pc, minx, maxx in self._scan_iter(flds):
-            if t < twin[0]:
-                continue
-            if t > twin[1]:
-                break
-
-            f.seek(off)
-            if fmt == 1:
-                # this record is compressed with gz
-                profdata = uncompress(f.read(bc))
-                pd = np.array(struct.unpack('dd' + pc * 'i', profdata)[2:])
-            elif fmt == 2:
-                profdata = f.read(bc)
-                pd = np.array(struct.unpack('dd' + pc * 'f', profdata)[2:])
-            else:
-                raise NotImplementedError('Unknown Agilent MH Scan format')
-            #TODO: probably not a good approximation?
-            ions = np.linspace(minx, maxx, len(pd))
-            yield Scan(ions, pd, name=t)
-
-        f.close()
+        times = self._scan_index()['times']
+        win = (times >= twin[0]) & (times <= twin[1])
+        return self._iter_scans(np.flatnonzero(win))
+
+    def _read_scans(self, idxs):
+        return list(self._iter_scans(idxs))
+
+    def _iter_scans(self, idxs):
+        idx = self._scan_index()
+        with open(op.join(op.split(self.filename)[0], 'MSProfile.bin'), \
+                  'rb') as f:
+            for i in idxs:
+                f.seek(idx['offsets'][i])
+                profdata = f.read(idx['bytecounts'][i])
+                if idx['formats'][i] == 1:
+                    # this record is compressed with gz (but only the
+                    # deflated data is stored, not the gzip header)
+                    profdata = zlib.decompressobj(-zlib.MAX_WBITS) \
+                            .decompress(profdata)
+                    dtype = '<i4'
+                elif idx['formats'][i] == 2:
+                    dtype = '<f4'
+                else:
+                    raise NotImplementedError('Unknown Agilent MH ' + \
+                                              'Scan format')
+                # the points come after two doubles
+                pd = np.frombuffer(profdata, dtype=dtype, offset=16, \
+                                   count=idx['pointcounts'][i])
+                #TODO: probably not a good approximation?
+                ions = np.linspace(idx['minx'][i], idx['maxx'][i], len(pd))
+                yield Scan(ions, pd.astype(float), name=idx['times'][i])
 
     def mrm_trace(self, parent=None, daughter=None, tol=0.5, twin=None):
         if twin is None:
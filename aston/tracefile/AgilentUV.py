@@ -4,8 +4,18 @@ import struct
 from datetime import datetime
 import numpy as np
 from aston.resources import cache
-from aston.trace.Trace import AstonFrame
+from aston.trace.Trace import AstonFrame, LazyAstonFrame
 from aston.tracefile.TraceFile import TraceFile
+from aston.tracefile.Common import delta_decode
+from aston.tracefile.FrameCache import disk_cache
+
+
+def _abs_i4(w):
+    """
+    The absolute values (a big-endian int32) after each escape
+    in the data of a *.ch file.
+    """
+    return (w[:, 0] << 16 | w[:, 1]).astype(np.uint32).view(np.int32)
 
 
 class AgilentMWD(TraceFile):
@@ -15,7 +25,6 @@ class AgilentMWD(TraceFile):
 
     @property
     def data(self):
-        print(self.filename)
         #Because the spectra are stored in several files in the same
         #directory, we need to loop through them and return them together.
         ions = []
@@ -61,28 +70,13 @@ class AgilentMWD(TraceFile):
         f.seek(0x284)
         del_ab = struct.unpack('>d', f.read(8))[0]
 
-        data = np.array([])
-
-        f.seek(0x401)
-        loc = 0
-        while True:
-            rec_len = struct.unpack('>B', f.read(1))[0]
-            if rec_len == 0:
-                break
-            data = np.append(data, np.empty(rec_len))
-            for _ in range(rec_len):
-                inp = struct.unpack('>h', f.read(2))[0]
-                if inp == -32768:
-                    inp = struct.unpack('>i', f.read(4))[0]
-                    data[loc] = del_ab * inp
-                elif loc == 0:
-                    data[loc] = del_ab * inp
-                else:
-                    data[loc] = data[loc - 1] + del_ab * inp
-                loc += 1
-            f.read(1)  # this value is always 0x10?
+        # records of up to 255 values, each with a 0x10 and a count
+        # in front; a record with no values ends the data
+        f.seek(0x400)
+        data = delta_decode(f.read(), -32768, 2, _abs_i4, \
+                            records=lambda hdr: hdr & 0xFF == 0)
         f.close()
-        return wv, data
+        return wv, del_ab * data
 
     @property
     def info(self):
@@ -155,25 +149,11 @@ class AgilentMWD2(TraceFile):
         f.seek(0x127C)
         del_ab = struct.unpack('>d', f.read(8))[0]
 
-        #data = np.array([])
-        data = []
-
         f.seek(0x1800)
-        while True:
-            x, nrecs = struct.unpack('>BB', f.read(2))
-            if x == 0 and nrecs == 0:
-                break
-            for _ in range(nrecs):
-                inp = struct.unpack('>h', f.read(2))[0]
-                if inp == -32768:
-                    inp = struct.unpack('>i', f.read(4))[0]
-                    data.append(del_ab * inp)
-                elif len(data) == 0:
-                    data.append(del_ab * inp)
-                else:
-                    data.append(data[-1] + del_ab * inp)
+        data = delta_decode(f.read(), -32768, 2, _abs_i4, \
+                            records=lambda hdr: hdr == 0)
         f.close()
-        return wv, np.array(data)
+        return wv, del_ab * data
 
     @property
     def info(self):
@@ -222,36 +202,46 @@ class AgilentDAD(TraceFile):
     #time series in DAD1.sg
     #all doubles, starts at 0x44
     #750x 54 double entries
+    @cache(maxsize=1)
+    def _scan_index(self):
+        """
+        Reads the headers of every scan (from the *.sd file) and
+        memory-maps the spectra (in the *.sp file).
+        """
+        with open(self.filename[:-3] + '.sd', 'rb') as f:
+            f.seek(0x50)
+            nscans = struct.unpack('<Q', f.read(8))[0]
+            f.seek(0xA4)
+            hdrs = np.fromfile(f, dtype=_DAD_SCAN, count=nscans)
+        spectra = np.memmap(self.filename[:-3] + '.sp', dtype=np.uint8, \
+                            mode='r')
+        return spectra, hdrs
+
     @property
+    @cache(maxsize=1)
     def data(self):
-        fhead = open(self.filename[:-3] + '.sd', 'rb')
-        fdata = open(self.filename[:-3] + '.sp', 'rb')
-
-        fhead.seek(0x50)
-        nscans = struct.unpack('Q', fhead.read(8))[0]
-        fhead.seek(0xA4)
-
-        ions = []
-        for scn in range(nscans):
-            t = struct.unpack('<IdddIQIIdddd', fhead.read(80))
-
-            npts = t[7]
-            if scn == 0:
-                #TODO: this will fail if the wavelengths collected
-                #change through the run.
-                data = np.zeros((nscans, npts))
-                times = np.zeros((nscans))
-                ions = [t[8] + x * t[3] for x in range(npts)]
-
-            times[scn] = t[1]
-
-            fdata.seek(t[5] + 16)
-            #TODO: use np.fromfile?
-            data[scn] = struct.unpack('<' + npts * 'd', fdata.read(npts * 8))
-        return AstonFrame(data, times, ions)
-
-        fhead.close()
-        fdata.close()
+        return self.read_window()
+
+    def read_window(self, twin=None, wvwin=None):
+        """
+        Reads only the scans in twin and the wavelengths in wvwin.
+        """
+        spectra, hdrs = self._scan_index()
+        st, en = _window_idxs(hdrs['time'], twin)
+        hdrs = hdrs[st:en]
+        if len(hdrs) == 0:
+            return AstonFrame(np.zeros((0, 0)), np.array([]), [])
+
+        #TODO: this will fail if the wavelengths collected
+        #change through the run.
+        wvs = hdrs['wv_st'][0] + hdrs['wv_step'][0] * \
+                np.arange(hdrs['npts'][0])
+        cols = np.flatnonzero(_in_window(wvs, wvwin))
+
+        # every value is a double, 16 bytes into its scan's record
+        data = _f8_scans(spectra, hdrs['offset'].astype(np.int64) + 16, \
+                         len(wvs), cols)
+        return AstonFrame(data, hdrs['time'].copy(), wvs[cols].tolist())
 
 
 class AgilentCSDAD(TraceFile):
@@ -262,47 +252,31 @@ class AgilentCSDAD(TraceFile):
     mgc = '0233'
     traces = ['#uv']
 
+    @cache(maxsize=1)
+    def _scan_index(self):
+        return _cs_scan_index(self.filename, 0x202)
+
     @property
     @cache(maxsize=1)
+    @disk_cache
     def data(self):
         #TODO: the chromatograms this generates are not exactly the
         #same as the ones in the *.CH files. Maybe they need to be 0'd?
-        f = open(self.filename, 'rb')
-
-        f.seek(0x116)
-        nscans = struct.unpack('>i', f.read(4))[0]
-
-        times = np.zeros(nscans)
-        data = nscans * [{}]
-        ions = []
-        npos = 0x202
-        for i in range(nscans):
-            f.seek(npos)
-            npos += struct.unpack('<H', f.read(2))[0]
-            times[i] = struct.unpack('<L', f.read(4))[0] / 60000.
-            nm_srt = struct.unpack('<H', f.read(2))[0] / 20.
-            nm_end = struct.unpack('<H', f.read(2))[0] / 20.
-            nm_stp = struct.unpack('<H', f.read(2))[0] / 20.
-            f.read(8)
-            s = {}
-            v = struct.unpack('<h', f.read(2))[0] / 2000.
-            s[nm_srt] = v
-            for wv in np.arange(nm_srt, nm_end, nm_stp):
-                ov = struct.unpack('<h', f.read(2))[0]
-                if ov == -32768:
-                    v = struct.unpack('<i', f.read(4))[0] / 2000.
-                else:
-                    v += ov / 2000.
-                s[wv] = v
-                if wv not in ions:
-                    ions.append(wv)
-            data[i] = s
-
-        ndata = np.zeros((nscans, len(ions)))
-        for i, d in zip(range(nscans), data):
-            for ion, abn in d.items():
-                ndata[i, ions.index(ion)] = abn
-        return AstonFrame(ndata, times, ions)
+        if self.lazy:
+            raw, offs, hdrs = self._scan_index()
+            decode = lambda st, en: _cs_decode(raw, offs[st:en], \
+                                               hdrs[st:en], True)
+            return LazyAstonFrame(hdrs['time'] / 60000., decode, \
+                                  lambda: _cs_wavelengths(hdrs))
+        return self.read_window()
+
+    def read_window(self, twin=None, wvwin=None):
+        """
+        Decodes only the scans in twin and the wavelengths in wvwin.
+        """
+        raw, offs, hdrs = self._scan_index()
+        st, en = _window_idxs(hdrs['time'] / 60000., twin)
+        return _cs_decode(raw, offs[st:en], hdrs[st:en], True, wvwin)
 
     @property
     def info(self):
@@ -343,86 +317,29 @@ class AgilentCSDAD2(TraceFile):
     mgc = '0331'
     traces = ['#uv']
 
-    #@profile
+    @cache(maxsize=1)
+    def _scan_index(self):
+        return _cs_scan_index(self.filename, 0x1002)
+
     @property
     @cache(maxsize=1)
+    @disk_cache
     def data(self):
-        f = open(self.filename, 'rb')
-
-        f.seek(0x116)
-        nscans = struct.unpack('>i', f.read(4))[0]
-
-        # get all wavelengths and times
-        wvs = set()
-        times = np.empty(nscans)
-        npos = 0x1002
-        for i in range(nscans):
-            f.seek(npos)
-            npos += struct.unpack('<H', f.read(2))[0]
-            times[i] = struct.unpack('<L', f.read(4))[0]
-            nm_srt, nm_end, nm_stp = struct.unpack('<HHH', f.read(6))
-            n_wvs = np.arange(nm_srt, nm_end, nm_stp) / 20.
-            wvs.update(set(n_wvs).difference(wvs))
-        wvs = list(wvs)
-
-        ndata = np.empty((nscans, len(wvs)), dtype="<i4")
-        npos = 0x1002
-
-        # try to speed up by preloading the function
-        unpack = struct.unpack
-        seek = f.seek
-        read = f.read
-        tell = f.tell
-
-        for i in range(nscans):
-            seek(npos)
-            dlen = unpack('<H', read(2))[0]
-            npos += dlen
-            seek(tell() + 4)  # skip time
-            nm_srt, nm_end, nm_stp = unpack('<HHH', read(6))
-            seek(tell() + 8)
-
-            ## OLD CODE
-            v = 0
-            pos = f.tell()
-            for wv in np.arange(nm_srt, nm_end, nm_stp) / 20.:
-                ov = unpack('<h', read(2))[0]
-                if ov == -32768:
-                    v = unpack('<i', read(4))[0]
-                else:
-                    v += ov
-                ndata[i, wvs.index(wv)] = v
-            seek(pos)
-
-            ## WORKING ON A FASTER WAY TO READ ALL THIS DATA BELOW
-            ## read in all the data
-            #data = np.fromfile(f, dtype="<i2", count=int((dlen - 24) / 2))
-
-            ## if there are any records marked -32768, we need to reinterpret
-            ## parts of the array as i4's
-            #oob_idxs = np.where(data == -32768)[0]
-
-            ## locations of the cells to merge into 32-bit ints
-            #big_idxs = np.repeat(oob_idxs, 2) + \
-            #        np.tile([1, 2], oob_idxs.shape[0])
-            #big_data = data[big_idxs].view('<i4').copy()
-
-            ## remove the 32-bit cells, so the arrays the right size
-            #data = np.delete(data, big_idxs).astype("<i4")
-
-            ## set the marker cells to the right values
-            #oob_idxs = np.where(data == -32768)[0]
-            #data[oob_idxs] = big_data
-
-            ## compute cumulative sums for each chunk
-            #pidx = 0
-            #if data.shape[0] != ndata.shape[1]:
-            #    print(big_data)
-            #for idx in np.hstack([oob_idxs, data.shape[0]]):
-            #    ndata[i, pidx:idx] = np.cumsum(data[pidx:idx])
-            #    pidx = idx
-
-        return AstonFrame(ndata / 2000., times / 60000., wvs)
+        if self.lazy:
+            raw, offs, hdrs = self._scan_index()
+            decode = lambda st, en: _cs_decode(raw, offs[st:en], \
+                                               hdrs[st:en], False)
+            return LazyAstonFrame(hdrs['time'] / 60000., decode, \
+                                  lambda: _cs_wavelengths(hdrs))
+        return self.read_window()
+
+    def read_window(self, twin=None, wvwin=None):
+        """
+        Decodes only the scans in twin and the wavelengths in wvwin.
+        """
+        raw, offs, hdrs = self._scan_index()
+        st, en = _window_idxs(hdrs['time'] / 60000., twin)
+        return _cs_decode(raw, offs[st:en], hdrs[st:en], False, wvwin)
 
     @property
     def info(self):
@@ -442,3 +359,139 @@ class AgilentCSDAD2(TraceFile):
             f.seek(0xC15)
             d['y_units'] = string_read(f)
         return d
+
+
+# the header of every scan in the *.sd file of a DAD run
+_DAD_SCAN = np.dtype([('x0', '<u4'), ('time', '<f8'), ('x1', '<f8'), \
+                      ('wv_step', '<f8'), ('x2', '<u4'), ('offset', '<u8'), \
+                      ('x3', '<u4'), ('npts', '<u4'), ('wv_st', '<f8'), \
+                      ('x4', '<f8', 3)])
+
+# the header of every scan in a Chemstation *.uv file
+_CS_SCAN = np.dtype([('len', '<u2'), ('time', '<u4'), ('wv_st', '<u2'), \
+                     ('wv_en', '<u2'), ('wv_step', '<u2'), ('x0', 'V8')])
+
+
+def _window_idxs(times, twin):
+    """
+    The first and last (exclusive) of the sorted times in twin.
+    """
+    if twin is None:
+        return 0, len(times)
+    st = 0 if twin[0] is None else np.searchsorted(times, twin[0], 'left')
+    en = len(times) if twin[1] is None else \
+            np.searchsorted(times, twin[1], 'right')
+    return int(st), int(en)
+
+
+def _in_window(wvs, wvwin):
+    if wvwin is None:
+        return np.ones(len(wvs), dtype=bool)
+    lo = -np.inf if wvwin[0] is None else wvwin[0]
+    hi = np.inf if wvwin[1] is None else wvwin[1]
+    return (wvs >= lo) & (wvs <= hi)
+
+
+def _f8_scans(buf, offs, npts, cols):
+    """
+    Reads the doubles in cols out of the npts-long (little-endian)
+    arrays that start at offs in buf, without copying whole scans.
+    """
+    steps = np.diff(offs)
+    if len(offs) == 1 or (np.all(steps == steps[0]) and steps[0] > 0):
+        # evenly spaced records can be looked at as one 2D array
+        step = int(steps[0]) if len(steps) > 0 else 8 * npts
+        scans = np.ndarray((len(offs), npts), '<f8', buf, int(offs[0]), \
+                           (step, 8))
+        return scans[:, cols]
+    data = np.empty((len(offs), len(cols)))
+    for i, off in enumerate(offs):
+        data[i] = np.ndarray((npts,), '<f8', buf, int(off))[cols]
+    return data
+
+
+def _cs_scan_index(filename, data_start):
+    """
+    Memory-maps a Chemstation *.uv file, follows the lengths of the
+    scans to find where each one starts, and reads all their headers.
+    """
+    raw = np.memmap(filename, dtype=np.uint8, mode='r')
+    nscans = struct.unpack_from('>i', raw, 0x116)[0]
+    offs = np.empty(nscans, dtype=np.int64)
+    pos, hlen = data_start, _CS_SCAN.itemsize
+    for i in range(nscans):
+        if pos + hlen > len(raw):
+            nscans = i
+            break
+        offs[i] = pos
+        pos += struct.unpack_from('<H', raw, pos)[0]
+    offs = offs[:nscans]
+    hdrs = np.empty(nscans, dtype=_CS_SCAN)
+    for i, off in enumerate(offs):
+        hdrs[i] = np.ndarray((), _CS_SCAN, raw, off)
+    return raw, offs, hdrs
+
+
+def _cs_wavelengths(hdrs):
+    """
+    Every wavelength that the scans with the headers hdrs (of a
+    Chemstation *.uv file) have a value for.
+    """
+    rngs = set(zip(hdrs['wv_st'].tolist(), hdrs['wv_en'].tolist(), \
+                   hdrs['wv_step'].tolist()))
+    wvs = set()
+    for st, en, step in rngs:
+        wvs.update(range(st, en, max(step, 1)))
+    return (np.array(sorted(wvs)) / 20.).tolist()
+
+
+def _cs_decode(raw, offs, hdrs, base_word, wvwin=None):
+    """
+    Decodes the spectra of the given scans of a Chemstation *.uv file.
+
+    Each spectrum is stored as little-endian differences from the
+    value at the previous wavelength, escaping to an int32 after a
+    -32768. In the older format (base_word), there's an extra word at
+    the start that the first difference is from.
+    """
+    times = hdrs['time'] / 60000.
+    wv_st = hdrs['wv_st'].astype(np.int64)
+    wv_step = np.maximum(hdrs['wv_step'].astype(np.int64), 1)
+    nwvs = np.maximum(-(-(hdrs['wv_en'] - wv_st) // wv_step), 0)
+
+    # every word of every spectrum, one after the other
+    data_st = offs + _CS_SCAN.itemsize
+    nw = np.maximum((offs + hdrs['len'] - data_st) // 2, 0)
+    first = np.zeros(len(nw), dtype=np.int64)
+    np.cumsum(nw[:-1], out=first[1:])
+    pos = np.repeat(data_st - 2 * first, nw) + 2 * np.arange(nw.sum())
+    # scans can start on odd bytes, so read those through a view
+    # of the file that's shifted by one
+    even = raw[:len(raw) // 2 * 2].view('<i2')
+    if np.all(data_st % 2 == 0):
+        words = even[pos // 2]
+    else:
+        odd = raw[1:(len(raw) - 1) // 2 * 2 + 1].view('<i2')
+        is_odd = pos % 2 == 1
+        words = np.empty(len(pos), dtype='<i2')
+        words[~is_odd] = even[pos[~is_odd] // 2]
+        words[is_odd] = odd[pos[is_odd] // 2]
+
+    abs_i4 = lambda w: (w[:, 1] << 16 | w[:, 0]).astype(np.uint32) \
+            .view(np.int32)
+    values, idx = delta_decode(words, -32768, 2, abs_i4, restarts=first, \
+                               return_index=True)
+
+    # figure out which scan and wavelength every value is for
+    scan = np.searchsorted(first, idx, 'right') - 1
+    k = np.arange(len(idx)) - np.searchsorted(idx, first)[scan]
+    if base_word:
+        k -= 1
+    keep = (k >= 0) & (k < nwvs[scan])
+    wvs = wv_st[scan] + k * wv_step[scan]
+    keep &= _in_window(wvs / 20., wvwin)
+
+    cols, col_idx = np.unique(wvs[keep], return_inverse=True)
+    data = np.zeros((len(offs), len(cols)))
+    data[scan[keep], col_idx] = values[keep] / 2000.
+    return AstonFrame(data, times, (cols / 20.).tolist())
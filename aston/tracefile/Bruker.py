@@ -1,8 +1,10 @@
-import struct
+import os.path as op
 import numpy as np
 import scipy.sparse
-from aston.trace.Trace import AstonFrame, AstonSeries
+from aston.resources import cache
+from aston.trace.Trace import AstonFrame, LazyAstonFrame
 from aston.tracefile.TraceFile import TraceFile
+from aston.tracefile.FrameCache import disk_cache
 
 
 class BrukerMSMS(TraceFile):
@@ -10,81 +12,120 @@ class BrukerMSMS(TraceFile):
     mgc = None
     traces = ['#ms']
 
-    #def _getTotalTrace(self):
-    #    pass
+    @cache(maxsize=1)
+    def _scan_index(self):
+        """
+        Memory-maps the file as 32-bit words and finds the times of
+        every scan and the word offset that each one starts at.
+        """
+        # everything in the file is 4 or 8 bytes long, so it can all
+        # be addressed as 32-bit words
+        words = np.memmap(self.filename, dtype='<i4', mode='r', \
+                          shape=(op.getsize(self.filename) // 4,))
+        nscans = int(words[1])
+        times = words[2:2 + 2 * nscans].view('<f8') / 60.
+
+        # each scan is its number of points, its m/z's, its number of
+        # points again and then its abundances
+        offs = np.empty(nscans + 1, dtype=int)
+        pos = 3 + 2 * nscans
+        for scn in range(nscans):
+            offs[scn] = pos
+            pos += 2 + 2 * int(words[pos])
+        offs[-1] = pos
+        return words, times, offs
 
     @property
+    @cache(maxsize=1)
+    @disk_cache
     def data(self):
-        # convenience function for reading in data
-        rd = lambda f, st: struct.unpack(st, f.read(struct.calcsize(st)))
-
-        # open the file
-        f = open(self.filename, 'rb')
-
-        nscans = rd(f, 'ii')[1]
-        if nscans == 0:
-            self.data = AstonSeries(np.array([]), np.array([]), [])
-            return
-        times = np.array(rd(f, nscans * 'd')) / 60.0
-        f.seek(f.tell() + 4)  # number of scans again
-
-        # set up the array of column indices
-        indptr = np.empty(nscans + 1, dtype=int)
-        indptr[0] = 0
-
-        # figure out the total number of points
-        dpos = f.tell()
-        tot_pts = 0
-        for scn in range(nscans):
-            npts = rd(f, 'i')[0]
-            #rd(f, npts * 'f' + 'i' + n_pts * 'f')
-            f.seek(f.tell() + 8 * npts + 4)
-            tot_pts += npts
-            indptr[scn + 1] = tot_pts
-        f.seek(dpos)
-
-        ions = []
-        i_lkup = {}
-        idxs = np.empty(tot_pts, dtype=int)
-        vals = np.empty(tot_pts, dtype=float)
-
-        for scn in range(nscans):
-            npts = rd(f, 'i')[0]
-            rd_ions = rd(f, npts * 'f')
-            f.seek(f.tell() + 4)  # number of points again
-            abun = rd(f, npts * 'f')
-
-            nions = set([int(i) for i in rd_ions \
-              if int(i) not in i_lkup])
-            i_lkup.update(dict((ion, i + len(ions) - 1) \
-              for i, ion in enumerate(nions)))
-            ions += nions
-
-            idxs[indptr[scn]:indptr[scn + 1]] = \
-                [i_lkup[int(i)] for i in rd_ions]
-            vals[indptr[scn]:indptr[scn + 1]] = \
-                abun
-
-        idxs += 1
-        data = scipy.sparse.csr_matrix((vals, idxs, indptr), \
-                                    shape=(nscans, len(ions)), \
-                                    dtype=float)
-        return AstonFrame(data, times, ions)
-
-        #self.data = np.zeros((recs, 2))
-        #times = rd(f, nscans * 'd')
-        #self.data[:, 0] = np.array(times) / 60
-        #ions = set()
-        #rd(f, 'i')  # number of data points again
-        #for i in range(nscans):
-        #    n_pts = rd(f, 'i')[0]
-        #    ions.update(rd(f, n_pts * 'f'))
-        #    rd(f, 'i')  # number of pts in spectra again
-        #    abun = rd(f, n_pts * 'f')
-        #    #self.data[i, 0] = times[i] / 60
-        #    self.data[i, 1] = sum(abun)
-        #f.close()
-        #self.ions = [1]
+        if self.lazy:
+            words, times, offs = self._scan_index()
+            decode = lambda st, en: _bruker_frame(words, times[st:en], \
+                                                  offs[st:en + 1], 1.)
+            return LazyAstonFrame(times, decode, \
+                                  lambda: _bruker_ions(words, offs, 1.))
+        return self.read_window()
+
+    def read_window(self, twin=None, mz_round=1.):
+        """
+        Reads only the scans in twin into a sparse AstonFrame.
+
+        Parameters
+        ----------
+        twin : tuple of float, optional
+            Start and end time (in minutes) of the scans to read.
+        mz_round : float, optional
+            m/z's are rounded to the nearest multiple of this to find
+            their column; if None every distinct m/z gets a column.
+        """
+        words, times, offs = self._scan_index()
+        st = 0 if twin is None or twin[0] is None else \
+                int(np.searchsorted(times, twin[0], 'left'))
+        en = len(times) if twin is None or twin[1] is None else \
+                int(np.searchsorted(times, twin[1], 'right'))
+        return _bruker_frame(words, times[st:en], offs[st:en + 1], mz_round)
+
+
+def _bruker_frame(words, times, offs, mz_round=None):
+    """
+    Decodes the scans starting at word offsets offs[:-1] into a
+    sparse AstonFrame.
+    """
+    indptr, mzs, abns = _bruker_points(words, offs)
+    if mz_round and len(mzs) > 0:
+        keys = np.round(mzs / mz_round).astype(int)
+        k0 = keys.min()
+        keys -= k0
+        if keys.max() < 4 * len(keys):
+            # the rounded m/z's are integers close together, so a lookup
+            # table maps them to columns faster than sorting them would
+            ions = np.flatnonzero(np.bincount(keys))
+            lkup = np.zeros(ions[-1] + 1, dtype=int)
+            lkup[ions] = np.arange(len(ions))
+            cols = lkup[keys]
+        else:
+            ions, cols = np.unique(keys, return_inverse=True)
+        ions = mz_round * (ions + k0)
+    else:
+        ions, cols = np.unique(mzs, return_inverse=True)
+    data = scipy.sparse.csr_matrix((abns, cols.ravel(), indptr), \
+                                   shape=(len(indptr) - 1, len(ions)), \
+                                   dtype=float)
+    # rounding can put more than one point of a scan in the same column
+    data.sum_duplicates()
+    return AstonFrame(data, times, ions.tolist())
+
+
+def _bruker_points(words, offs):
+    """
+    The row pointers, m/z's and abundances of the points of the scans
+    starting at word offsets offs[:-1].
+    """
+    npts = (offs[1:] - offs[:-1] - 2) // 2
+    indptr = np.zeros(len(npts) + 1, dtype=int)
+    np.cumsum(npts, out=indptr[1:])
+
+    # the word offset of the m/z of every point; its abundance is
+    # after the rest of the m/z's and the second number of points
+    mz_pos = np.repeat(offs[:-1] + 1 - indptr[:-1], npts) + \
+            np.arange(indptr[-1])
+    flts = words.view('<f4')
+    mzs = flts[mz_pos].astype(float)
+    abns = flts[mz_pos + np.repeat(npts + 1, npts)]
+    return indptr, mzs, abns
+
+
+def _bruker_ions(words, offs, mz_round, chunk=1000):
+    """
+    The columns _bruker_frame gives the scans starting at word offsets
+    offs[:-1], found a chunk of scans at a time.
+    """
+    keys = np.array([], dtype=int)
+    for st in range(0, len(offs) - 1, chunk):
+        mzs = _bruker_points(words, offs[st:st + chunk + 1])[1]
+        keys = np.union1d(keys, np.round(mzs / mz_round).astype(int))
+    return mz_round * keys
 
 
 class BrukerBAF(TraceFile):
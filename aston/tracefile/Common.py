@@ -1,13 +1,14 @@
 import os
 import os.path as op
 import binascii
+import bisect
+import hashlib
 import re
 import struct
 from itertools import product
-from glob import glob
-import inspect
 from importlib import import_module
-from aston.resources import cache
+import numpy as np
+from aston.resources import cache, file_stamp
 
 #File types from http://en.wikipedia.org/wiki/Mass_spectrometry_data_format
 #and http://www.amdis.net/What_is_AMDIS/AMDIS_Detailed/amdis_detailed.html
@@ -25,26 +26,64 @@ from aston.resources import cache
 #TODO: .YEP | Bruker instrument data format
 
 
+# Every class for reading data files: the module it's in (under
+# aston.tracefile), its name, and the magic bytes (the first two bytes
+# of the file, in hex), extension and file name its files have. These
+# have to match the mgc, ext and fnm attributes of each class; they're
+# repeated here so files can be identified without importing every
+# reader (and everything they import).
+TRACEFILES = [
+    ('AgilentExtraCS', 'AgilentCSFlowInject', '0233', None, 'ACQRES.REG'),
+    ('AgilentExtraCS', 'AgilentCSFraction', '0233', None, 'LAFC1FD.REG'),
+    ('AgilentExtraCS', 'AgilentCSLC', '0233', None, 'LCDIAG.REG'),
+    ('AgilentExtraCS', 'AgilentCSPump', '0233', None, 'LPMP1.REG'),
+    ('AgilentExtraMH', 'AgilentMHAcqMethod', None, None, 'ACQ_METHOD.XML'),
+    ('AgilentExtraMH', 'AgilentMHPump', None, None, 'CAPPUMP1.CD'),
+    ('AgilentExtraMH', 'AgilentMHSampleInfo', None, None, 'SAMPLE_INFO.XML'),
+    ('AgilentExtraMH', 'AgilentMHTemp', None, None, 'TCC1.CD'),
+    ('AgilentFID', 'AgilentFID', '0238', 'CH', None),
+    ('AgilentFID', 'AgilentFID2', '0331', 'CH', None),
+    ('AgilentMS', 'AgilentMS', '0132', 'MS', None),
+    ('AgilentMS', 'AgilentMSMSScan', '0101', 'BIN', None),
+    ('AgilentUV', 'AgilentCSDAD', '0233', 'UV', None),
+    ('AgilentUV', 'AgilentCSDAD2', '0331', 'UV', None),
+    ('AgilentUV', 'AgilentDAD', None, 'SD', None),
+    ('AgilentUV', 'AgilentMWD', '0233', 'CH', None),
+    ('AgilentUV', 'AgilentMWD2', '0331', 'CH', None),
+    ('Bruker', 'BrukerBAF', '2400', 'BAF', None),
+    ('Bruker', 'BrukerMSMS', None, 'AMI', None),
+    ('Inficon', 'InficonHapsite', '0403', 'HPS', None),
+    ('MZML', 'mzML', None, 'MZML', None),
+    ('NetCDF', 'NetCDF', '4344', 'CDF', None),
+    ('NucSequencing', 'AB1File', '4142', ('AB1', 'ABI'), None),
+    ('NucSequencing', 'StandardChromatogramFormat', '2E73', 'SCF', None),
+    ('OtherFiles', 'CSVFile', None, 'CSV', None),
+    ('Thermo', 'ThermoCF', 'FFFF', 'CF', None),
+    ('Thermo', 'ThermoDXF', 'FFFF', 'DXF', None),
+    ('Thermo', 'ThermoRAW', '01A1', 'RAW', None),
+    ('Waters', 'WatersAutospec', None, 'IDX', None),
+]
+
+
+@cache(maxsize=64)
+def tfclass(name):
+    """
+    The class for reading data files with the given name (importing
+    the module it's in the first time it's needed).
+    """
+    for modname, clsname, _, _, _ in TRACEFILES:
+        if clsname == name:
+            module = import_module('aston.tracefile.' + modname)
+            return getattr(module, clsname)
+    return None
+
+
 @cache(maxsize=1)
 def tfclasses():
     """
     A list of every class for reading data files.
     """
-    # automatically find any subclasses of TraceFile in the same
-    # directory as me
-    classes = []
-    mydir = op.dirname(op.abspath(inspect.getfile(file_type)))
-    tfcls = ("<class 'aston.tracefile.TraceFile.TraceFile'>",
-             "<class 'aston.tracefile.TraceFile.ScanListFile'>")
-    for filename in glob(op.join(mydir, '*.py')):
-        name = op.splitext(op.basename(filename))[0]
-        module = import_module('aston.tracefile.' + name)
-        for clsname in dir(module):
-            cls = getattr(module, clsname)
-            if hasattr(cls, '__base__'):
-                if str(cls.__base__) in tfcls:
-                    classes.append(cls)
-    return classes
+    return [tfclass(clsname) for _, clsname, _, _, _ in TRACEFILES]
 
 
 @cache(maxsize=1)
@@ -64,18 +103,18 @@ def tfclasses_lookup():
 
     # create the lookup table
     lookup = {}
-    for cls in tfclasses():
-        for mgc, ext, fnm in product(mi(cls.mgc), mi(cls.ext), mi(cls.fnm)):
+    for _, clsname, mgcs, exts, fnms in TRACEFILES:
+        for mgc, ext, fnm in product(mi(mgcs), mi(exts), mi(fnms)):
             if mgc is None:
                 if fnm is not None:
-                    lookup[fnm] = cls.__name__
+                    lookup[fnm] = clsname
                 else:
-                    lookup[ext] = cls.__name__
+                    lookup[ext] = clsname
             else:
                 if fnm is not None:
-                    lookup[fnm + '|' + mgc] = cls.__name__
+                    lookup[fnm + '|' + mgc] = clsname
                 else:
-                    lookup[ext + '|' + mgc] = cls.__name__
+                    lookup[ext + '|' + mgc] = clsname
     return lookup
 
 
@@ -105,6 +144,158 @@ def file_type(filename):
     return ftype
 
 
+def file_md5(filename, sample=None, chunk_size=2 ** 20):
+    """
+    The MD5 hash of a file, read a chunk at a time.
+
+    Parameters
+    ----------
+    sample : int, optional
+        If given, only this many bytes from the start and from the end
+        of the file (and its size) are hashed, which is much faster
+        for big files and still tells apart nearly any two data files.
+    chunk_size : int, optional
+
+    Returns
+    -------
+    str
+        The hex digest.
+    """
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if sample is not None and size > 2 * sample:
+            md5.update(str(size).encode('ascii'))
+            md5.update(f.read(sample))
+            f.seek(-sample, os.SEEK_END)
+            md5.update(f.read(sample))
+        else:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _restart_cumsum(d, starts, bases):
+    """
+    Cumulative sum of d that restarts at each of starts (sorted
+    positions in d) with the value from bases.
+    """
+    cs = np.cumsum(d)
+    if len(starts) == 0:
+        return cs
+    seg = np.cumsum(np.bincount(starts, minlength=len(d))) - 1
+    offset = np.where(seg >= 0, (bases - cs[starts])[seg.clip(0)], 0)
+    return cs + offset
+
+
+def delta_decode(raw, marker, nwords, absolute, records=None, order=1, \
+                 restarts=None, return_index=False):
+    """
+    Decodes a signal stored as differences in int16s, like the ones
+    in Agilent *.ch and *.uv files.
+
+    Each word is the change from the previous value (or, for order=2,
+    the change in that change) except for escapes: a marker followed
+    by nwords words holding an absolute value, which the differences
+    start again from.
+
+    Parameters
+    ----------
+    raw : bytes or np.ndarray
+        Big-endian data, or an array of the words themselves.
+    marker : int
+        The word that starts an escape.
+    nwords : int
+        Number of words after each marker.
+    absolute : function
+        Turns an (n, nwords) array of the uint16s after each marker
+        into the absolute values.
+    records : function, optional
+        If given, the words are grouped into records, each starting
+        with a word whose low byte is the number of values in it;
+        records(word) is True for the header that ends the data.
+    order : {1, 2}, optional
+    restarts : np.ndarray, optional
+        Sorted positions of words that are differences from zero
+        (e.g. the start of each of many signals in raw).
+    return_index : bool, optional
+        Also return the position of the word each value came from.
+
+    Returns
+    -------
+    np.ndarray
+        The decoded values (int64).
+    """
+    if isinstance(raw, np.ndarray):
+        words = raw
+    else:
+        words = np.frombuffer(raw, dtype='>i2', count=len(raw) // 2)
+    n = len(words)
+    cands = np.flatnonzero(words == marker).tolist()
+    keep = np.ones(n, dtype=bool)
+    real = []
+
+    if records is None:
+        # only candidates inside another marker's payload aren't real
+        if len(cands) > 0 and np.all(np.diff(cands) > nwords):
+            real = cands
+        else:
+            for c in cands:
+                if len(real) == 0 or c > real[-1] + nwords:
+                    real.append(c)
+        end = n
+    else:
+        end, k = 0, 0
+        while end < n and not records(int(words[end]) & 0xFFFF):
+            keep[end] = False
+            st = end + 1
+            end = st + (int(words[end]) & 0xFF)
+            k = bisect.bisect_left(cands, st, k)
+            while k < len(cands) and cands[k] < end:
+                real.append(cands[k])
+                end += nwords
+                k = bisect.bisect_left(cands, cands[k] + nwords + 1, k)
+            end = min(end, n)
+
+    # a marker cut off by the end of the data ends it
+    while len(real) > 0 and real[-1] + nwords >= min(end, n):
+        end = real.pop()
+    keep[end:] = False
+
+    real = np.array(real, dtype=int)
+    pay = (real[:, None] + np.arange(1, nwords + 1)).ravel()
+    keep[pay] = False
+    esc_vals = absolute(words[pay].astype(np.int64).reshape(-1, nwords) \
+                        & 0xFFFF)
+
+    samples = np.flatnonzero(keep)
+    d = words[samples].astype(np.int64)
+    esc = np.searchsorted(samples, real)
+    d[esc] = 0
+    if restarts is not None and len(samples) > 0:
+        rst = np.searchsorted(samples, restarts).clip(0, len(samples) - 1)
+        rst = np.setdiff1d(rst[samples[rst] == restarts], esc)
+    else:
+        rst = np.array([], dtype=int)
+    starts = np.concatenate([esc, rst])
+    order_idx = np.argsort(starts, kind='mergesort')
+    starts, is_esc = starts[order_idx], (order_idx < len(esc))
+
+    def bases(d, esc_bases):
+        b = np.empty(len(starts), dtype=np.int64)
+        b[is_esc] = esc_bases
+        b[~is_esc] = d[starts[~is_esc]]
+        return b
+
+    if order == 2:
+        d = _restart_cumsum(d, starts, bases(d, 0))
+        d[esc] = 0
+    values = _restart_cumsum(d, starts, bases(d, esc_vals))
+    if return_index:
+        return values, samples
+    return values
+
+
 def find_offset(f, search_str, hint=None):
     if hint is None:
         hint = 0
@@ -122,6 +313,35 @@ def find_offset(f, search_str, hint=None):
     return foff
 
 
+def load_index(filename):
+    """
+    Returns the arrays stored by save_index for filename (as a dict)
+    or None if there aren't any or the file has changed since.
+    """
+    try:
+        stamp = file_stamp(filename)
+        with open(filename + '.astonidx', 'rb') as f:
+            idx = dict(np.load(f))
+    except Exception:  # missing or corrupt
+        return None
+    if idx.pop('_stamp', np.array([])).tolist() != stamp:
+        return None
+    return idx
+
+
+def save_index(filename, **arrays):
+    """
+    Persists arrays (e.g. offsets of every scan in filename) in a
+    file next to filename, so they don't have to be found again.
+    """
+    arrays['_stamp'] = np.array(file_stamp(filename))
+    try:
+        with open(filename + '.astonidx', 'wb') as f:
+            np.savez(f, **arrays)
+    except (IOError, OSError):
+        pass  # e.g. a read-only share; we'll just rebuild it next time
+
+
 def parse_c_serialized(f):
     """
     Reads in a binary file created by a C++ serializer (prob. MFC?)
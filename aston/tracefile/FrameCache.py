@@ -0,0 +1,238 @@
+"""
+An on-disk cache of decoded AstonFrames.
+
+Each frame is stored as a directory of uncompressed *.npy files (the
+index, the columns and either the dense values or the CSR arrays) so
+that it can be memory-mapped straight back in. Entries are keyed on
+the path, size and modification time of the file they were read from,
+so changing a file invalidates its entry.
+
+The cache is only used if CACHE_DIRECTORY is set in aston.ini.
+"""
+import os
+import os.path as op
+import functools
+import hashlib
+import json
+import shutil
+import numpy as np
+import scipy.sparse
+from aston.resources import get_pref, file_stamp
+from aston.trace.Trace import AstonFrame, LazyAstonFrame
+
+
+def cache_dir():
+    """
+    The directory the cache is stored in (or None if it's disabled).
+    """
+    path = get_pref('Default.CACHE_DIRECTORY')
+    if path is None or path.strip() == '':
+        return None
+    return op.abspath(op.expanduser(path.strip()))
+
+
+def cache_size():
+    """
+    The maximum size of the cache, in bytes.
+    """
+    try:
+        return int(float(get_pref('Default.CACHE_SIZE')) * 1024 ** 2)
+    except (TypeError, ValueError):
+        return 2048 * 1024 ** 2
+
+
+def _entry_names(filename):
+    """
+    Returns the prefix shared by every cache entry for this filename
+    and the name of the entry for the file as it is right now.
+    """
+    filename = op.abspath(filename)
+    prefix = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+    stamp = '{}:{}'.format(*file_stamp(filename))
+    suffix = hashlib.sha1(stamp.encode('utf-8')).hexdigest()[:16]
+    return prefix, prefix + '-' + suffix
+
+
+def invalidate(filename, path=None):
+    """
+    Removes every cached frame for filename.
+    """
+    if path is None:
+        path = cache_dir()
+    if path is None or not op.isdir(path):
+        return
+    prefix = hashlib.sha1(op.abspath(filename).encode('utf-8')).hexdigest()
+    for entry in os.listdir(path):
+        if entry.startswith(prefix + '-'):
+            shutil.rmtree(op.join(path, entry), ignore_errors=True)
+
+
+def rekey(old_filename, filename, path=None):
+    """
+    Keeps the cached frame for old_filename as the cached frame for
+    filename as it is now, for files that were moved or touched but
+    whose contents haven't changed.
+    """
+    if path is None:
+        path = cache_dir()
+    if path is None or not op.isdir(path):
+        return
+    try:
+        _, name = _entry_names(filename)
+    except OSError:
+        return
+    old_prefix = hashlib.sha1(op.abspath(old_filename).encode('utf-8')) \
+            .hexdigest()
+    entries = [e for e in os.listdir(path) \
+               if e.startswith(old_prefix + '-')]
+    if len(entries) == 0 or entries[0] == name:
+        return
+    if op.abspath(old_filename) != op.abspath(filename):
+        invalidate(filename, path)
+    try:
+        os.rename(op.join(path, entries[0]), op.join(path, name))
+        with open(op.join(path, name, 'meta.json')) as f:
+            meta = json.load(f)
+        meta['filename'] = op.abspath(filename)
+        with open(op.join(path, name, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+    except (IOError, OSError, ValueError):
+        shutil.rmtree(op.join(path, name), ignore_errors=True)
+
+
+def load_frame(filename, path=None):
+    """
+    Returns the cached AstonFrame for filename (with all of its arrays
+    memory-mapped) or None if it isn't in the cache or is out of date.
+    """
+    if path is None:
+        path = cache_dir()
+    if path is None or not op.isdir(path):
+        return None
+
+    try:
+        prefix, name = _entry_names(filename)
+    except OSError:
+        return None
+    entry = op.join(path, name)
+    if not op.isdir(entry):
+        # throw out entries for old versions of this file
+        invalidate(filename, path)
+        return None
+
+    try:
+        with open(op.join(entry, 'meta.json')) as f:
+            meta = json.load(f)
+        ld = lambda n: np.load(op.join(entry, n + '.npy'), mmap_mode='r')
+        index, columns = ld('index'), ld('columns')
+        if meta['format'] == 'csr':
+            values = scipy.sparse.csr_matrix((ld('data'), ld('indices'), \
+                                              ld('indptr')), \
+                                             shape=tuple(meta['shape']))
+        else:
+            values = ld('values')
+    except (IOError, OSError, ValueError, KeyError):
+        shutil.rmtree(entry, ignore_errors=True)
+        return None
+
+    # mark this entry as recently used for eviction
+    os.utime(op.join(entry, 'meta.json'), None)
+    return AstonFrame(values, index, columns)
+
+
+def save_frame(filename, frame, path=None, max_size=None):
+    """
+    Stores frame in the cache as the decoded contents of filename.
+    """
+    if path is None:
+        path = cache_dir()
+    if path is None:
+        return
+    if not op.isdir(path):
+        os.makedirs(path)
+
+    prefix, name = _entry_names(filename)
+    invalidate(filename, path)
+
+    # write everything into a temporary directory first, so a
+    # partially written entry is never picked up by load_frame
+    tmp = op.join(path, '.' + name + '-' + str(os.getpid()))
+    os.makedirs(tmp)
+    sv = lambda n, a: np.save(op.join(tmp, n + '.npy'), np.asarray(a))
+    sv('index', frame.index)
+    columns = np.asarray(frame.columns)
+    if columns.dtype.kind == 'O':
+        columns = columns.astype(str)
+    sv('columns', columns)
+    meta = {'filename': op.abspath(filename), 'shape': list(frame.shape)}
+    if scipy.sparse.issparse(frame.values):
+        values = frame.values.tocsr()
+        sv('data', values.data)
+        sv('indices', values.indices)
+        sv('indptr', values.indptr)
+        meta['format'] = 'csr'
+    else:
+        sv('values', frame.values)
+        meta['format'] = 'dense'
+    with open(op.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    try:
+        os.rename(tmp, op.join(path, name))
+    except OSError:
+        # another process cached this file at the same time
+        shutil.rmtree(tmp, ignore_errors=True)
+    evict(max_size, path)
+
+
+def evict(max_size=None, path=None):
+    """
+    Deletes the least recently used entries until the cache is
+    smaller than max_size bytes.
+    """
+    if path is None:
+        path = cache_dir()
+    if max_size is None:
+        max_size = cache_size()
+    if path is None or not op.isdir(path):
+        return
+
+    entries = []
+    for name in os.listdir(path):
+        entry = op.join(path, name)
+        if name.startswith('.') or not op.isdir(entry):
+            continue
+        try:
+            size = sum(op.getsize(op.join(entry, i)) \
+                       for i in os.listdir(entry))
+            used = op.getmtime(op.join(entry, 'meta.json'))
+        except OSError:
+            continue
+        entries.append((used, size, entry))
+
+    total = sum(e[1] for e in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_size:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def disk_cache(f):
+    """
+    Decorator for the data property of TraceFiles that stores the
+    AstonFrame it returns in the on-disk cache.
+    """
+    @functools.wraps(f)
+    def wrapper(self):
+        if self.filename is None or cache_dir() is None:
+            return f(self)
+        df = load_frame(self.filename)
+        if df is None:
+            df = f(self)
+            # lazy frames would have to be decoded entirely to be stored
+            if isinstance(df, AstonFrame) and \
+               not isinstance(df, LazyAstonFrame) and len(df.index) > 0:
+                save_frame(self.filename, df)
+        return df
+    return wrapper
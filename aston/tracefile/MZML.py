@@ -3,8 +3,10 @@ import zlib
 import base64
 from xml.etree import ElementTree as ET
 import numpy as np
+from aston.resources import cache
 from aston.trace.Trace import AstonSeries
 from aston.tracefile.TraceFile import ScanListFile
+from aston.tracefile.Common import load_index, save_index
 from aston.spectra.Scan import Scan
 
 
@@ -58,70 +60,150 @@ class mzML(ScanListFile):
 
     ns = {'m': 'http://psi.hupo.org/ms/mzml'}
 
+    @cache(maxsize=1)
+    def _scan_index(self):
+        """
+        Byte offsets (and times) of every spectrum and chromatogram
+        in the file. These are taken from the indexedmzML offset list if
+        there is one and saved next to the file, so this only has
+        to be done once.
+        """
+        idx = load_index(self.filename)
+        if idx is not None:
+            return idx
+
+        with open(self.filename, 'rb') as f:
+            offsets = _indexed_offsets(f)
+            if offsets is None:
+                offsets = _scan_offsets(f)
+            times = np.array([_spectrum_time(f, o) for o \
+                              in offsets['spectrum']], dtype=float)
+        idx = {'times': times,
+               'offsets': np.array(offsets['spectrum'], dtype=np.int64),
+               'chromatograms': np.array(offsets['chromatogram'], \
+                                         dtype=np.int64)}
+        save_index(self.filename, **idx)
+        return idx
+
+    @cache(maxsize=1)
+    def _param_groups(self):
+        """
+        The referenceableParamGroupList (if any) from the file header.
+        """
+        nsl = '{' + self.ns['m'] + '}'
+        with open(self.filename, 'rb') as f:
+            for evt, e in ET.iterparse(f, events=('start', 'end')):
+                if evt == 'start' and e.tag == nsl + 'run':
+                    break
+                elif evt == 'end' and \
+                  e.tag == nsl + 'referenceableParamGroupList':
+                    return e
+        return None
+
+    def _element(self, f, offset, tag):
+        """
+        Parses the single element (e.g. a spectrum) starting at offset.
+        """
+        root = b'<mzML xmlns="' + self.ns['m'].encode('ascii') + b'">'
+        xml = root + _read_element(f, offset, tag) + b'</mzML>'
+        return ET.fromstring(xml)[0]
+
     def scans(self, twin=None):
         if twin is None:
             twin = (-np.inf, np.inf)
-        r = ET.parse(self.filename).getroot()
-        pgr = r.find('.//m:referenceableParamGroupList', namespaces=self.ns)
-
-        spectra = r.findall('*//m:spectrum', namespaces=self.ns)
-        for s in spectra:
-            q = './/m:cvParam[@accession="MS:1000016"]'
-            time_elem = s.find(q, namespaces=self.ns)
-            if time_elem is None:
-                continue
-            time = time_elem.get('value')
-
-            #FIXME: won't find these properties if a paramGroupRef exists
-            for i in ['MS:1000514', 'MS:1000617', 'MS:1000786']:
-                q = './/m:cvParam[@accession="' + i + '"]/..'
-                x_elem = s.find(q, namespaces=self.ns)
-                if x_elem is not None:
-                    x = self.read_binary(x_elem, pgr)
-                    break
-            else:
-                #check paramGroupRef
-                q0 = './/m:referenceableParamGroupRef'
-                bin_arrs = s.findall(q0 + '/..', namespaces=self.ns)
-                for ba in bin_arrs:
-                    ref = ba.find(q0, namespaces=self.ns).get('ref')
-                    q = 'm:referenceableParamGroup[@id="' + ref + '"]'
-                    pg = pgr.find(q, namespaces=self.ns)
-                    q = './/m:cvParam[@accession="MS:1000514"]/..'
-                    if pg.find(q, namespaces=self.ns) is not None:
-                        x = self.read_binary(ba, pgr)
-                        break
-                    q = './/m:cvParam[@accession="MS:1000617"]/..'
-                    if pg.find(q, namespaces=self.ns) is not None:
-                        x = self.read_binary(ba, pgr)
-                        break
-                    q = './/m:cvParam[@accession="MS:1000786"]/..'
-                    if pg.find(q, namespaces=self.ns) is not None:
-                        x = self.read_binary(ba, pgr)
+        idx = self._scan_index()
+
+        # spectra without a time are skipped
+        has_t = ~np.isnan(idx['times'])
+        times, offsets = idx['times'][has_t], idx['offsets'][has_t]
+
+        # jump straight to the first spectrum in the time window
+        srtd = np.all(np.diff(times) >= 0)
+        st_idx = np.searchsorted(times, twin[0]) if srtd else 0
+
+        pgr = self._param_groups()
+        with open(self.filename, 'rb') as f:
+            for t, off in zip(times[st_idx:], offsets[st_idx:]):
+                if t < twin[0]:
+                    continue
+                elif t > twin[1]:
+                    if srtd:
                         break
-                else:
                     continue
+                scn = self._read_spectrum(self._element(f, off, b'spectrum'), \
+                                          pgr)
+                if scn is not None:
+                    yield scn
+
+    def _read_scans(self, idxs):
+        offsets = self._scan_index()['offsets']
+        pgr = self._param_groups()
+        scans = []
+        with open(self.filename, 'rb') as f:
+            for off in offsets[idxs]:
+                scn = self._read_spectrum(self._element(f, off, b'spectrum'), \
+                                          pgr)
+                if scn is not None:
+                    scans.append(scn)
+        return scans
+
+    def _read_spectrum(self, s, pgr):
+        q = './/m:cvParam[@accession="MS:1000016"]'
+        time_elem = s.find(q, namespaces=self.ns)
+        if time_elem is None:
+            return None
+        time = time_elem.get('value')
+
+        #FIXME: won't find these properties if a paramGroupRef exists
+        for i in ['MS:1000514', 'MS:1000617', 'MS:1000786']:
+            q = './/m:cvParam[@accession="' + i + '"]/..'
+            x_elem = s.find(q, namespaces=self.ns)
+            if x_elem is not None:
+                x = self.read_binary(x_elem, pgr)
+                break
+        else:
+            #check paramGroupRef
+            q0 = './/m:referenceableParamGroupRef'
+            bin_arrs = s.findall(q0 + '/..', namespaces=self.ns)
+            for ba in bin_arrs:
+                ref = ba.find(q0, namespaces=self.ns).get('ref')
+                q = 'm:referenceableParamGroup[@id="' + ref + '"]'
+                pg = pgr.find(q, namespaces=self.ns)
+                q = './/m:cvParam[@accession="MS:1000514"]/..'
+                if pg.find(q, namespaces=self.ns) is not None:
+                    x = self.read_binary(ba, pgr)
+                    break
+                q = './/m:cvParam[@accession="MS:1000617"]/..'
+                if pg.find(q, namespaces=self.ns) is not None:
+                    x = self.read_binary(ba, pgr)
+                    break
+                q = './/m:cvParam[@accession="MS:1000786"]/..'
+                if pg.find(q, namespaces=self.ns) is not None:
+                    x = self.read_binary(ba, pgr)
+                    break
+            else:
+                return None
 
-            q = './/m:cvParam[@accession="MS:1000515"]/..'
-            y_elem = s.find(q, namespaces=self.ns)
-            if y_elem is not None:
-                y = self.read_binary(y_elem, pgr)
+        q = './/m:cvParam[@accession="MS:1000515"]/..'
+        y_elem = s.find(q, namespaces=self.ns)
+        if y_elem is not None:
+            y = self.read_binary(y_elem, pgr)
+        else:
+            #check paramGroupRef
+            q0 = './/m:referenceableParamGroupRef'
+            bin_arrs = s.findall(q0 + '/..', namespaces=self.ns)
+            for ba in bin_arrs:
+                ref = ba.find(q0, namespaces=self.ns).get('ref')
+                q = 'm:referenceableParamGroup[@id="' + ref + '"]'
+                pg = pgr.find(q, namespaces=self.ns)
+                q = './/m:cvParam[@accession="MS:1000515"]/..'
+                if pg.find(q, namespaces=self.ns) is not None:
+                    y = self.read_binary(ba, pgr)
+                    break
             else:
-                #check paramGroupRef
-                q0 = './/m:referenceableParamGroupRef'
-                bin_arrs = s.findall(q0 + '/..', namespaces=self.ns)
-                for ba in bin_arrs:
-                    ref = ba.find(q0, namespaces=self.ns).get('ref')
-                    q = 'm:referenceableParamGroup[@id="' + ref + '"]'
-                    pg = pgr.find(q, namespaces=self.ns)
-                    q = './/m:cvParam[@accession="MS:1000515"]/..'
-                    if pg.find(q, namespaces=self.ns) is not None:
-                        y = self.read_binary(ba, pgr)
-                        break
-                else:
-                    continue
+                return None
 
-            yield Scan(x, y, name=time)
+        return Scan(x, y, name=time)
 
     def read_binary(self, ba, param_groups=None):
         """
@@ -162,31 +244,124 @@ class mzML(ScanListFile):
             rawdata = zlib.decompress(base64.b64decode(datatext))
         else:
             rawdata = base64.b64decode(datatext)
-        return np.fromstring(rawdata, dtype=dtype)
+        return np.frombuffer(rawdata, dtype=dtype)
 
     def total_trace(self, twin=None):
-        r = ET.parse(self.filename).getroot()
+        if twin is None:
+            twin = (-np.inf, np.inf)
 
         # get it from the chromatogram list
-        c = r.find('.//m:cvParam[@accession="MS:1000235"]/..', \
-                   namespaces=self.ns)
-        if c is not None:
-            q = './/m:cvParam[@accession="MS:1000595"]/..'
-            index = self.read_binary(c.find(q, namespaces=self.ns))
-            q = './/m:cvParam[@accession="MS:1000515"]/..'
-            values = self.read_binary(c.find(q, namespaces=self.ns))
-            return AstonSeries(values, index, name='tic')
-
-        ## otherwise try to extract it from the individual records
-        #spectra = r.findall('*//m:spectrum/', namespaces=self.ns)
-        #for s in spectra:
-        #    # TIC
-        #    s.find('m:cvParam[@accession="MS:1000285"]', namespaces=self.ns)
-        #    # time
-        #    s.find('.//m:cvParam[@accession="MS:1000016"]', \
-        #           namespaces=self.ns)
-
-        #TODO: call parent function if no TIC found
+        with open(self.filename, 'rb') as f:
+            for off in self._scan_index()['chromatograms']:
+                c = self._element(f, off, b'chromatogram')
+                q = 'm:cvParam[@accession="MS:1000235"]'
+                if c.find(q, namespaces=self.ns) is None:
+                    continue
+                q = './/m:cvParam[@accession="MS:1000595"]/..'
+                index = self.read_binary(c.find(q, namespaces=self.ns))
+                q = './/m:cvParam[@accession="MS:1000515"]/..'
+                values = self.read_binary(c.find(q, namespaces=self.ns))
+                win = (index >= twin[0]) & (index <= twin[1])
+                return AstonSeries(values[win], index[win], name='tic')
+
+        # otherwise calculate it from the individual spectra
+        return super(mzML, self).total_trace(twin)
+
+
+def _read_element(f, offset, tag):
+    """
+    Returns the raw bytes from offset to the closing tag.
+    """
+    end = b'</' + tag + b'>'
+    f.seek(offset)
+    buf, bsize = b'', 65536
+    while True:
+        d = f.read(bsize)
+        st = max(0, len(buf) - len(end))
+        buf += d
+        loc = buf.find(end, st)
+        if loc >= 0:
+            return buf[:loc + len(end)]
+        elif d == b'':
+            return buf
+        bsize *= 2
+
+
+def _indexed_offsets(f):
+    """
+    Reads the spectrum and chromatogram offsets out of the index at
+    the end of an indexedmzML file (or returns None if it's not one).
+    """
+    f.seek(0, 2)
+    f.seek(max(0, f.tell() - 4096))
+    srch = re.search(br'<indexListOffset>\s*(\d+)\s*</indexListOffset>', \
+                     f.read())
+    if srch is None:
+        return None
+    f.seek(int(srch.group(1)))
+    idx_list = f.read()
+
+    offsets = {}
+    for name in ('spectrum', 'chromatogram'):
+        srch = re.search(br'<index\s+name="' + name.encode('ascii') + \
+                         b'">(.*?)</index>', idx_list, re.DOTALL)
+        if srch is None:
+            offsets[name] = []
+        else:
+            offsets[name] = [int(i) for i in re.findall( \
+                br'<offset[^>]*>\s*(\d+)\s*</offset>', srch.group(1))]
+
+    # make sure the offsets are actually right before using them
+    for name, offs in offsets.items():
+        if len(offs) > 0:
+            f.seek(offs[0])
+            if not f.read(len(name) + 1) == b'<' + name.encode('ascii'):
+                return None
+    return offsets
+
+
+def _scan_offsets(f, bsize=2 ** 24):
+    """
+    Finds every spectrum and chromatogram in a file without an index by
+    searching through the raw bytes a block at a time.
+    """
+    regexp = re.compile(br'<(spectrum|chromatogram)[\s>]')
+    offsets = {'spectrum': [], 'chromatogram': []}
+    f.seek(0)
+    pos, prev = 0, b''
+    while True:
+        d = f.read(bsize)
+        if d == b'':
+            break
+        buf = prev + d
+        for m in regexp.finditer(buf):
+            # matches entirely in the overlap were found last time
+            if m.end() > len(prev):
+                offsets[m.group(1).decode('ascii')].append( \
+                    pos - len(prev) + m.start())
+        pos += len(d)
+        prev = buf[-13:]
+    return offsets
+
+
+def _spectrum_time(f, offset):
+    """
+    Pulls just the scan start time out of the spectrum at offset.
+    """
+    time_re = b'<cvParam[^>]*accession="MS:1000016"[^>]*>'
+    f.seek(offset)
+    d = f.read(8192)
+    srch = re.search(time_re, d)
+    if srch is None and b'<binaryDataArrayList' not in d:
+        d = _read_element(f, offset, b'spectrum')
+        srch = re.search(time_re, d)
+    if srch is None:
+        return np.nan
+    val = re.search(b'value="([^"]*)"', srch.group(0))
+    try:
+        return float(val.group(1))
+    except (AttributeError, ValueError):
+        return np.nan
 
 
 def write_mzxml(filename, df, info=None, precision='f'):
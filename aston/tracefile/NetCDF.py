@@ -1,8 +1,13 @@
 import numpy as np
 import scipy.sparse
-from scipy.io.netcdf import NetCDFFile
-from aston.trace.Trace import AstonFrame, AstonSeries
+try:
+    from scipy.io.netcdf import NetCDFFile
+except ImportError:  # renamed in newer versions of scipy
+    from scipy.io import netcdf_file as NetCDFFile
+from aston.resources import cache
+from aston.trace.Trace import AstonFrame, AstonSeries, LazyAstonFrame
 from aston.tracefile.TraceFile import TraceFile
+from aston.tracefile.FrameCache import disk_cache
 
 
 class NetCDF(TraceFile):
@@ -10,36 +15,117 @@ class NetCDF(TraceFile):
     mgc = '4344'
     traces = ['#ms']
 
+    @cache(maxsize=1)
+    def _scan_index(self):
+        """
+        Finds the time of every scan and which points in mass_values/
+        intensity_values belong to it. Only these (copied) arrays are
+        kept; the file is closed again.
+        """
+        with NetCDFFile(self.filename, 'r', mmap=True) as f:
+            tme = f.variables['scan_acquisition_time'].data / 60.
+            npts = f.variables['point_count'].data.astype(int)
+            if 'scan_index' in f.variables:
+                starts = f.variables['scan_index'].data.astype(int)
+            else:
+                starts = np.zeros(len(npts), dtype=int)
+                np.cumsum(npts[:-1], out=starts[1:])
+        return tme, starts, npts
+
     def total_trace(self, twin=None):
-        f = NetCDFFile(open(self.filename, 'rb'))
-        tme = f.variables['scan_acquisition_time'].data / 60.
-        tic = f.variables['total_intensity'].data
-        return AstonSeries(tic, tme, name='TIC')
+        tme = self._scan_index()[0]
+        with NetCDFFile(self.filename, 'r', mmap=True) as f:
+            tic = f.variables['total_intensity'].data.astype(float)
+        return AstonSeries(tic, tme, name='TIC').twin(twin)
 
     @property
+    @disk_cache
     def data(self):
-        f = NetCDFFile(open(self.filename, 'rb'))
-        t = f.variables['scan_acquisition_time'].data / 60.
-
-        ## this is half the speed of the following code
-        #ions = list(set(f.variables['mass_values'].data))
-        #cols = np.array([ions.index(i) for i in \
-        #                 f.variables['mass_values'].data])
-
-        #TODO: slow; there has to be a way to vectorize this more?
-        ions = np.array(list(set(f.variables['mass_values'].data)))
-        rcols = f.variables['mass_values'].data
-        cols = np.empty(rcols.shape, dtype=int)
-        for i, ion in enumerate(ions):
-            cols[rcols == ion] = i
-
-        vals = f.variables['intensity_values'].data
-        rowst = np.add.accumulate(f.variables['point_count'].data)
-        rowst = np.insert(rowst, 0, 0)
-
-        data = scipy.sparse.csr_matrix((vals, cols, rowst), \
-          shape=(len(t), len(ions)), dtype=float)
-        return AstonFrame(data.todense(), t, ions)
+        if self.lazy:
+            idx = self._scan_index()
+            decode = lambda st, en: _cdf_frame(self.filename, idx, st, en)
+            return LazyAstonFrame(idx[0], decode, \
+                                  lambda: _cdf_ions(self.filename, idx))
+        return self.read_window()
+
+    def read_window(self, twin=None, mz_tol=None):
+        """
+        Reads only the scans in twin into a sparse AstonFrame.
+
+        Parameters
+        ----------
+        twin : tuple of float, optional
+            Start and end time (in minutes) of the scans to read.
+        mz_tol : float, optional
+            If given, m/z's that are within mz_tol of each other share
+            a column (labelled with their mean) instead of every distinct
+            m/z getting its own column.
+        """
+        idx = self._scan_index()
+        tme = idx[0]
+        st = 0 if twin is None or twin[0] is None else \
+                np.searchsorted(tme, twin[0], 'left')
+        en = len(tme) if twin is None or twin[1] is None else \
+                np.searchsorted(tme, twin[1], 'right')
+        return _cdf_frame(self.filename, idx, int(st), int(en), mz_tol)
+
+
+def _cdf_frame(filename, idx, st, en, mz_tol=None):
+    """
+    Builds a CSR AstonFrame out of the scans st to en (exclusive).
+    """
+    tme, starts, npts = idx
+    indptr, pts = _cdf_points(starts[st:en], npts[st:en])
+    with NetCDFFile(filename, 'r', mmap=True) as f:
+        mzs = f.variables['mass_values'].data[pts]
+        vals = f.variables['intensity_values'].data[pts]
+    ions, cols = _map_ions(mzs, mz_tol)
+    data = scipy.sparse.csr_matrix((vals, cols, indptr), \
+      shape=(len(indptr) - 1, len(ions)), dtype=float)
+    # binning can put more than one point of a scan in the same column
+    data.sum_duplicates()
+    return AstonFrame(data, tme[st:en], ions.tolist())
+
+
+def _cdf_points(starts, npts):
+    """
+    The row pointers of the scans with points starting at starts and
+    where every one of their points is in the point arrays.
+    """
+    indptr = np.zeros(len(npts) + 1, dtype=int)
+    np.cumsum(npts, out=indptr[1:])
+    pts = np.repeat(starts - indptr[:-1], npts) + np.arange(indptr[-1])
+    return indptr, pts
+
+
+def _cdf_ions(filename, idx, chunk=1000):
+    """
+    The distinct m/z's in every scan (the columns _cdf_frame gives
+    them without mz_tol), found a chunk of scans at a time.
+    """
+    tme, starts, npts = idx
+    ions = np.array([])
+    with NetCDFFile(filename, 'r', mmap=True) as f:
+        for st in range(0, len(npts), chunk):
+            pts = _cdf_points(starts[st:st + chunk], npts[st:st + chunk])[1]
+            ions = np.union1d(ions, f.variables['mass_values'].data[pts])
+    return ions.astype(float)
+
+
+def _map_ions(mzs, mz_tol=None):
+    """
+    Finds the (sorted) columns and the column of every m/z in mzs.
+    """
+    ions, cols = np.unique(mzs, return_inverse=True)
+    ions = ions.astype(float)
+    if mz_tol:
+        # a new column starts wherever neighbouring m/z's are further
+        # apart than mz_tol (so close m/z's can chain together)
+        grps = np.zeros(len(ions), dtype=int)
+        np.cumsum(np.diff(ions) > mz_tol, out=grps[1:])
+        ions = np.bincount(grps, weights=ions) / np.bincount(grps)
+        cols = grps[cols]
+    return ions, cols.ravel()
 
 
 def write_netcdf(filename, df, info=None):
@@ -75,17 +161,20 @@ def write_netcdf(filename, df, info=None):
 
     f.createDimension('scan_number', len(df.index))
     v = f.createVariable('scan_acquisition_time', '>d', ('scan_number',))
-    v[:] = df.index.astype('d')
+    v[:] = 60. * df.index.astype('d')
     v = f.createVariable('total_intensity', '>d', ('scan_number',))
     v[:] = df.values.sum(axis=1).astype('d')
+    npts = np.sum(df.values != 0, axis=1).astype('i')
     v = f.createVariable('point_count', '>i', ('scan_number',))
-    v[:] = np.sum(df.values != 0, axis=1).astype('i')
+    v[:] = npts
+    v = f.createVariable('scan_index', '>i', ('scan_number',))
+    v[:] = np.cumsum(npts) - npts
     f.flush()
 
     f.createDimension('point_number', np.sum(df.values != 0))
-    stretch_t = np.resize(df.index, df.values.T.shape).T
+    stretch_mz = np.resize(np.array(df.columns, dtype=float), df.values.shape)
     v = f.createVariable('mass_values', '>f', ('point_number',))
-    v[:] = stretch_t[df.values != 0]
+    v[:] = stretch_mz[df.values != 0]
     v = f.createVariable('intensity_values', '>f', ('point_number',))
     v[:] = df.values[df.values != 0]
 
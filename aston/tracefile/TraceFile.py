@@ -1,6 +1,9 @@
 import numpy as np
 from aston.trace.Trace import AstonSeries, AstonFrame
-from aston.tracefile.Common import tfclasses, file_type
+from aston.resources import cache, get_pref
+from aston.tracefile.Common import tfclass, file_type, file_md5
+from aston.spectra.Scan import Scan
+from aston.spectra.Merge import merge_scans
 
 
 class TraceFile(object):
@@ -13,10 +16,11 @@ class TraceFile(object):
     # a # indicating a 2d trace or nothing indicating a single trace name
     traces = []
 
-    def __init__(self, filename=None, ftype=None, data=None):
+    def __init__(self, filename=None, ftype=None, data=None, lazy=None):
         self.filename = filename
         self.ftype = ''
         self._data = None
+        self._lazy = lazy
 
         # try to automatically change my class to reflect
         # whatever type of file I'm pointing at if not provided
@@ -27,17 +31,29 @@ class TraceFile(object):
             if filename is None:
                 return
 
-            ftype = file_type(filename)
+            if ftype is None:
+                ftype = file_type(filename)
 
             if ftype is not None:
                 # try to automatically subclass myself to provided type
-                for cls in tfclasses():
-                    if cls.__name__ == ftype:
-                        self.__class__ = cls
-                        self.ftype = ftype
+                cls = tfclass(ftype)
+                if cls is not None:
+                    self.__class__ = cls
+                    self.ftype = ftype
         else:
             self.ftype = self.__class__.__name__
 
+    @property
+    def lazy(self):
+        """
+        If True, readers that support it memory-map the file and only
+        decode the parts of the data that are actually used.
+        """
+        if self._lazy is None:
+            self._lazy = str(get_pref('Default.LAZY_FRAMES')).lower() \
+                    in {'true', 'yes', '1'}
+        return self._lazy
+
     @property
     def data(self):
         if self._data is not None:
@@ -98,6 +114,12 @@ class TraceFile(object):
         else:
             return AstonSeries()
 
+    def traces_for(self, mzs, tol=0.5, twin=None):
+        """
+        Returns an AstonFrame of the traces for every one of mzs.
+        """
+        return self.data.traces_for(mzs, tol, twin)
+
     def scan(self, t, dt=None, aggfunc=None):
         """
         Returns the spectrum from a specific time or range of times.
@@ -114,10 +136,16 @@ class TraceFile(object):
         #TODO: check for '*' trace in self.traces
         return []
 
-    def md5hash(self):
-        #TODO: calculate md5hash of this file
-        # to be used for determining if files in db are unique
-        raise NotImplementedError
+    def md5hash(self, sample=None):
+        """
+        The MD5 hash of this file, for telling if files are the same.
+
+        Parameters
+        ----------
+        sample : int, optional
+            Only hash this many bytes from each end of the file.
+        """
+        return file_md5(self.filename, sample)
 
 
 class ScanListFile(TraceFile):
@@ -146,36 +174,132 @@ class ScanListFile(TraceFile):
             twin = (-np.inf, np.inf)
         if name in {'tic', 'x', ''}:
             return self.total_trace(twin)
-        times, y = [], []
+        try:
+            mz = float(name)
+        except ValueError:
+            return AstonSeries([], [], name=name)
+        xic = self.traces_for([mz], tol, twin)
+        return AstonSeries(xic.values[:, 0], xic.index, name=name)
+
+    def traces_for(self, mzs, tol=0.5, twin=None):
+        """
+        Extracts the ion chromatograms for many m/z's in one pass
+        through the scans.
+
+        Parameters
+        ----------
+        mzs : list of float
+        tol : float or list of float, optional
+            Abundances within this distance of each m/z are summed.
+        twin : tuple, optional
+
+        Returns
+        -------
+        AstonFrame
+            With one column for each of mzs.
+        """
+        if twin is None:
+            twin = (-np.inf, np.inf)
+        mzs = np.asarray(mzs, dtype=float)
+        tol = np.asarray(tol, dtype=float)
+        lo, hi = mzs - tol, mzs + tol
+
+        times, rows = [], []
         for s in self.scans(twin):
             t = float(s.name)
             if t < twin[0]:
                 continue
             if t > twin[1]:
                 break
+            x, abn = np.asarray(s.x, dtype=float), np.asarray(s.abn)
+            if np.any(x[1:] < x[:-1]):
+                srt = np.argsort(x, kind='mergesort')
+                x, abn = x[srt], abn[srt]
+            # sum of every point in (lo, hi) from a cumulative sum
+            csum = np.zeros(len(x) + 1)
+            np.cumsum(abn, out=csum[1:])
+            rows.append(csum[np.searchsorted(x, hi, 'left')] - \
+                        csum[np.searchsorted(x, lo, 'right')])
             times.append(t)
-            #TODO: this can be vectorized with numpy?
-            y.append(sum(j for i, j in zip(s.x, s.abn) \
-                            if np.abs(i - name) < tol))
-        return AstonSeries(y, times, name=name)
+        data = np.array(rows).reshape(len(times), len(mzs))
+        return AstonFrame(data, np.array(times), mzs.tolist())
 
-    def scan(self, t, dt=None, aggfunc=None):
-        #TODO: use aggfunc
-        prev_s = None
-        bin_scans = []
-        for s in self.scans():
-            if float(s.name) > t:
-                if float(prev_s.name) - t < float(s.name) - t:
-                    if dt is None:
-                        return prev_s
-                    else:
-                        bin_scans.append(prev_s)
-                elif dt is None:
-                    return s
-                bin_scans.append(s)
-                if float(s.name) > t + dt:
-                    break
-            prev_s = s
-        # merge bin_scans and return
-        #FIXME
-        pass
+    def _scan_index(self):
+        """
+        The times of every scan (as 'times'), along with anything else
+        _read_scans needs to find them again (e.g. their offsets in the
+        file). Readers should override this with something that doesn't
+        have to read every scan and persist it with save_index.
+        """
+        return {'times': np.array([float(s.name) for s in self.scans()])}
+
+    def _read_scans(self, idxs):
+        """
+        Reads the scans at the (sorted) positions idxs in _scan_index.
+        """
+        idxs = set(idxs)
+        return [s for i, s in enumerate(self.scans()) if i in idxs]
+
+    @cache(maxsize=1)
+    def _scan_times(self):
+        """
+        The positions in _scan_index of the scans with a time, their
+        times and whether those are sorted.
+        """
+        times = np.asarray(self._scan_index()['times'], dtype=float)
+        pos = np.flatnonzero(~np.isnan(times))
+        return pos, times[pos], bool(np.all(np.diff(times[pos]) >= 0))
+
+    def _nearest_scan(self, t):
+        """
+        The position of the scan closest to t (ties go to the earliest).
+        """
+        pos, times, srtd = self._scan_times()
+        if not srtd or len(times) < 2:
+            return np.abs(times - t).argmin()
+        idx = int(np.clip(np.searchsorted(times, t), 1, len(times) - 1))
+        return idx - 1 if t - times[idx - 1] <= times[idx] - t else idx
+
+    def scan(self, t, dt=None, aggfunc=None, tol=None, units='da'):
+        """
+        Returns the spectrum closest to time t or, if dt is given, all
+        of the spectra from t to t + dt merged together (or None if
+        there aren't any that can be read).
+
+        Parameters
+        ----------
+        t : float
+        dt : float, optional
+        aggfunc : {'sum', 'mean', 'max'} or callable, optional
+            How the spectra are combined (by default they're summed).
+            A callable gets a (scans x m/z's) array of the spectra and
+            returns one row.
+        tol : float, optional
+            Bin together m/z's within tol of each other when merging.
+        units : {'da', 'ppm'}, optional
+            The units of tol.
+        """
+        pos, times, _ = self._scan_times()
+        if len(times) == 0:
+            return None
+        idx = self._nearest_scan(t)
+        if dt is None:
+            # _read_scans leaves out spectra it can't decode
+            scans = self._read_scans([pos[idx]])
+            return scans[0] if len(scans) > 0 else None
+
+        # every scan between the ones closest to t and t + dt
+        lo, hi = sorted([times[idx], times[self._nearest_scan(t + dt)]])
+        scans = self._read_scans(pos[(times >= lo) & (times <= hi)])
+        if len(scans) == 0:
+            return None
+        if aggfunc is None or isinstance(aggfunc, str):
+            return merge_scans(scans, tol, units, aggfunc or 'sum')
+
+        x = np.concatenate([np.asarray(s.x, dtype=float) for s in scans])
+        ions, cols = np.unique(x, return_inverse=True)
+        abn = np.concatenate([np.asarray(s.abn, dtype=float) for s in scans])
+        rows = np.repeat(np.arange(len(scans)), [len(s.x) for s in scans])
+        data = np.zeros((len(scans), len(ions)))
+        np.add.at(data, (rows, cols.ravel()), abn)
+        return Scan(ions, np.asarray(aggfunc(data)).ravel())
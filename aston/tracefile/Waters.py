@@ -1,7 +1,8 @@
-import struct
 import os.path as op
 import numpy as np
-from aston.trace.Trace import AstonFrame
+import scipy.sparse
+from aston.resources import cache
+from aston.trace.Trace import AstonFrame, AstonSeries, LazyAstonFrame
 from aston.tracefile.TraceFile import TraceFile
 
 
@@ -14,58 +15,93 @@ class WatersAutospec(TraceFile):
     ext = 'IDX'
     traces = ['#ms']
 
-    #def _total_trace(self, twin=None):
-    #    fidx = open(self.filename, 'rb')
-    #    tme, tic = [], []
-    #    while True:
-    #        try:
-    #            d = struct.unpack('<IHHffhhh', fidx.read(22))
-    #            # I: offset in *.DAT file of data chunk
-    #            # H: number of data points in data chunk (bytes / 4)
-    #            # H:
-    #            # f: TIC of data point
-    #            # f: time of data point
-    #            # h:
-    #            # h: 10, 20, 21, 30, 31, 40, or 41?
-    #            # h: 80, A0, C0, E0
-    #        except struct.error:
-    #            break
-    #        tme.append(d[4])
-    #        tic.append(d[3])
-    #    fidx.close()
-    #    return TimeSeries(np.array(tic), np.array(tme), \
-    #                      ['TIC']).trace(twin=twin)
+    @cache(maxsize=1)
+    def _scan_index(self):
+        """
+        Reads every record of the *.IDX file and memory-maps the
+        *.DAT file that they point into.
+        """
+        idx = _read_idx(self.filename)
+        dat = np.memmap(op.splitext(self.filename)[0] + '.DAT', \
+                        dtype=np.uint8, mode='r')
+        return idx, dat
+
+    def total_trace(self, twin=None):
+        # the TIC of every scan is already in its index record
+        idx = _read_idx(self.filename)
+        return AstonSeries(idx['tic'].astype(float), \
+                           idx['time'].astype(float), name='TIC').twin(twin)
 
     @property
+    @cache(maxsize=1)
     def data(self):
-        fidx = open(self.filename, 'rb')
-        fdat = open(op.splitext(self.filename)[0] + '.DAT', 'rb')
-
-        ions = set([])
-        while True:
-            fdat.seek(fdat.tell() + 2)
-            try:
-                i = struct.unpack('<H', fdat.read(2))[0]
-            except struct.error:
-                break
-            ions.add(i)
-        ions = sorted(ions)
-
-        data = []
-        tme = []
-        while True:
-            try:
-                idx = struct.unpack('<IHHffhhh', fidx.read(22))
-                tme.append(idx[4])
-                fdat.seek(idx[0])
-                new_line = np.zeros(len(ions))
-                d = struct.unpack('<' + int(idx[1] / 4) * 'HH', \
-                fdat.read(idx[1]))
-                for i, v in zip(d[1::2], d[0::2]):
-                    new_line[ions.index(i)] = v
-                data.append(new_line)
-            except struct.error:
-                break
-        fdat.close()
-        fidx.close()
-        return AstonFrame(np.array(data), np.array(tme), ions)
+        idx, dat = self._scan_index()
+        if self.lazy:
+            decode = lambda st, en: _autospec_frame(idx[st:en], dat)
+            return LazyAstonFrame(idx['time'].astype(float), decode, \
+                                  lambda: _autospec_ions(idx, dat))
+        return _autospec_frame(idx, dat)
+
+
+# I: offset in *.DAT file of data chunk
+# H: number of bytes in data chunk (4 per data point)
+# H:
+# f: TIC of data point
+# f: time of data point
+# h:
+# h: 10, 20, 21, 30, 31, 40, or 41?
+# h: 80, A0, C0, E0
+_IDX_REC = np.dtype([('offset', '<u4'), ('nbytes', '<u2'), ('unk1', '<u2'), \
+                     ('tic', '<f4'), ('time', '<f4'), ('unk2', '<i2'), \
+                     ('unk3', '<i2'), ('unk4', '<i2')])
+
+
+def _read_idx(filename):
+    nscans = op.getsize(filename) // _IDX_REC.itemsize
+    return np.fromfile(filename, dtype=_IDX_REC, count=nscans)
+
+
+def _autospec_frame(idx, dat):
+    """
+    Decodes the data chunks that the index records idx point to into
+    a sparse AstonFrame.
+    """
+    indptr, abns, mzs = _autospec_points(idx, dat)
+
+    # ions are 16-bit, so a lookup table maps them to columns faster
+    # than sorting them with np.unique would
+    ions = np.flatnonzero(np.bincount(mzs))
+    lkup = np.zeros(ions[-1] + 1 if len(ions) > 0 else 0, dtype=int)
+    lkup[ions] = np.arange(len(ions))
+    data = scipy.sparse.csr_matrix((abns, lkup[mzs], indptr), \
+      shape=(len(idx), len(ions)), dtype=float)
+    return AstonFrame(data, idx['time'].astype(float), ions.tolist())
+
+
+def _autospec_points(idx, dat):
+    """
+    The row pointers, abundances and ions of the points in the data
+    chunks that the index records idx point to.
+    """
+    npts = idx['nbytes'].astype(int) // 4
+    indptr = np.zeros(len(idx) + 1, dtype=int)
+    np.cumsum(npts, out=indptr[1:])
+
+    # every point is a little-endian abundance and then its ion
+    pos = np.repeat(idx['offset'] - 4 * indptr[:-1], npts) + \
+            4 * np.arange(indptr[-1])
+    pts = dat[pos[:, None] + np.arange(4)].astype(np.uint16)
+    abns = pts[:, 0] | (pts[:, 1] << 8)
+    mzs = pts[:, 2] | (pts[:, 3] << 8)
+    return indptr, abns, mzs
+
+
+def _autospec_ions(idx, dat, chunk=1000):
+    """
+    The (sorted) ions in any of the data chunks that idx point to,
+    found a chunk of records at a time.
+    """
+    seen = np.zeros(2 ** 16, dtype=bool)
+    for st in range(0, len(idx), chunk):
+        seen[_autospec_points(idx[st:st + chunk], dat)[2]] = True
+    return np.flatnonzero(seen)
@@ -20,9 +20,12 @@
 
 '''Loads and runs the Aston application.'''
 #pylint: disable=C0103
+import ast
+import multiprocessing
 import sys
 
-if len(sys.argv) > 1:
+
+def make_parser():
     import argparse
     parser = argparse.ArgumentParser(description='Chromatogram processor.')
 
@@ -37,19 +40,64 @@ if len(sys.argv) > 1:
     parser_conv.add_argument('outfile')
 
     parser_plot = subp.add_parser('plot')
-    parser_conv.add_argument('file')
-    parser_conv.add_argument('-p', '--plotfile')
+    parser_plot.add_argument('file')
+    parser_plot.add_argument('-p', '--plotfile')
 
     parser_info = subp.add_parser('info')
-    parser_conv.add_argument('file')
-
-    args = parser.parse_args()
+    parser_info.add_argument('file')
+
+    parser_proc = subp.add_parser('process', \
+                                  help='find and integrate peaks in ' + \
+                                  'every file in a directory')
+    parser_proc.add_argument('directory')
+    parser_proc.add_argument('output', \
+                             help='SQLite database or *.csv file')
+    parser_proc.add_argument('-t', '--trace', action='append', \
+                             help='trace to integrate (default: tic)')
+    parser_proc.add_argument('-f', '--peak-finder', default='simple', \
+                             help='simple, statslope or wavelet')
+    parser_proc.add_argument('-i', '--integrator', default='drop', \
+                             help='simple, drop, constant or periodic')
+    parser_proc.add_argument('--pf-opt', action='append', default=[], \
+                             metavar='KEY=VALUE')
+    parser_proc.add_argument('--int-opt', action='append', default=[], \
+                             metavar='KEY=VALUE')
+    parser_proc.add_argument('-j', '--jobs', type=int, \
+                             help='number of worker processes')
+    parser_proc.add_argument('--restart', action='store_true', \
+                             help="redo files that were already processed")
+    parser_proc.add_argument('-q', '--quiet', action='store_true')
+    return parser, parser_proc
+
+
+def process(args, parser_proc):
+    from aston.batch import process_directory
+
+    def value(v):
+        # numbers, booleans, None and lists are parsed; anything
+        # else (e.g. f=gaussian) is passed through as a string
+        try:
+            return ast.literal_eval(v)
+        except (ValueError, SyntaxError):
+            return v
+
+    def opts(kvs):
+        return dict((kv.split('=', 1)[0], value(kv.split('=', 1)[1])) \
+                    for kv in kvs)
 
-    startx = args.cmd == 'gui'
-else:
-    startx = True
-
-if startx:
+    try:
+        summary = process_directory(args.directory, args.output, \
+                                    args.trace or ['tic'], \
+                                    args.peak_finder, args.integrator, \
+                                    opts(args.pf_opt), opts(args.int_opt), \
+                                    args.jobs, args.restart, \
+                                    None if args.quiet else sys.stderr)
+    except (IOError, ValueError) as e:
+        parser_proc.error(str(e))
+    return 1 if summary['errors'] > 0 else 0
+
+
+def start_gui():
     #for compatibility with Python 2
     import sip
     sip.setapi('QVariant', 2)
@@ -66,12 +114,7 @@ if startx:
     warnings.simplefilter('error', RuntimeWarning)
     warnings.simplefilter('ignore', sqlalchemy.exc.SAWarning)
 
-    # for multiprocessing to work on Windows
-    import multiprocessing
-    multiprocessing.freeze_support()
-
     #all the other imports
-    import sys
     import PyQt4
     from aston.qtgui.MainWindow import AstonWindow
     qt = PyQt4.QtGui.QApplication(sys.argv)
@@ -93,4 +136,31 @@ if startx:
     # set up the main window and start
     aston = AstonWindow()
     aston.show()
-    sys.exit(qt.exec_())
+    return qt.exec_()
+
+
+def main():
+    # for multiprocessing to work on Windows (and frozen apps); the
+    # worker processes re-import this module, so nothing runs at the
+    # top level of it
+    multiprocessing.freeze_support()
+
+    if len(sys.argv) > 1:
+        parser, parser_proc = make_parser()
+        args = parser.parse_args()
+
+        if args.version:
+            from aston import __version__
+            print('Aston ' + __version__)
+            return 0
+
+        if args.cmd == 'process':
+            return process(args, parser_proc)
+
+        if args.cmd != 'gui':
+            return 0
+    return start_gui()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
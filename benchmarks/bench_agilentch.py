@@ -0,0 +1,128 @@
+"""
+Compares decoding Agilent *.ch files with delta_decode against the
+previous value-at-a-time loops, for the old (MWD) and new (MWD2) UV
+formats and the old FID format.
+
+    python benchmarks/bench_agilentch.py [npts]
+"""
+import os
+import struct
+import sys
+import tempfile
+import timeit
+import numpy as np
+from aston.tracefile.AgilentUV import AgilentMWD, AgilentMWD2
+from aston.tracefile.AgilentFID import AgilentFID
+from aston.test.SyntheticFiles import write_agilent_ch
+
+
+def old_mwd(fname):
+    """
+    The original AgilentMWD._read_ind_file, kept here as a reference.
+    """
+    f = open(fname, 'rb')
+    f.seek(0x284)
+    del_ab = struct.unpack('>d', f.read(8))[0]
+    data = np.array([])
+    f.seek(0x401)
+    loc = 0
+    while True:
+        rec_len = struct.unpack('>B', f.read(1))[0]
+        if rec_len == 0:
+            break
+        data = np.append(data, np.empty(rec_len))
+        for _ in range(rec_len):
+            inp = struct.unpack('>h', f.read(2))[0]
+            if inp == -32768:
+                inp = struct.unpack('>i', f.read(4))[0]
+                data[loc] = del_ab * inp
+            elif loc == 0:
+                data[loc] = del_ab * inp
+            else:
+                data[loc] = data[loc - 1] + del_ab * inp
+            loc += 1
+        f.read(1)  # this value is always 0x10?
+    f.close()
+    return data
+
+
+def old_mwd2(fname):
+    """
+    The original AgilentMWD2._read_ind_file, kept here as a reference.
+    """
+    f = open(fname, 'rb')
+    f.seek(0x127C)
+    del_ab = struct.unpack('>d', f.read(8))[0]
+    data = []
+    f.seek(0x1800)
+    while True:
+        x, nrecs = struct.unpack('>BB', f.read(2))
+        if x == 0 and nrecs == 0:
+            break
+        for _ in range(nrecs):
+            inp = struct.unpack('>h', f.read(2))[0]
+            if inp == -32768:
+                inp = struct.unpack('>i', f.read(4))[0]
+                data.append(del_ab * inp)
+            elif len(data) == 0:
+                data.append(del_ab * inp)
+            else:
+                data.append(data[-1] + del_ab * inp)
+    f.close()
+    return np.array(data)
+
+
+def old_fid(fname):
+    """
+    The original AgilentFID.total_trace decoding, kept as a reference.
+    """
+    f = open(fname, 'rb')
+    data = []
+    f.seek(0x400)
+    delt = 0
+    while True:
+        try:
+            inp = struct.unpack('>h', f.read(2))[0]
+        except struct.error:
+            break
+
+        if inp == 32767:
+            inp = struct.unpack('>i', f.read(4))[0]
+            inp2 = struct.unpack('>H', f.read(2))[0]
+            delt = 0
+            data.append(inp * 65534 + inp2)
+        else:
+            delt += inp
+            data.append(data[-1] + delt)
+    f.close()
+    return np.array(data)
+
+
+def main(npts=100000, repeat=3):
+    rnd = np.random.RandomState(0)
+    times = np.linspace(0, 30, npts)
+    signal = np.cumsum(rnd.randint(-2000, 2000, npts))
+
+    tmpdir = tempfile.mkdtemp()
+    print('{} points'.format(npts))
+    for kind, old, new in (('MWD', old_mwd, \
+                            lambda fn: AgilentMWD(fn)._read_ind_file(fn)[1]), \
+                           ('MWD2', old_mwd2, \
+                            lambda fn: AgilentMWD2(fn)._read_ind_file(fn)[1]), \
+                           ('FID', old_fid, \
+                            lambda fn: AgilentFID(fn).total_trace().values)):
+        filename = os.path.join(tmpdir, kind + '.CH')
+        write_agilent_ch(filename, times, signal, kind=kind)
+        assert np.allclose(old(filename), np.ravel(new(filename)))
+        old_t = min(timeit.repeat(lambda: old(filename), \
+                                  number=1, repeat=repeat))
+        new_t = min(timeit.repeat(lambda: new(filename), \
+                                  number=1, repeat=repeat))
+        print('{}: {:.1f} ms -> {:.1f} ms ({:.0f}x)'.format(kind, \
+              1e3 * old_t, 1e3 * new_t, old_t / new_t))
+        os.remove(filename)
+    os.rmdir(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:2]])
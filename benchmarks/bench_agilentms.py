@@ -0,0 +1,93 @@
+"""
+Compares the vectorized AgilentMS.data decoder against the previous
+scan-by-scan struct.unpack decoder on a synthetic full-scan run.
+
+    python benchmarks/bench_agilentms.py [nscans] [npts]
+"""
+import os
+import struct
+import sys
+import tempfile
+import timeit
+import numpy as np
+import scipy.sparse
+from aston.trace.Trace import AstonFrame
+from aston.tracefile.AgilentMS import AgilentMS
+from aston.test.SyntheticFiles import random_ms_scans, write_agilent_ms
+
+
+def struct_data(filename):
+    """
+    The original AgilentMS.data, kept here as a reference.
+    """
+    f = open(filename, 'rb')
+    f.seek(0x118)
+    nscans = struct.unpack('>H', f.read(2))[0]
+
+    f.seek(0x10A)
+    f.seek(2 * struct.unpack('>H', f.read(2))[0] - 2)
+    dstart = f.tell()
+
+    tot_pts = 0
+    rowst = np.empty(nscans + 1, dtype=int)
+    rowst[0] = 0
+    for scn in range(nscans):
+        npos = f.tell() + 2 * struct.unpack('>H', f.read(2))[0]
+        tot_pts += (npos - f.tell() - 26) // 4
+        rowst[scn + 1] = tot_pts
+        f.seek(npos)
+    f.seek(dstart)
+
+    ions = []
+    i_lkup = {}
+    cols = np.empty(tot_pts, dtype=int)
+    vals = np.empty(tot_pts, dtype=np.int64)
+    times = np.empty(nscans)
+    for scn in range(nscans):
+        npos = f.tell() + 2 * struct.unpack('>H', f.read(2))[0]
+        times[scn] = struct.unpack('>I', f.read(4))[0] / 60000.
+        f.seek(f.tell() + 12)
+        npts = rowst[scn + 1] - rowst[scn]
+        mzs = struct.unpack('>' + npts * 'HH', f.read(npts * 4))
+        nions = set(mzs[0::2]).difference(i_lkup)
+        i_lkup.update({ion: i + len(ions) for i, ion in enumerate(nions)})
+        ions += nions
+        cols[rowst[scn]:rowst[scn + 1]] = [i_lkup[i] for i in mzs[0::2]]
+        vals[rowst[scn]:rowst[scn + 1]] = mzs[1::2]
+        f.seek(npos)
+    f.close()
+
+    vals = ((vals & 16383) * 8 ** (vals >> 14)).astype(float)
+    data = scipy.sparse.csr_matrix((vals, cols, rowst), \
+      shape=(nscans, len(ions)), dtype=float)
+    return AstonFrame(data, times, np.array(ions) / 20.)
+
+
+def main(nscans=4000, npts=300, repeat=3):
+    fd, filename = tempfile.mkstemp(suffix='.MS')
+    os.close(fd)
+    try:
+        write_agilent_ms(filename, *random_ms_scans(nscans, npts))
+
+        old = struct_data(filename)
+        new = AgilentMS(filename).data
+        old_order = np.argsort(old.columns)
+        assert np.allclose(old.index, new.index)
+        assert np.allclose(old.columns[old_order], new.columns)
+        assert (old.values[:, old_order] != new.values).nnz == 0
+
+        old_t = min(timeit.repeat(lambda: struct_data(filename), \
+                                  number=1, repeat=repeat))
+        # bypass the cache on the data property
+        new_f = AgilentMS.data.fget.__wrapped__
+        new_t = min(timeit.repeat(lambda: new_f(AgilentMS(filename)), \
+                                  number=1, repeat=repeat))
+        print('{} scans x {} points'.format(nscans, npts))
+        print('struct.unpack: {:.3f} s'.format(old_t))
+        print('vectorized:    {:.3f} s ({:.1f}x)'.format(new_t, old_t / new_t))
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:3]])
@@ -0,0 +1,168 @@
+"""
+Compares reading diode array spectra from Chemstation *.uv files
+(old and new formats) and *.sd/*.sp files against the previous
+struct.unpack loops, and reading only a window of them.
+
+    python benchmarks/bench_agilentuv.py [nscans] [nwvs]
+"""
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import timeit
+import numpy as np
+from aston.trace.Trace import AstonFrame
+from aston.tracefile.AgilentUV import AgilentCSDAD, AgilentCSDAD2, \
+        AgilentDAD
+from aston.test.SyntheticFiles import write_agilent_uv, write_agilent_dad
+
+
+def old_csdad(filename):
+    """
+    The original AgilentCSDAD.data, kept here as a reference.
+    """
+    f = open(filename, 'rb')
+    f.seek(0x116)
+    nscans = struct.unpack('>i', f.read(4))[0]
+
+    times = np.zeros(nscans)
+    data = nscans * [{}]
+    ions = []
+    npos = 0x202
+    for i in range(nscans):
+        f.seek(npos)
+        npos += struct.unpack('<H', f.read(2))[0]
+        times[i] = struct.unpack('<L', f.read(4))[0] / 60000.
+        nm_srt = struct.unpack('<H', f.read(2))[0] / 20.
+        nm_end = struct.unpack('<H', f.read(2))[0] / 20.
+        nm_stp = struct.unpack('<H', f.read(2))[0] / 20.
+        f.read(8)
+        s = {}
+        v = struct.unpack('<h', f.read(2))[0] / 2000.
+        s[nm_srt] = v
+        for wv in np.arange(nm_srt, nm_end, nm_stp):
+            ov = struct.unpack('<h', f.read(2))[0]
+            if ov == -32768:
+                v = struct.unpack('<i', f.read(4))[0] / 2000.
+            else:
+                v += ov / 2000.
+            s[wv] = v
+            if wv not in ions:
+                ions.append(wv)
+        data[i] = s
+
+    ndata = np.zeros((nscans, len(ions)))
+    for i, d in zip(range(nscans), data):
+        for ion, abn in d.items():
+            ndata[i, ions.index(ion)] = abn
+    return AstonFrame(ndata, times, ions)
+
+
+def old_csdad2(filename):
+    """
+    The original AgilentCSDAD2.data, kept here as a reference.
+    """
+    f = open(filename, 'rb')
+    f.seek(0x116)
+    nscans = struct.unpack('>i', f.read(4))[0]
+
+    wvs = set()
+    times = np.empty(nscans)
+    npos = 0x1002
+    for i in range(nscans):
+        f.seek(npos)
+        npos += struct.unpack('<H', f.read(2))[0]
+        times[i] = struct.unpack('<L', f.read(4))[0]
+        nm_srt, nm_end, nm_stp = struct.unpack('<HHH', f.read(6))
+        n_wvs = np.arange(nm_srt, nm_end, nm_stp) / 20.
+        wvs.update(set(n_wvs).difference(wvs))
+    wvs = list(wvs)
+
+    ndata = np.empty((nscans, len(wvs)), dtype="<i4")
+    npos = 0x1002
+    unpack, seek, read, tell = struct.unpack, f.seek, f.read, f.tell
+    for i in range(nscans):
+        seek(npos)
+        dlen = unpack('<H', read(2))[0]
+        npos += dlen
+        seek(tell() + 4)  # skip time
+        nm_srt, nm_end, nm_stp = unpack('<HHH', read(6))
+        seek(tell() + 8)
+        v = 0
+        for wv in np.arange(nm_srt, nm_end, nm_stp) / 20.:
+            ov = unpack('<h', read(2))[0]
+            if ov == -32768:
+                v = unpack('<i', read(4))[0]
+            else:
+                v += ov
+            ndata[i, wvs.index(wv)] = v
+    return AstonFrame(ndata / 2000., times / 60000., wvs)
+
+
+def old_dad(filename):
+    """
+    The original AgilentDAD.data, kept here as a reference.
+    """
+    fhead = open(filename[:-3] + '.sd', 'rb')
+    fdata = open(filename[:-3] + '.sp', 'rb')
+    fhead.seek(0x50)
+    nscans = struct.unpack('Q', fhead.read(8))[0]
+    fhead.seek(0xA4)
+    for scn in range(nscans):
+        t = struct.unpack('<IdddIQIIdddd', fhead.read(80))
+        npts = t[7]
+        if scn == 0:
+            data = np.zeros((nscans, npts))
+            times = np.zeros((nscans))
+            ions = [t[8] + x * t[3] for x in range(npts)]
+        times[scn] = t[1]
+        fdata.seek(t[5] + 16)
+        data[scn] = struct.unpack('<' + npts * 'd', fdata.read(npts * 8))
+    return AstonFrame(data, times, ions)
+
+
+def sorted_values(df):
+    return df.values[:, np.argsort(df.columns)]
+
+
+def main(nscans=2000, nwvs=200, repeat=3):
+    rnd = np.random.RandomState(0)
+    times = np.linspace(0, 30, nscans)
+    spectra = np.cumsum(rnd.randint(-3000, 3000, (nscans, nwvs)), axis=1)
+    tmpdir = tempfile.mkdtemp()
+
+    uv_wvs = (190 * 20, 190 * 20 + nwvs * 40, 40)
+    dad_file = os.path.join(tmpdir, 'DAD1.sd')
+    write_agilent_dad(dad_file, times, (190., 2., nwvs), spectra / 7.)
+    runs = []
+    for kind, cls, old in (('CSDAD', AgilentCSDAD, old_csdad), \
+                           ('CSDAD2', AgilentCSDAD2, old_csdad2)):
+        filename = os.path.join(tmpdir, kind + '.UV')
+        write_agilent_uv(filename, times, uv_wvs, spectra, kind=kind)
+        runs.append((kind, cls, old, filename))
+    runs.append(('DAD', AgilentDAD, old_dad, dad_file))
+
+    print('{} scans of {} wavelengths'.format(nscans, nwvs))
+    # a new object each time, so nothing is cached between runs
+    new = lambda cls, fn: cls(fn, lazy=False).read_window()
+    window = lambda cls, fn: cls(fn).read_window((10, 12), (250, 260))
+    try:
+        for kind, cls, old, filename in runs:
+            assert np.allclose(sorted_values(old(filename)), \
+                               new(cls, filename).values)
+            old_t = min(timeit.repeat(lambda: old(filename), \
+                                      number=1, repeat=repeat))
+            new_t = min(timeit.repeat(lambda: new(cls, filename), \
+                                      number=1, repeat=repeat))
+            win_t = min(timeit.repeat(lambda: window(cls, filename), \
+                                      number=1, repeat=repeat))
+            print('{}: {:.1f} ms -> {:.1f} ms ({:.0f}x), window: {:.1f} ms' \
+                  .format(kind, 1e3 * old_t, 1e3 * new_t, old_t / new_t, \
+                          1e3 * win_t))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:3]])
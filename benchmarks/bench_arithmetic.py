@@ -0,0 +1,62 @@
+"""
+Compares AstonSeries arithmetic against the previous apply_along_axis
+and interp1d implementation, summing a handful of traces (like the
+ion string 57+71+85+99) on matching and on mismatched time axes.
+
+    python benchmarks/bench_arithmetic.py [npts] [ntraces]
+"""
+import sys
+import timeit
+import numpy as np
+from scipy.interpolate import interp1d
+from aston.trace.Trace import AstonSeries
+
+
+def old_add(a, b):
+    """
+    The original AstonSeries.__add__, kept here as a reference.
+    """
+    if np.array_equal(b.index, a.index):
+        d = b.values
+    else:
+        f = lambda d: interp1d(b.index, d, \
+            bounds_error=False, fill_value=0.0)(a.index)
+        d = np.apply_along_axis(f, 0, b.values)
+    new_data = np.apply_along_axis(lambda x, y: x + y, 0, a.values, d)
+    return AstonSeries(new_data, a.index, name=a.name)
+
+
+def main(npts=5000, ntraces=4, repeat=200):
+    rnd = np.random.RandomState(0)
+    t = np.linspace(0, 60, npts)
+    same = [AstonSeries(rnd.rand(npts), t, name=str(i)) \
+            for i in range(ntraces)]
+    # every other trace was sampled on a slightly offset time axis
+    diff = [AstonSeries(rnd.rand(npts), t + 0.003 * (i % 2), name=str(i)) \
+            for i in range(ntraces)]
+
+    def old_sum(tss):
+        total = tss[0]
+        for ts in tss[1:]:
+            total = old_add(total, ts)
+        return total
+
+    def new_sum(tss):
+        total = tss[0].copy()
+        for ts in tss[1:]:
+            total += ts
+        return total
+
+    print('{} traces of {} points'.format(ntraces, npts))
+    for name, tss in (('same times', same), ('different times', diff)):
+        assert np.allclose(old_sum(tss).values, new_sum(tss).values)
+        old_t = min(timeit.repeat(lambda: old_sum(tss), \
+                                  number=1, repeat=repeat))
+        new_t = min(timeit.repeat(lambda: new_sum(tss), \
+                                  number=1, repeat=repeat))
+        print('{}: {:.1f} us -> {:.1f} us ({:.1f}x)'.format(name, \
+              1e6 * old_t, 1e6 * new_t, old_t / new_t))
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:3]])
@@ -0,0 +1,107 @@
+"""
+Compares reading Bruker *.AMI files with one bulk gather and np.unique
+against the previous struct.unpack loops (which built a set and dict
+of ions for every scan).
+
+    python benchmarks/bench_bruker.py [nscans] [npts]
+"""
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import timeit
+import numpy as np
+import scipy.sparse
+from aston.trace.Trace import AstonFrame
+from aston.tracefile.Bruker import BrukerMSMS
+from aston.test.SyntheticFiles import random_ms_scans, write_bruker_ami
+
+
+def old_data(filename):
+    """
+    The original BrukerMSMS.data, kept here as a reference.
+    """
+    rd = lambda f, st: struct.unpack(st, f.read(struct.calcsize(st)))
+    f = open(filename, 'rb')
+
+    nscans = rd(f, 'ii')[1]
+    times = np.array(rd(f, nscans * 'd')) / 60.0
+    f.seek(f.tell() + 4)  # number of scans again
+
+    indptr = np.empty(nscans + 1, dtype=int)
+    indptr[0] = 0
+
+    dpos = f.tell()
+    tot_pts = 0
+    for scn in range(nscans):
+        npts = rd(f, 'i')[0]
+        f.seek(f.tell() + 8 * npts + 4)
+        tot_pts += npts
+        indptr[scn + 1] = tot_pts
+    f.seek(dpos)
+
+    ions = []
+    i_lkup = {}
+    idxs = np.empty(tot_pts, dtype=int)
+    vals = np.empty(tot_pts, dtype=float)
+
+    for scn in range(nscans):
+        npts = rd(f, 'i')[0]
+        rd_ions = rd(f, npts * 'f')
+        f.seek(f.tell() + 4)  # number of points again
+        abun = rd(f, npts * 'f')
+
+        nions = set([int(i) for i in rd_ions \
+          if int(i) not in i_lkup])
+        i_lkup.update(dict((ion, i + len(ions) - 1) \
+          for i, ion in enumerate(nions)))
+        ions += nions
+
+        idxs[indptr[scn]:indptr[scn + 1]] = \
+            [i_lkup[int(i)] for i in rd_ions]
+        vals[indptr[scn]:indptr[scn + 1]] = \
+            abun
+
+    idxs += 1
+    data = scipy.sparse.csr_matrix((vals, idxs, indptr), \
+                                shape=(nscans, len(ions)), \
+                                dtype=float)
+    f.close()
+    return AstonFrame(data, times, ions)
+
+
+def main(nscans=5000, npts=200, repeat=3):
+    times, scans = random_ms_scans(nscans, npts)
+    rnd = np.random.RandomState(1)
+    # centroided m/z's a little above each nominal mass (the old reader
+    # truncated them and the new one rounds them)
+    scans = [(mzs + rnd.uniform(0, 0.4, len(mzs)), abns) \
+             for mzs, abns in scans]
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'RUN.AMI')
+    write_bruker_ami(filename, times, scans)
+
+    # a new object each time, so nothing is cached between runs
+    new = lambda **kw: BrukerMSMS(filename, lazy=False).read_window(**kw)
+    try:
+        old = old_data(filename)
+        srt = np.argsort(old.columns)
+        assert np.allclose(old.values.toarray()[:, srt], \
+                           new().values.toarray())
+
+        old_t = min(timeit.repeat(lambda: old_data(filename), \
+                                  number=1, repeat=repeat))
+        print('{} scans of {} points'.format(nscans, npts))
+        for name, kw in (('nominal', {}), ('exact', {'mz_round': None}), \
+                         ('1 min window', {'twin': (10., 11.)})):
+            new_t = min(timeit.repeat(lambda: new(**kw), \
+                                      number=1, repeat=repeat))
+            print('{}: {:.1f} ms -> {:.1f} ms ({:.0f}x)'.format(name, \
+                  1e3 * old_t, 1e3 * new_t, old_t / new_t))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:3]])
@@ -0,0 +1,68 @@
+"""
+Compares identifying many spectra with one batched SpectralLibrary.search
+(with each of its scoring methods) against calling find_spectrum_match
+once per spectrum (which is what the compound database did for every
+peak).
+
+    python benchmarks/bench_library.py [nlib] [nquery]
+"""
+import sys
+import timeit
+import numpy as np
+import scipy.sparse
+from aston.spectra.Math import find_spectrum_match
+from aston.spectra.Library import SpectralLibrary
+
+
+def old_search(lib_mat, lib_mzs, spectra):
+    """
+    One find_spectrum_match per spectrum, kept here as a reference.
+    """
+    hits = []
+    for mzs, abns in spectra:
+        adj_spc = np.zeros(lib_mzs.shape)
+        for ion, abn in zip(mzs, abns):
+            adj_spc[np.abs(lib_mzs - ion) < 0.5] += abn
+        hits.append(find_spectrum_match(adj_spc, lib_mat)[0])
+    return np.array(hits)
+
+
+def main(nlib=5000, nquery=200, repeat=3):
+    rnd = np.random.RandomState(0)
+    spectra = []
+    for _ in range(nlib):
+        npts = rnd.randint(10, 80)
+        mzs = np.sort(rnd.choice(np.arange(30., 600.), npts, replace=False))
+        spectra.append((mzs, rnd.exponential(100., npts)))
+    names = ['c{}'.format(i) for i in range(nlib)]
+    queries = [(mzs + rnd.normal(0, 0.1, len(mzs)), \
+                abns * rnd.uniform(0.9, 1.1, len(abns))) \
+               for mzs, abns in spectra[:nquery]]
+
+    lib = SpectralLibrary.build(names, spectra)
+    # the old code's library: spectra scaled to their largest peak
+    lib_mat = scipy.sparse.csr_matrix(lib.matrix.multiply( \
+        lib.norms[:, np.newaxis]))
+    assert np.all(old_search(lib_mat, lib.mzs, queries) == np.arange(nquery))
+    assert np.all(lib.search(queries, 1)[0][:, 0] == np.arange(nquery))
+
+    print('{} library spectra, {} queries'.format(nlib, nquery))
+    old_t = min(timeit.repeat(lambda: old_search(lib_mat, lib.mzs, queries), \
+                              number=1, repeat=repeat))
+    for name, f in (('search', lambda: lib.search(queries, 5)), \
+                    ('search (no prefilter)', \
+                     lambda: lib.search(queries, 5, prefilter=False)), \
+                    ('search (weighted dot)', \
+                     lambda: lib.search(queries, 5, method='dot')), \
+                    ('search (composite)', \
+                     lambda: lib.search(queries, 5, method='composite')), \
+                    ('search (reverse composite)', \
+                     lambda: lib.search(queries, 5, method='composite', \
+                                        reverse=True))):
+        new_t = min(timeit.repeat(f, number=1, repeat=repeat))
+        print('{}: {:.1f} ms -> {:.1f} ms ({:.0f}x)'.format(name, \
+              1e3 * old_t, 1e3 * new_t, old_t / new_t))
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:3]])
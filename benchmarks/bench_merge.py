@@ -0,0 +1,54 @@
+"""
+Times merging many high resolution spectra with merge_spectra, with
+and without ppm binning, against summing them into a dict by m/z.
+
+    python benchmarks/bench_merge.py [nscans] [npts]
+"""
+import sys
+import timeit
+import numpy as np
+from aston.spectra.Merge import merge_spectra
+
+
+def dict_merge(mzs, abns):
+    """
+    Summing every spectrum into a dict, for reference.
+    """
+    merged = {}
+    for x, y in zip(mzs, abns):
+        for mz, abn in zip(x.tolist(), y.tolist()):
+            merged[mz] = merged.get(mz, 0) + abn
+    srt = sorted(merged)
+    return np.array(srt), np.array([merged[mz] for mz in srt])
+
+
+def main(nscans=2000, npts=1000, repeat=3):
+    rnd = np.random.RandomState(0)
+    # npts real ions, measured a little differently every scan
+    ions = np.sort(rnd.uniform(50, 1000, npts))
+    mzs = [ions * (1 + rnd.normal(0, 2e-6, npts)) for _ in range(nscans)]
+    abns = [rnd.uniform(0, 1e4, npts) for _ in range(nscans)]
+
+    x, y = merge_spectra(mzs, abns)
+    assert np.allclose(y, dict_merge(mzs, abns)[1])
+    x, y = merge_spectra(mzs, abns, tol=10, units='ppm')
+    print('{} scans of {} points, {} bins at 10 ppm'.format(nscans, npts, \
+          len(x)))
+
+    old_t = min(timeit.repeat(lambda: dict_merge(mzs, abns), \
+                              number=1, repeat=repeat))
+    print('dict: {:.1f} ms'.format(1e3 * old_t))
+    for name, kw in (('exact', {}), \
+                     ('10 ppm sum', {'tol': 10, 'units': 'ppm'}), \
+                     ('10 ppm mean', {'tol': 10, 'units': 'ppm', \
+                                      'how': 'mean'}), \
+                     ('10 ppm max', {'tol': 10, 'units': 'ppm', \
+                                     'how': 'max'})):
+        new_t = min(timeit.repeat(lambda: merge_spectra(mzs, abns, **kw), \
+                                  number=1, repeat=repeat))
+        print('{}: {:.1f} ms ({:.0f}x)'.format(name, 1e3 * new_t, \
+                                               old_t / new_t))
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:3]])
@@ -0,0 +1,76 @@
+"""
+Compares reading high resolution AIA/ANDI *.CDF files with np.unique
+against the previous loop over every distinct m/z (which also made
+the frame dense), and reading only a time window of them.
+
+    python benchmarks/bench_netcdf.py [nscans] [npts]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import numpy as np
+import scipy.sparse
+from aston.trace.Trace import AstonFrame
+from aston.tracefile.NetCDF import NetCDF, NetCDFFile
+from aston.test.SyntheticFiles import random_ms_scans, write_andi_ms
+
+
+def old_data(filename):
+    """
+    The original NetCDF.data, kept here as a reference.
+    """
+    f = NetCDFFile(open(filename, 'rb'))
+    t = f.variables['scan_acquisition_time'].data / 60.
+
+    ions = np.array(list(set(f.variables['mass_values'].data)))
+    rcols = f.variables['mass_values'].data
+    cols = np.empty(rcols.shape, dtype=int)
+    for i, ion in enumerate(ions):
+        cols[rcols == ion] = i
+
+    vals = f.variables['intensity_values'].data
+    rowst = np.add.accumulate(f.variables['point_count'].data)
+    rowst = np.insert(rowst, 0, 0)
+
+    data = scipy.sparse.csr_matrix((vals, cols, rowst), \
+      shape=(len(t), len(ions)), dtype=float)
+    return AstonFrame(data.todense(), t, ions)
+
+
+def main(nscans=300, npts=100, repeat=3):
+    times, scans = random_ms_scans(nscans, npts)
+    rnd = np.random.RandomState(1)
+    # high resolution m/z's wander a little around each nominal mass
+    scans = [(mzs + rnd.uniform(-0.01, 0.01, len(mzs)), abns) \
+             for mzs, abns in scans]
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'DATA.CDF')
+    write_andi_ms(filename, times, scans)
+
+    # a new object each time, so nothing is cached between runs
+    new = lambda **kw: NetCDF(filename, lazy=False).read_window(**kw)
+    try:
+        old = old_data(filename)
+        srt = np.argsort(old.columns)
+        assert np.allclose(old.values[:, srt], new().values.toarray())
+        print('{} scans of {} points, {} distinct m/z\'s'.format(nscans, \
+              npts, len(old.columns)))
+        del old
+
+        old_t = min(timeit.repeat(lambda: old_data(filename), \
+                                  number=1, repeat=repeat))
+        for name, kw in (('all', {}), \
+                         ('binned to 0.1', {'mz_tol': 0.1}), \
+                         ('1 min window', {'twin': (10., 11.)})):
+            new_t = min(timeit.repeat(lambda: new(**kw), \
+                                      number=1, repeat=repeat))
+            print('{}: {:.1f} ms -> {:.1f} ms ({:.0f}x)'.format(name, \
+                  1e3 * old_t, 1e3 * new_t, old_t / new_t))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:3]])
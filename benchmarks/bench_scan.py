@@ -0,0 +1,76 @@
+"""
+Compares looking up one spectrum with ScanListFile.scan through the
+scan index against the previous walk through every scan before it,
+for mzML and MassHunter files, and merging a range of spectra (which
+used to return None).
+
+    python benchmarks/bench_scan.py [nscans] [npts]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import numpy as np
+from aston.tracefile.MZML import mzML
+from aston.tracefile.AgilentMS import AgilentMSMSScan
+from aston.test.SyntheticFiles import random_ms_scans, write_mzml, \
+                                      write_agilent_mh
+
+
+def old_scan(tf, t, dt=None, aggfunc=None):
+    """
+    The original ScanListFile.scan, kept here as a reference.
+    """
+    prev_s = None
+    bin_scans = []
+    for s in tf.scans():
+        if float(s.name) > t:
+            if float(prev_s.name) - t < float(s.name) - t:
+                if dt is None:
+                    return prev_s
+                else:
+                    bin_scans.append(prev_s)
+            elif dt is None:
+                return s
+            bin_scans.append(s)
+            if float(s.name) > t + dt:
+                break
+        prev_s = s
+    pass
+
+
+def main(nscans=2000, npts=200, repeat=3):
+    times, scans = random_ms_scans(nscans, npts)
+    tmpdir = tempfile.mkdtemp()
+    mzml_file = os.path.join(tmpdir, 'DATA.mzML')
+    write_mzml(mzml_file, times, scans)
+    mh_file = os.path.join(tmpdir, 'MSScan.bin')
+    mzs = np.linspace(40., 400., npts)
+    write_agilent_mh(mh_file, times, [(mzs, a) for _, a in scans])
+
+    # somewhere in the back half of the run, and a ~1 min window there
+    t, dt = times[int(0.75 * nscans)] + 1e-3, 1.
+    print('{} scans of {} points'.format(nscans, npts))
+    try:
+        for name, cls, filename in (('mzML', mzML, mzml_file), \
+                                    ('MassHunter', AgilentMSMSScan, mh_file)):
+            # build (and save) the index before timing anything
+            tf = cls(filename)
+            assert np.allclose(old_scan(tf, t).abn, tf.scan(t).abn)
+            old_t = min(timeit.repeat(lambda: old_scan(tf, t), \
+                                      number=1, repeat=repeat))
+            # a new object each time, so the index is loaded from disk
+            new_t = min(timeit.repeat(lambda: cls(filename).scan(t), \
+                                      number=1, repeat=repeat))
+            rng_t = min(timeit.repeat(lambda: cls(filename).scan(t, dt), \
+                                      number=1, repeat=repeat))
+            print('{}: {:.1f} ms -> {:.1f} ms ({:.0f}x), {} min range: ' \
+                  '{:.1f} ms'.format(name, 1e3 * old_t, 1e3 * new_t, \
+                                     old_t / new_t, dt, 1e3 * rng_t))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:3]])
@@ -0,0 +1,56 @@
+"""
+Times how long Aston takes to start: `astonx.py --version`, and the
+first call to file_type() in a fresh interpreter (which only needs the
+reader registry) compared with importing every reader through
+tfclasses() (which is what the first call used to do).
+
+    python benchmarks/bench_startup.py [repeat]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_CALL = """
+import sys, time
+t = time.time()
+from aston.tracefile.Common import file_type, tfclasses
+{}
+print('{{}} {{}}'.format(time.time() - t, len(sys.modules)))
+"""
+
+
+def run(code):
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+    secs, nmods = out.decode('ascii').split()
+    return float(secs), int(nmods)
+
+
+def main(repeat=5):
+    from aston.test.SyntheticFiles import random_ms_scans, write_agilent_ms
+
+    cmd = [sys.executable, os.path.join(ROOT, 'astonx.py'), '--version']
+    t = min(timeit.repeat(lambda: subprocess.check_output(cmd), \
+                          number=1, repeat=repeat))
+    print('astonx.py --version: {:.1f} ms'.format(1e3 * t))
+
+    fd, filename = tempfile.mkstemp(suffix='.MS')
+    os.close(fd)
+    try:
+        write_agilent_ms(filename, *random_ms_scans(5, 5))
+        for name, call in (('first file_type()', \
+                            'assert file_type({!r}) == "AgilentMS"'), \
+                           ('tfclasses()', 'tfclasses()')):
+            res = [run(FIRST_CALL.format(call.format(filename))) \
+                   for _ in range(repeat)]
+            print('{}: {:.1f} ms, {} modules loaded'.format(name, \
+                  1e3 * min(r[0] for r in res), res[0][1]))
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:2]])
@@ -0,0 +1,88 @@
+"""
+Compares reading Waters Autospec *.IDX/*.DAT files into a sparse frame
+against the previous struct.unpack loops (which looked up the column
+of every point with list.index), and reading only the TIC.
+
+    python benchmarks/bench_waters.py [nscans] [npts]
+"""
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import timeit
+import numpy as np
+from aston.trace.Trace import AstonFrame
+from aston.tracefile.Waters import WatersAutospec
+from aston.test.SyntheticFiles import random_ms_scans, write_waters_autospec
+
+
+def old_data(filename):
+    """
+    The original WatersAutospec.data, kept here as a reference.
+    """
+    fidx = open(filename, 'rb')
+    fdat = open(os.path.splitext(filename)[0] + '.DAT', 'rb')
+
+    ions = set([])
+    while True:
+        fdat.seek(fdat.tell() + 2)
+        try:
+            i = struct.unpack('<H', fdat.read(2))[0]
+        except struct.error:
+            break
+        ions.add(i)
+    ions = sorted(ions)
+
+    data = []
+    tme = []
+    while True:
+        try:
+            idx = struct.unpack('<IHHffhhh', fidx.read(22))
+            tme.append(idx[4])
+            fdat.seek(idx[0])
+            new_line = np.zeros(len(ions))
+            d = struct.unpack('<' + int(idx[1] / 4) * 'HH', \
+            fdat.read(idx[1]))
+            for i, v in zip(d[1::2], d[0::2]):
+                new_line[ions.index(i)] = v
+            data.append(new_line)
+        except struct.error:
+            break
+    fdat.close()
+    fidx.close()
+    return AstonFrame(np.array(data), np.array(tme), ions)
+
+
+def main(nscans=2000, npts=200, repeat=3):
+    times, scans = random_ms_scans(nscans, npts)
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'RUN.IDX')
+    write_waters_autospec(filename, times, scans)
+
+    # a new object each time, so nothing is cached between runs
+    new = lambda: WatersAutospec(filename, lazy=False).data
+    try:
+        old = old_data(filename)
+        assert np.allclose(old.values, new().values.toarray())
+        old_tic = old.trace('tic').values
+        del old
+
+        old_t = min(timeit.repeat(lambda: old_data(filename), \
+                                  number=1, repeat=repeat))
+        new_t = min(timeit.repeat(new, number=1, repeat=repeat))
+        print('{} scans of {} points'.format(nscans, npts))
+        print('data: {:.1f} ms -> {:.1f} ms ({:.0f}x)'.format(1e3 * old_t, \
+              1e3 * new_t, old_t / new_t))
+
+        tic = lambda: WatersAutospec(filename).total_trace()
+        assert np.allclose(old_tic, tic().values)
+        tic_t = min(timeit.repeat(tic, number=1, repeat=repeat))
+        print('TIC: {:.1f} ms -> {:.2f} ms ({:.0f}x)'.format(1e3 * old_t, \
+              1e3 * tic_t, old_t / tic_t))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:3]])